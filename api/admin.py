@@ -7,6 +7,7 @@ from .auctions.models import (
     AuctionTransaction,
     Bid,
     Category,
+    ProxyBid,
 )
 from .chats.models import Connection, Message
 from .users.models import User
@@ -21,6 +22,7 @@ admin.site.register(User)
 admin.site.register(Auction)
 admin.site.register(Category)
 admin.site.register(Bid)
+admin.site.register(ProxyBid)
 admin.site.register(AuctionImage)
 admin.site.register(AuctionTransaction)
 admin.site.register(AuctionReport)
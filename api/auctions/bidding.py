@@ -0,0 +1,433 @@
+"""Bid service shared by the WebSocket bid engine and the REST endpoint.
+
+A bid is accepted with a single conditional UPDATE on the auction price
+(``WHERE current_price = <price the bid was checked against>``, together with
+the bid_sequence it was checked against). When another writer moved the price
+first the UPDATE matches no row, the bid is checked again against the fresh
+price and retried, and the conflict is counted per auction so contention shows
+up in the metrics.
+
+Proxy bids hold the highest amount a bidder is willing to pay. Instead of
+replaying a bid war increment by increment, the proxies of an auction are
+resolved in one pass like a second price auction: the highest maximum wins at
+one increment above the runner-up, capped at its own maximum, so a war between
+any number of proxies ends in a single ledger entry and a single broadcast.
+"""
+
+import heapq
+import logging
+from dataclasses import dataclass, field
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+
+from api import metrics
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Auction, Bid, ProxyBid
+from .serializers import BidCreateSerializer, ProxyBidCreateSerializer
+
+logger = logging.getLogger(__name__)
+
+
+class BidRejected(Exception):
+    """Raised when a bid does not satisfy the auction rules.
+
+    retryable marks a refusal that says nothing about the bid itself, e.g. a
+    busy auction, which the same bid may pass when sent again.
+    """
+
+    def __init__(self, message, minimum=None, retryable=False):
+        super().__init__(message)
+        self.message = message
+        self.minimum = minimum
+        self.retryable = retryable
+
+
+class BidConflict(Exception):
+    """Raised when the auction price changed since the bid was checked."""
+
+
+@dataclass
+class AuctionState:
+    """The fields of an auction needed to check and commit a bid."""
+
+    auction_id: str
+    seller_id: str
+    category_id: int
+    status: str
+    end_time: object
+    current_price: Decimal
+    bid_increment: Decimal
+    # Number of bids accepted so far, stamped on the delta events
+    bid_sequence: int = 0
+    bid_count: int = 0
+    # current_price as stored in the database, used as the UPDATE condition
+    persisted_price: Decimal = None
+    # Bidder of the top bid and when it was placed, ties go to the earliest
+    leader_id: str = None
+    leader_since: object = None
+    # Proxy of every bidder that can still act on the price, by bidder id
+    proxies: dict = field(default_factory=dict)
+    soft_close_window: int = 0
+    soft_close_extension: int = 0
+
+    @classmethod
+    def load(cls, auction_id):
+        try:
+            auction = (
+                Auction.objects.select_related("top_bid")
+                .only(
+                    "id",
+                    "seller_id",
+                    "category_id",
+                    "status",
+                    "end_time",
+                    "current_price",
+                    "starting_price",
+                    "bid_increment",
+                    "bid_sequence",
+                    "bid_count",
+                    "soft_close_window",
+                    "soft_close_extension",
+                    "top_bid__bidder_id",
+                    "top_bid__placed_at",
+                )
+                .get(pk=auction_id)
+            )
+        except (Auction.DoesNotExist, ValidationError) as e:
+            raise BidRejected(f"Auction {auction_id} not found") from e
+
+        current_price = auction.current_price or auction.starting_price
+        proxies = ProxyBid.objects.filter(
+            auction_id=auction.pk, max_amount__gt=current_price
+        ).values_list("bidder_id", "max_amount", "updated_at")
+        top_bid = auction.top_bid
+
+        return cls(
+            auction_id=str(auction.pk),
+            seller_id=str(auction.seller_id),
+            category_id=auction.category_id,
+            status=auction.status,
+            end_time=auction.end_time,
+            current_price=current_price,
+            bid_increment=auction.bid_increment,
+            bid_sequence=auction.bid_sequence,
+            bid_count=auction.bid_count,
+            persisted_price=auction.current_price,
+            leader_id=str(top_bid.bidder_id) if top_bid else None,
+            leader_since=top_bid.placed_at if top_bid else None,
+            proxies={
+                str(bidder_id): Proxy(str(bidder_id), max_amount, updated_at)
+                for bidder_id, max_amount, updated_at in proxies
+            },
+            soft_close_window=auction.soft_close_window,
+            soft_close_extension=auction.soft_close_extension,
+        )
+
+    @property
+    def minimum_bid(self):
+        return self.current_price + self.bid_increment
+
+    def apply(self, bid):
+        """Move the state past an accepted bid."""
+        self.current_price = bid.amount
+        self.bid_sequence = bid.sequence
+        self.bid_count = bid.bid_count
+        self.leader_id = bid.bidder_id
+        self.leader_since = bid.placed_at
+        if bid.end_time is not None:
+            self.end_time = bid.end_time
+
+
+@dataclass
+class Proxy:
+    """The maximum a bidder lets the engine bid for them."""
+
+    bidder_id: str
+    max_amount: Decimal
+    # When the maximum was last set, ties go to the earliest
+    placed_at: object
+
+
+@dataclass
+class AcceptedBid:
+    """A bid that passed the auction rules."""
+
+    auction_id: str
+    category_id: int
+    bidder_id: str
+    amount: Decimal
+    previous_price: Decimal
+    placed_at: object
+    sequence: int
+    bid_count: int
+    # New end_time of the auction when the bid triggered the soft close
+    end_time: object = None
+
+
+def check_bid(state, bidder, amount=None):
+    """Check a bid against the auction state and return it as an AcceptedBid.
+
+    Without an amount the bid is the next increment over the current price,
+    otherwise the amount is validated like BidCreateSerializer does.
+    """
+    now = _check_open(state, bidder)
+
+    if amount is None:
+        amount = state.minimum_bid
+    else:
+        try:
+            Decimal(str(amount))
+        except (InvalidOperation, ValueError) as e:
+            raise BidRejected("Invalid bid amount", state.minimum_bid) from e
+
+        # The state quacks like an auction for validate_amount
+        serializer = BidCreateSerializer(
+            data={"amount": str(amount)}, context={"auction": state}
+        )
+        if not serializer.is_valid():
+            message = serializer.errors["amount"][0]
+            raise BidRejected(str(message), state.minimum_bid)
+        amount = serializer.validated_data["amount"]
+
+    return _accept(state, str(bidder.pk), amount, now)
+
+
+def check_proxy(state, bidder, max_amount):
+    """Check a proxy maximum against the auction state and return it as a Proxy.
+
+    The leader only has to stay at or above the current price, anyone else has
+    to be able to outbid it.
+    """
+    now = _check_open(state, bidder)
+    bidder_id = str(bidder.pk)
+    if bidder_id == state.leader_id:
+        minimum = state.current_price
+    else:
+        minimum = state.minimum_bid
+
+    serializer = ProxyBidCreateSerializer(
+        data={"max_amount": str(max_amount)}, context={"minimum": minimum}
+    )
+    if not serializer.is_valid():
+        message = serializer.errors["max_amount"][0]
+        raise BidRejected(str(message), minimum)
+
+    return Proxy(bidder_id, serializer.validated_data["max_amount"], now)
+
+
+def resolve_proxies(state):
+    """Return the single bid the proxies place against the standing price.
+
+    The leader counts with the larger of its top bid and its proxy, every other
+    proxy that can outbid the current price is a challenger. The two highest
+    maxima decide the outcome: the highest wins at one increment above the
+    runner-up, capped at its own maximum. Returns None when no challenger can
+    move the price.
+    """
+    price = state.current_price
+    minimum = state.minimum_bid
+
+    candidates = []
+    for proxy in state.proxies.values():
+        if proxy.bidder_id == state.leader_id:
+            continue
+        if proxy.max_amount >= minimum:
+            candidates.append((proxy.max_amount, proxy.placed_at, proxy.bidder_id))
+    if not candidates:
+        return None
+
+    if state.leader_id is not None:
+        leader_max = price
+        leader = state.proxies.get(state.leader_id)
+        if leader is not None and leader.max_amount > price:
+            leader_max = leader.max_amount
+        candidates.append((leader_max, state.leader_since, state.leader_id))
+
+    # Highest maximum first, the earliest one wins a tie
+    top = heapq.nsmallest(2, candidates, key=lambda c: (-c[0], c[1]))
+    max_amount, _, bidder_id = top[0]
+
+    if len(top) > 1:
+        amount = min(max_amount, top[1][0] + state.bid_increment)
+    else:
+        amount = minimum
+
+    if bidder_id == state.leader_id and amount <= price:
+        return None
+
+    return _accept(state, bidder_id, max(amount, minimum), timezone.now())
+
+
+def accept_bid(state, bidder, amount=None):
+    """Check a bid, let the proxies answer it and return the bids to commit.
+
+    The state is moved past every returned bid, the last one holds the price
+    the auction ends up at.
+    """
+    bid = check_bid(state, bidder, amount)
+    state.apply(bid)
+
+    bids = [bid]
+    answer = resolve_proxies(state)
+    if answer is not None:
+        state.apply(answer)
+        bids.append(answer)
+    return bids
+
+
+def accept_proxy(state, bidder, max_amount):
+    """Check and store a proxy, returning it with the bid it places, if any."""
+    proxy = check_proxy(state, bidder, max_amount)
+    state.proxies[proxy.bidder_id] = proxy
+
+    bids = []
+    answer = resolve_proxies(state)
+    if answer is not None:
+        state.apply(answer)
+        bids.append(answer)
+    return proxy, bids
+
+
+def _check_open(state, bidder):
+    now = timezone.now()
+
+    if state.status != Auction.Status.ONGOING or now >= state.end_time:
+        raise BidRejected("Auction is not open for bidding")
+
+    if str(bidder.pk) == state.seller_id:
+        raise BidRejected("Sellers cannot bid on their own auctions")
+
+    return now
+
+
+def _accept(state, bidder_id, amount, now):
+    return AcceptedBid(
+        auction_id=state.auction_id,
+        category_id=state.category_id,
+        bidder_id=bidder_id,
+        amount=amount,
+        previous_price=state.current_price,
+        placed_at=now,
+        sequence=state.bid_sequence + 1,
+        bid_count=state.bid_count + 1,
+        end_time=_soft_close(state, now),
+    )
+
+
+def _soft_close(state, now):
+    """Return the end_time a bid placed now pushes the auction to, if any.
+
+    A bid in the last soft_close_window seconds leaves at least
+    soft_close_extension seconds to answer it, so bids placed together, like a
+    bid and the answer of the proxies, do not add up their extensions.
+    """
+    if not state.soft_close_window or not state.soft_close_extension:
+        return None
+    if state.end_time - now > timedelta(seconds=state.soft_close_window):
+        return None
+
+    end_time = now + timedelta(seconds=state.soft_close_extension)
+    return end_time if end_time > state.end_time else None
+
+
+def commit_bids(auction_id, expected_price, expected_sequence, bids, proxies=()):
+    """Append bids on one auction to the ledger if its price is unchanged.
+
+    bids are ordered, the last one carries the new price and sequence and
+    becomes the top bid of the auction. proxies are saved in the same
+    transaction. Raises BidConflict, and writes nothing, when another writer
+    changed the price first.
+    """
+    with transaction.atomic():
+        for proxy in proxies:
+            _save_proxy(auction_id, proxy)
+
+        if bids:
+            _append_bids(auction_id, expected_price, expected_sequence, bids)
+
+    metrics.increment("bids_accepted", len(bids))
+
+
+def _save_proxy(auction_id, proxy):
+    updated = ProxyBid.objects.filter(
+        auction_id=auction_id, bidder_id=proxy.bidder_id
+    ).update(max_amount=proxy.max_amount, updated_at=proxy.placed_at)
+    if not updated:
+        ProxyBid.objects.create(
+            auction_id=auction_id,
+            bidder_id=proxy.bidder_id,
+            max_amount=proxy.max_amount,
+        )
+
+
+def _append_bids(auction_id, expected_price, expected_sequence, bids):
+    *earlier, last = bids
+
+    if earlier:
+        Bid.objects.bulk_create(
+            Bid(auction_id=auction_id, bidder_id=bid.bidder_id, amount=bid.amount)
+            for bid in earlier
+        )
+    top_bid = Bid.objects.create(
+        auction_id=auction_id, bidder_id=last.bidder_id, amount=last.amount
+    )
+
+    changes = {}
+    extended = [bid.end_time for bid in bids if bid.end_time is not None]
+    if extended:
+        changes["end_time"] = max(extended)
+
+    updated = Auction.objects.filter(
+        pk=auction_id,
+        status=Auction.Status.ONGOING,
+        current_price=expected_price,
+        bid_sequence=expected_sequence,
+    ).update(
+        current_price=last.amount,
+        bid_sequence=last.sequence,
+        bid_count=F("bid_count") + len(bids),
+        top_bid=top_bid,
+        **changes,
+    )
+
+    if not updated:
+        metrics.increment_top("bid_conflicts", "auction", auction_id)
+        logger.warning(f"Bid conflict on auction {auction_id}")
+        # Rolls back the ledger rows written above
+        raise BidConflict(auction_id)
+
+
+def reject(auction_id, error):
+    """Count a rejected bid and hand the error back for raising."""
+    metrics.increment_top("bids_rejected", "auction", auction_id)
+    return error
+
+
+def place_bid(auction_id, bidder, amount=None):
+    """Check and commit a single bid, retrying when the price moved.
+
+    Returns the committed bids, the bid itself followed by the answer of the
+    proxies when they outbid it.
+    """
+    for attempt in range(settings.BID_CONFLICT_RETRIES + 1):
+        try:
+            state = AuctionState.load(auction_id)
+            sequence = state.bid_sequence
+            bids = accept_bid(state, bidder, amount)
+        except BidRejected as e:
+            raise reject(auction_id, e)
+
+        try:
+            commit_bids(state.auction_id, state.persisted_price, sequence, bids)
+            return bids
+        except BidConflict:
+            continue
+
+    raise reject(
+        auction_id, BidRejected("Auction is busy, please try again", retryable=True)
+    )
@@ -0,0 +1,90 @@
+"""Tick-based coalescing of hot auction broadcasts.
+
+Bid deltas are not sent to the channel layer as they are accepted. The first
+delta of an auction opens a window of BROADCAST_COALESCE_WINDOW_MS; deltas
+accepted during the window replace the pending one, and when the window closes
+only the newest state is sent, with ``merged`` set to the number of bids it
+stands for. A quiet auction still gets every bid, at most one window late,
+while a hot one sends one message per window whatever its bid rate.
+
+The coalescer lives on the event loop of the server process, where the
+consumers await it.
+"""
+
+import asyncio
+import logging
+from dataclasses import dataclass
+
+from api import metrics
+from api.realtime.codecs import broadcast_event
+from api.realtime.hub import group_send
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _Pending:
+    key: str
+    groups: list
+    source: str
+    data: dict
+    merged: int = 1
+
+
+class BroadcastCoalescer:
+    """Merges broadcasts sharing a key until the current tick is flushed."""
+
+    def __init__(self, window=None):
+        if window is None:
+            window = settings.BROADCAST_COALESCE_WINDOW_MS / 1000
+        self.window = window
+        self._pending = {}
+        self._flush_task = None
+
+    async def submit(self, channel_layer, key, groups, source, data):
+        """Queue data for the groups, replacing an older update for key."""
+        if self.window <= 0:
+            merged = data.get("merged", 1)
+            await self._send(channel_layer, _Pending(key, groups, source, data, merged))
+            return
+
+        # An update may already stand for several bids committed together
+        merged = data.get("merged", 1)
+        pending = self._pending.get(key)
+        if pending is None:
+            self._pending[key] = _Pending(key, groups, source, data, merged)
+        else:
+            # Keep the newest state, bids may reach us out of order
+            if data.get("seq", 0) >= pending.data.get("seq", 0):
+                pending.data = data
+                pending.groups = groups
+            pending.merged += merged
+
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.ensure_future(self._flush(channel_layer))
+
+    async def _flush(self, channel_layer):
+        # Until nothing is left: an update submitted while a tick is being sent
+        # finds this task still running and relies on it for the next tick
+        while self._pending:
+            await asyncio.sleep(self.window)
+            pending, self._pending = self._pending, {}
+
+            for update in pending.values():
+                if update.merged > 1:
+                    metrics.increment("broadcasts_coalesced", update.merged - 1)
+                try:
+                    await self._send(channel_layer, update)
+                except Exception as e:
+                    logger.error(f"Error broadcasting message: {str(e)}")
+
+    async def _send(self, channel_layer, update):
+        event = broadcast_event(
+            update.source, dict(update.data, merged=update.merged), key=update.key
+        )
+        for group in update.groups:
+            await group_send(channel_layer, group, event)
+
+
+broadcast_coalescer = BroadcastCoalescer()
@@ -1,23 +1,42 @@
+import asyncio
 import base64
-import json
 import logging
 import os
 
 import jwt
-from asgiref.sync import async_to_sync
-from channels.generic.websocket import WebsocketConsumer
+from api import metrics
+from api.realtime.codecs import broadcast_event
+from api.realtime.consumers import HandlerError, RealtimeConsumer, parse_since
+from api.realtime.hub import group_send
+from api.realtime.idempotency import idempotency_key, idempotency_store
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.core.exceptions import ObjectDoesNotExist
+from django.core.exceptions import ObjectDoesNotExist, ValidationError
 from django.core.files.base import ContentFile
 from django.db import transaction
-from django.db.models import Count, Q
-
+from django.db.models import F, Q
+
+from .bidding import BidRejected
+from .coalescer import broadcast_coalescer
+from .engine import bid_engine
+from .events import auction_extended_event, new_bid_event
+from .groups import (
+    auction_group,
+    bid_groups,
+    category_group,
+    lifecycle_groups,
+    new_auction_groups,
+    parse_auction_id,
+    parse_category,
+)
 from .models import Auction, AuctionImage, Bid
 from .serializers import (
     AuctionCreateSerializer,
     AuctionSerializer,
     AuctionUpdateSerializer,
+    BidSerializer,
 )
 
 logger = logging.getLogger(__name__)
@@ -25,18 +44,30 @@ logger = logging.getLogger(__name__)
 MODE = settings.ENVIRONMENT
 
 
-class AuctionConsumer(WebsocketConsumer):
-    """WebSocket consumer for handling auction-related real-time communication."""
+class AuctionConsumer(RealtimeConsumer):
+    """WebSocket consumer for handling auction-related real-time communication.
+
+    Frames are handled on the event loop: the ORM work of a handler runs in a
+    single database_sync_to_async call and channel layer calls are awaited, so
+    a connection only holds a thread while it is actually in the database.
+    """
 
-    GROUP_NAME = "auction"  # Constant for group name
+    endpoint = "auctions"
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.user = None
         self.username = None
         self.AUCTION_LIMIT = 10
-
-    def connect(self):
+        self.subscriptions = set()
+        # Frames sent back for the request being handled, None when not tracked
+        self._replies = None
+        # Whether its outcome is transient, not to be replayed to a retry
+        self._retryable = False
+        # Whether it timed out in the bid engine, which may still commit it
+        self._in_doubt = False
+
+    async def connect(self):
         """Authenticate and establish WebSocket connection."""
         print("reach socket")
 
@@ -45,53 +76,101 @@ class AuctionConsumer(WebsocketConsumer):
             if not token:
                 raise ValueError("No authentication token provided")
 
-            self.user = self._authenticate_token(token)
+            self.user = await self._authenticate_token(token)
             if not self.user:
                 raise ValueError("Invalid authentication credentials")
 
-            self._initialize_connection()
-            self._join_group()
+            await self._initialize_connection()
             logger.info(f"✅ Authenticated WebSocket connection for user: {self.user}")
-            logger.info(f"{self.username} joined auction group.")
 
         except Exception as e:
             logger.error(f"🚨 WebSocket connection failed: {str(e)}")
-            self.close()
+            await self.close()
 
-    def disconnect(self, close_code):
+    async def disconnect(self, close_code):
         """Clean up on WebSocket disconnect."""
         if hasattr(self, "username") and self.username:
-            self._leave_group()
+            await self.group_discard(self.username)
+            await self._leave_group()
             logger.info(f"User {self.username} disconnected with code: {close_code}")
 
-    def receive(self, text_data):
+    async def receive_json(self, content, **kwargs):
         """Handle incoming WebSocket messages."""
         try:
-            data = self._parse_message(text_data)
-            handler = self._get_message_handler(data.get("source"))
-            if handler:
-                handler(data)
+            if not isinstance(content, dict):
+                raise ValueError("Message must be a JSON object")
+
+            handler = self._get_message_handler(content.get("source"))
+            if not handler:
+                await self._send_error("Unsupported message type")
+            elif content.get("requestId"):
+                await self._handle_idempotent(handler, content)
             else:
-                self._send_error("Unsupported message type")
+                await handler(content)
 
-        except json.JSONDecodeError:
-            self._send_error("Invalid message format")
+        except HandlerError as e:
+            await self._send_error(e.message)
         except Exception as e:
             logger.error(f"Error processing message: {str(e)}")
-            self._send_error("Internal server error")
+            await self._send_error("Internal server error")
+
+    async def _handle_idempotent(self, handler, data):
+        """Run handler once per requestId, replaying its replies to retries."""
+        request_id = data["requestId"]
+        key = idempotency_key(self.user.pk, data.get("source"), request_id)
+
+        # The store may go through a shared cache, keep it off the event loop
+        claimed, frames = await sync_to_async(
+            idempotency_store.claim, thread_sensitive=False
+        )(key)
+        if not claimed:
+            if frames is None:
+                await self._send_frame(
+                    {"source": "request_in_progress", "data": {"requestId": request_id}}
+                )
+                return
+            metrics.increment("idempotent_replays", source=data.get("source"))
+            for frame in frames:
+                await self._send_frame(frame)
+            return
+
+        self._replies = []
+        self._retryable = False
+        self._in_doubt = False
+        try:
+            try:
+                await handler(data)
+            except HandlerError as e:
+                await self._send_error(e.message)
+        except Exception:
+            await sync_to_async(idempotency_store.release, thread_sensitive=False)(key)
+            raise
+        else:
+            if self._in_doubt:
+                # Kept pending, a retry placing the bid twice is told the
+                # request is in progress until the claim expires
+                logger.warning(f"Request {request_id} timed out in the bid engine")
+            elif self._retryable:
+                # The retry the reply asks for must run the handler again
+                await sync_to_async(idempotency_store.release, thread_sensitive=False)(
+                    key
+                )
+            else:
+                await sync_to_async(idempotency_store.complete, thread_sensitive=False)(
+                    key, self._replies
+                )
+        finally:
+            self._replies = None
+
+    def _record_reply(self, frame):
+        if self._replies is not None:
+            self._replies.append(frame)
 
     # ----------------------
     #  Authentication Helpers
     # ----------------------
 
-    def _extract_token(self):
-        """Extract token from query string."""
-        query_string = self.scope["query_string"].decode()
-        if "tokens=" in query_string:
-            return query_string.split("tokens=")[-1]
-        return None
-
-    def _authenticate_token(self, token):
+    async def _authenticate_token(self, token):
         """Validate JWT token and return user."""
         try:
             payload = jwt.decode(
@@ -102,7 +181,10 @@ class AuctionConsumer(WebsocketConsumer):
             )
             # print('auction verif: ',payload["user_id"])
 
-            return get_user_model().objects.get(pk=payload["user_id"])
+            user = await get_user_model().objects.aget(pk=payload["user_id"])
+            # Closed when the token expires, unless a refresh_token comes first
+            self.arm_expiry(payload.get("exp"))
+            return user
         except jwt.ExpiredSignatureError:
             print("🚨 Token expired")
         except jwt.DecodeError:
@@ -117,42 +199,40 @@ class AuctionConsumer(WebsocketConsumer):
     #  Group Management
     # ----------------------
 
-    def _initialize_connection(self):
+    async def _initialize_connection(self):
         """Set up user connection and groups."""
         self.scope["user"] = self.user
         self.username = self.user.username
 
         # Join user to their personal group
-        async_to_sync(self.channel_layer.group_add)(self.username, self.channel_name)
-        self.accept()
-
-    def _join_group(self):
-        """Add connection to auction group."""
-
-        # Join common auction broadcast group
-        async_to_sync(self.channel_layer.group_add)(self.GROUP_NAME, self.channel_name)
-
-        # self.accept()
-
-    def _leave_group(self):
-        """Remove connection from auction group."""
-        async_to_sync(self.channel_layer.group_discard)(
-            self.GROUP_NAME, self.channel_name
-        )
+        await self.group_add(self.username)
+        await self.register_connection(self.user)
+        await self.accept()
+        await self.resume(self.username)
+
+    async def _join_group(self, group):
+        """Subscribe the connection to an auction or category group."""
+        if group in self.subscriptions:
+            return True
+        if len(self.subscriptions) >= settings.WS_MAX_SUBSCRIPTIONS:
+            return False
+
+        await self.group_add(group)
+        self.subscriptions.add(group)
+        return True
+
+    async def _leave_group(self, group=None):
+        """Unsubscribe from one group, or from all of them when none is given."""
+        groups = [group] if group else list(self.subscriptions)
+        for name in groups:
+            if name in self.subscriptions:
+                await self.group_discard(name)
+                self.subscriptions.discard(name)
 
     # ----------------------
     #  Message Handlers
     # ----------------------
 
-    def _parse_message(self, text_data):
-        """Parse and validate incoming message."""
-        data = json.loads(text_data)
-        # print('client receive data: ', json.dumps(data, indent=2))
-        # print('client receive data: ', data)
-        if not isinstance(data, dict):
-            raise ValueError("Message must be a JSON object")
-        return data
-
     def _get_message_handler(self, message_type):
         """Get appropriate handler for message type."""
         handlers = {
@@ -160,6 +240,9 @@ class AuctionConsumer(WebsocketConsumer):
             "FetchAuctionsListByCategory": self._handle_fetch_auctions_list_by_category,
             "create_auction": self._handle_create_auction,
             "place_bid": self._handle_place_bid,
+            "set_proxy_bid": self._handle_set_proxy_bid,
+            "fetch_auction": self._handle_fetch_auction,
+            "fetch_bid_history": self._handle_fetch_bid_history,
             "watch_auction": self._handle_watch_auction,
             "delete_auction": self._handle_delete_auction,
             "edit_auction": self._handle_edit_auction,
@@ -171,62 +254,119 @@ class AuctionConsumer(WebsocketConsumer):
             "bidsAuctions": self._handle_fetch_bids_auctions,
             "salesAuctions": self._handle_fetch_sales_auctions,
             "my_auctions": self._handle_my_auctions,
+            "subscribe": self._handle_subscribe,
+            "unsubscribe": self._handle_unsubscribe,
         }
         return handlers.get(message_type)
 
-    def _handle_search(self, data):
+    def _parse_subscription_groups(self, data):
+        """Map the auction_id / category of a (un)subscribe request to groups."""
+        data = data.get("data", {})
+        groups = []
+
+        if "auction_id" in data:
+            auction_id = parse_auction_id(data["auction_id"])
+            if not auction_id:
+                raise HandlerError(f"Invalid auction_id {data['auction_id']}")
+            groups.append(auction_group(auction_id))
+
+        if "category" in data:
+            try:
+                groups.append(category_group(parse_category(data["category"])))
+            except (TypeError, ValueError):
+                raise HandlerError(f"Invalid category {data['category']}")
+
+        return groups
+
+    async def _handle_subscribe(self, data):
+        """Join the groups of an open auction detail screen or feed.
+
+        With a ``since`` seq, or one given at connect, the events of each
+        joined group after it are sent once subscribed.
+        """
+        try:
+            since = parse_since(data.get("data", {}).get("since"))
+        except (TypeError, ValueError):
+            raise HandlerError("Invalid since")
+
+        joined = []
+        for group in self._parse_subscription_groups(data):
+            if group in self.subscriptions:
+                continue
+            if not await self._join_group(group):
+                await self._send_error(
+                    f"Subscription limit of {settings.WS_MAX_SUBSCRIPTIONS} reached"
+                )
+                break
+            joined.append(group)
+
+        await self._send_subscriptions()
+        for group in joined:
+            await self.resume(group, since)
+
+    async def _handle_unsubscribe(self, data):
+        """Leave the groups of a closed auction detail screen or feed."""
+        for group in self._parse_subscription_groups(data):
+            await self._leave_group(group)
+
+        await self._send_subscriptions()
+
+    async def _handle_search(self, data):
         """Process auction search requests."""
         query = data.get("query", "").strip()
 
         # print('handle search: ',query)
         if not query:
-            self._send_error("Empty search query")
+            await self._send_error("Empty search query")
             return
 
-        auctions = self._search_auctions(query)
-        # print('search auctions: ',auctions)
-
-        serialized = AuctionSerializer(auctions, context={"user": self.user}, many=True)
-        # print('serialized data: ',serialized.data)
-
-        self._send_search_results(serialized.data)
+        results = await self._search_auctions(query)
+        await self._send_search_results(results)
 
+    @database_sync_to_async
     def _search_auctions(self, query):
-        """Perform auction search query."""
+        """Perform auction search query and serialize the results."""
 
         # print('search auction: ',query)
-        return Auction.objects.filter(
-            Q(title__istartswith=query) | Q(title__icontains=query)
-        ).exclude(seller=self.user)
+        auctions = (
+            Auction.objects.with_top_bid()
+            .filter(Q(title__istartswith=query) | Q(title__icontains=query))
+            .exclude(seller=self.user)
+        )
 
-    def _handle_fetch_auctions_list_by_category(self, data):
+        return AuctionSerializer(auctions, context={"user": self.user}, many=True).data
+
+    async def _handle_fetch_auctions_list_by_category(self, data):
         """Fetches a filtered list of auctions using optional filters."""
-        user = self.user
         request_data = data.get("data", {})
+        page = request_data.get("page", 1)
+
+        auctions, next_page = await self._fetch_auctions_list(request_data, page)
+
+        await self._broadcast_to_user(
+            "auctionsList",
+            {
+                "auctions": auctions,
+                "nextPage": next_page,
+                "loaded": page != 1,
+            },
+        )
 
+    @database_sync_to_async
+    def _fetch_auctions_list(self, request_data, page):
         category = request_data.get("category")
         price = request_data.get("price")
         item_condition = request_data.get("itemCondition")
         popularity = request_data.get("popularity")
         posting_time = request_data.get("postingTime")
 
-        page = request_data.get("page", 1)
-        page_size = 10
-        start = (page - 1) * page_size
-        end = page * page_size + 1  # Fetch one extra to detect next page
-
         # Base queryset: exclude the seller's own auctions
-        base_qs = Auction.objects.active().exclude(seller=user)
+        base_qs = Auction.objects.active().exclude(seller=self.user)
 
-        # print("reach ", category)
         # Category filter
         if category and category.get("value") != "All":
-            # print("reach ")
-
             base_qs = base_qs.filter(category__id=category["key"])
 
-            # print("auctions: ",base_qs)
-
         # Price sorting
         if price == "asc":
             base_qs = base_qs.order_by("current_price")
@@ -237,13 +377,11 @@ class AuctionConsumer(WebsocketConsumer):
         if item_condition:
             base_qs = base_qs.filter(item_condition=item_condition)
 
-        # Popularity sorting
+        # Popularity sorting, backed by the denormalized counters
         if popularity == "mostLikes":
-            base_qs = base_qs.annotate(num_watchers=Count("watchers")).order_by(
-                "-num_watchers"
-            )
+            base_qs = base_qs.order_by("-watcher_count")
         elif popularity == "mostBids":
-            base_qs = base_qs.annotate(num_bids=Count("bid")).order_by("-num_bids")
+            base_qs = base_qs.order_by("-bid_count")
 
         # Posting time sorting
         if posting_time == "newest":
@@ -251,171 +389,301 @@ class AuctionConsumer(WebsocketConsumer):
         elif posting_time == "oldest":
             base_qs = base_qs.order_by("created_at")
 
-        # print("auctions: ",base_qs)
+        return self._serialize_page(base_qs, page)
 
-        results = list(base_qs[start:end])
-        has_next = len(results) > page_size
-        paginated = results[:page_size]
+    def _serialize_page(self, queryset, page, page_size=10):
+        """Serialize one page of auctions and return it with the next page."""
+        start = (page - 1) * page_size
+        end = page * page_size + 1  # Fetch one extra to detect next page
 
-        serialized = AuctionSerializer(paginated, context={"user": user}, many=True)
-        next_page = page + 1 if has_next else None
+        results = list(queryset.with_top_bid()[start:end])
+        has_next = len(results) > page_size
 
-        self._broadcast_to_user(
-            "auctionsList",
-            {
-                "auctions": serialized.data,
-                "nextPage": next_page,
-                "loaded": page != 1,
-            },
+        paginated = results[:page_size]  # Trim the extra item if it exists
+        serialized = AuctionSerializer(
+            paginated, context={"user": self.user}, many=True
         )
+        return serialized.data, page + 1 if has_next else None
 
-    def _handle_create_auction(self, data):
-        user = self.user
+    async def _handle_create_auction(self, data):
         data = data.get("data")
         images = data.pop("image", [])
 
-        count = Auction.objects.filter(seller=user).count()
-        # print("count: ", count)
-        if count >= self.AUCTION_LIMIT:
-            return ValueError("Auction limit reached")
-
         if not isinstance(images, list):
             raise ValueError("Image data must be a list")
         if len(images) > 3:
             raise ValueError("You can upload a maximum of 3 images")
 
-        # Wrap everything in a transaction
         try:
-            # Atomic operations (all succeeds or all fails)
-            # Wrapped the entire operation in transaction.atomic() so if image saving fails, the auction creation is rolled back
-            with transaction.atomic():
-                # Create auction
-                serializer = AuctionCreateSerializer(data=data, context={"user": user})
-
-                if not serializer.is_valid():
-                    error_msg = "Auction validation failed: " + str(serializer.errors)
-                    raise ValueError(error_msg)
-
-                new_auction = serializer.save()
-
-                # Validate image data first before creating auction
-                for idx, img_data in enumerate(images):
-                    if not img_data.get("uri") or not img_data.get("fileName"):
-                        raise ValueError(
-                            f"Image at index {idx} is missing required data"
-                        )
-
-                    try:
-                        base64_data = img_data.get("uri")
-                        if "," in base64_data:
-                            base64_data = base64_data.split(",")[1]
-                        image_data = base64.b64decode(base64_data)
-                    except (base64.binascii.Error, AttributeError) as e:
-                        raise ValueError(
-                            f"Invalid base64 image data at index {idx}"
-                        ) from e
-
-                    # Save auction image
-                    try:
-                        image_file = ContentFile(
-                            image_data, name=img_data.get("fileName")
-                        )
-                        AuctionImage.objects.create(
-                            auction=new_auction, image=image_file, is_primary=(idx == 0)
-                        )
-                        # AuctionImage.save()
-                    except Exception as e:
-                        raise ValueError(
-                            f"Failed to save auction image: {str(e)}"
-                        ) from e
-
-                # Serialize the created auction
-                broadcast_data = AuctionSerializer(
-                    new_auction, context={"user": user}, many=False
-                ).data
-
-                # Broadcast to all connected users in the group
-                self._broadcast_group("new_auction", broadcast_data)
-
-                # return new_auction
-
+            new_auction, broadcast_data = await self._create_auction(data, images)
+        except HandlerError:
+            raise
         except Exception as e:
             # Log the full error here if needed
             print(f"Error in auction creation: {str(e)}")
             raise  # Re-raise the exception after logging
 
-    def _handle_place_bid(self, data):
+        # Recorded for a retry of the request to get it again
+        await self._broadcast_to_user("auction_created", broadcast_data)
+        # Broadcast to the users browsing the auction's category
+        await self._broadcast_group(
+            "new_auction", broadcast_data, new_auction_groups(new_auction)
+        )
+
+    @database_sync_to_async
+    def _create_auction(self, data, images):
+        user = self.user
+
+        count = Auction.objects.filter(seller=user).count()
+        if count >= self.AUCTION_LIMIT:
+            raise HandlerError("Auction limit reached")
+
+        # Atomic operations (all succeeds or all fails)
+        # Wrapped the entire operation in transaction.atomic() so if image saving fails, the auction creation is rolled back
+        with transaction.atomic():
+            # Create auction
+            serializer = AuctionCreateSerializer(data=data, context={"user": user})
+
+            if not serializer.is_valid():
+                error_msg = "Auction validation failed: " + str(serializer.errors)
+                raise ValueError(error_msg)
+
+            new_auction = serializer.save()
+
+            # Validate image data first before creating auction
+            for idx, img_data in enumerate(images):
+                if not img_data.get("uri") or not img_data.get("fileName"):
+                    raise ValueError(f"Image at index {idx} is missing required data")
+
+                try:
+                    base64_data = img_data.get("uri")
+                    if "," in base64_data:
+                        base64_data = base64_data.split(",")[1]
+                    image_data = base64.b64decode(base64_data)
+                except (base64.binascii.Error, AttributeError) as e:
+                    raise ValueError(f"Invalid base64 image data at index {idx}") from e
+
+                # Save auction image
+                try:
+                    image_file = ContentFile(image_data, name=img_data.get("fileName"))
+                    AuctionImage.objects.create(
+                        auction=new_auction, image=image_file, is_primary=(idx == 0)
+                    )
+                except Exception as e:
+                    raise ValueError(f"Failed to save auction image: {str(e)}") from e
+
+        # Serialize the created auction
+        broadcast_data = AuctionSerializer(
+            new_auction, context={"user": user}, many=False
+        ).data
+        return new_auction, broadcast_data
+
+    async def _handle_place_bid(self, data):
 
         user = self.user
         data = data.get("data")
         auction_id = data.get("auction_id")
-        current_price = data.get("current_price")
+        # Optional jump bid, otherwise the engine bids the next increment
+        amount = data.get("amount")
 
+        # The owning shard checks the bid against its in-memory price, so the
+        # price the client last saw is not trusted anymore.
+        try:
+            bids = await self._engine_result(
+                bid_engine.submit(auction_id, user, amount)
+            )
+        except BidRejected as e:
+            await self._send_bid_rejected(auction_id, e)
+            return
+        except Exception as e:
+            logger.exception(f"Error while placing bid: {str(e)}")
+            self._retryable = True
+            await self._send_error("Failed to place bid.")
+            return
+
+        # Recorded for a retry of the request to get it again
+        await self._broadcast_to_user(
+            "bid_accepted",
+            {
+                "auction_id": auction_id,
+                "amount": str(bids[0].amount),
+                "seq": bids[0].sequence,
+            },
+        )
+        await self._broadcast_bids(bids)
+
+    async def _handle_set_proxy_bid(self, data):
+        """Let the engine bid for the user up to a maximum amount."""
+        user = self.user
+        data = data.get("data")
+        auction_id = data.get("auction_id")
+        max_amount = data.get("max_amount")
+
+        try:
+            proxy, bids = await self._engine_result(
+                bid_engine.submit_proxy(auction_id, user, max_amount)
+            )
+        except BidRejected as e:
+            await self._send_bid_rejected(auction_id, e)
+            return
+        except Exception as e:
+            logger.exception(f"Error while setting proxy bid: {str(e)}")
+            self._retryable = True
+            await self._send_error("Failed to set proxy bid.")
+            return
+
+        await self._broadcast_to_user(
+            "proxy_bid_set",
+            {"auction_id": auction_id, "max_amount": str(proxy.max_amount)},
+        )
+        if bids:
+            await self._broadcast_bids(bids)
+
+    async def _engine_result(self, future):
+        """Wait for a bid engine Future without blocking the event loop."""
+        try:
+            return await asyncio.wait_for(
+                asyncio.wrap_future(future), settings.BID_ENGINE_TIMEOUT
+            )
+        except asyncio.TimeoutError:
+            # Cancelled only when its shard had not started on it yet
+            self._in_doubt = not future.cancelled()
+            raise
+
+    async def _send_bid_rejected(self, auction_id, error):
+        self._retryable = error.retryable
+        await self._broadcast_to_user(
+            "bid_rejected",
+            {
+                "auction_id": auction_id,
+                "message": error.message,
+                "minimum": str(error.minimum) if error.minimum is not None else None,
+            },
+        )
+
+    async def _broadcast_bids(self, bids):
+        """Broadcast the price reached by bids committed together."""
+        bid = bids[-1]
+        if bid.bidder_id == str(self.user.pk):
+            bidder = self.user
+        else:
+            # Placed by a proxy on behalf of another bidder
+            bidder = await get_user_model().objects.aget(pk=bid.bidder_id)
+
+        # Broadcast only what changed, clients patch their local auction.
+        # Bids on a hot auction are merged into one message per tick.
+        await self._broadcast_coalesced(
+            bid.auction_id,
+            "new_bid",
+            new_bid_event(bid, bidder, merged=len(bids)),
+            bid_groups(bid.auction_id, bid.category_id),
+        )
+
+        extended = [bid for bid in bids if bid.end_time is not None]
+        if extended:
+            await self._broadcast_group(
+                "auction_extended",
+                auction_extended_event(extended[-1]),
+                bid_groups(bid.auction_id, bid.category_id),
+            )
+
+    async def _handle_fetch_auction(self, data):
+        """Send a full snapshot of an auction, e.g. after a sequence gap."""
+        data = data.get("data", {})
+        auction_id = data.get("auction_id")
+
+        await self._broadcast_to_user(
+            "auction_snapshot", await self._fetch_auction(auction_id)
+        )
+
+    @database_sync_to_async
+    def _fetch_auction(self, auction_id):
         try:
             auction = Auction.objects.get(pk=auction_id)
-        except Auction.DoesNotExist:
-            logger.error(f"Auction {auction_id} not found")
-            self._send_error(f"Auction {auction_id} not found")
-            return  # stop further execution
+        except (Auction.DoesNotExist, ValidationError):
+            raise HandlerError(f"Auction {auction_id} not found")
 
-        # print("user: ", user)
-        # print("auction_id: ", auction.seller)
+        return AuctionSerializer(auction, context={"user": self.user}).data
 
-        # Check if user has already an existing bid
-        new_amount = current_price + auction.bid_increment
+    async def _handle_fetch_bid_history(self, data):
+        """Page through the bid ledger of an auction, highest bids first."""
+        request_data = data.get("data", {})
+        auction_id = request_data.get("auction_id")
+        page = request_data.get("page", 1)
 
-        # # print(new_amount)
+        bids, next_page = await self._fetch_bid_history(auction_id, page)
 
-        with transaction.atomic():
-            try:
-                bid, created = Bid.objects.get_or_create(
-                    auction=auction, bidder=user, defaults={"amount": new_amount}
-                )
-                if not created:
-                    bid.amount = new_amount
-                    bid.save()
+        await self._broadcast_to_user(
+            "bid_history",
+            {
+                "auction_id": auction_id,
+                "bids": bids,
+                "nextPage": next_page,
+                "loaded": page != 1,
+            },
+        )
 
-                auction.current_price = new_amount
-                auction.save()
+    @database_sync_to_async
+    def _fetch_bid_history(self, auction_id, page, page_size=20):
+        start = (page - 1) * page_size
+        end = page * page_size + 1  # Fetch one extra to check for next page
 
-            except Exception as e:
-                logger.exception(f"Error while placing bid: {str(e)}")
-                self._send_error(f"Failed to place bid.: {str(e)}")
-                return
+        # Served by the (auction, -amount, placed_at) index
+        base_qs = (
+            Bid.objects.filter(auction_id=auction_id)
+            .select_related("bidder", "auction")
+            .order_by("-amount", "placed_at")
+        )
 
-        # Serialize and broadcast to group so all connected users see the update
-        broadcast_data = AuctionSerializer(auction, context={"user": user}).data
-        # print(broadcast_data)
-        self._broadcast_group("new_bid", broadcast_data)
+        try:
+            results = list(base_qs[start:end])
+        except ValidationError:
+            raise HandlerError(f"Auction {auction_id} not found")
 
-    def _handle_watch_auction(self, data):
-        user = self.user
+        has_next = len(results) > page_size
+        serialized = BidSerializer(
+            results[:page_size], context={"user": self.user}, many=True
+        )
+        return serialized.data, page + 1 if has_next else None
+
+    async def _handle_watch_auction(self, data):
         data = data.get("data")
         auction_id = data.get("auction_id")
 
+        broadcast_data = await self._toggle_watch(auction_id)
+        await self._broadcast_to_user("watcher", broadcast_data)
+
+    @database_sync_to_async
+    def _toggle_watch(self, auction_id):
+        user = self.user
+
         try:
             auction = Auction.objects.get(pk=auction_id)
         except Auction.DoesNotExist:
             logger.error(f"Auction {auction_id} not found")
-            self._send_error(f"Auction {auction_id} not found")
-            return  # stop further execution
+            raise HandlerError(f"Auction {auction_id} not found")
 
-        # Check if user is a watcher
-        is_watcher = auction.watchers.filter(pk=user.pk).exists()
-
-        if is_watcher:
-            auction.watchers.remove(user)
-        else:
-            auction.watchers.add(user)
+        # Toggle the watch and move the counter in the same transaction
+        Watch = Auction.watchers.through
+        with transaction.atomic():
+            removed, _ = Watch.objects.filter(
+                auction_id=auction.pk, user_id=user.pk
+            ).delete()
+            if removed:
+                change = -removed
+            else:
+                Watch.objects.create(auction_id=auction.pk, user_id=user.pk)
+                change = 1
 
-        auction.save()
+            Auction.objects.filter(pk=auction.pk).update(
+                watcher_count=F("watcher_count") + change
+            )
+        auction.refresh_from_db(fields=["watcher_count"])
 
         # Serialize and broadcast to group so all connected users see the update
-        broadcast_data = AuctionSerializer(auction, context={"user": user}).data
-        # print(broadcast_data)
-        self._broadcast_to_user("watcher", broadcast_data)
+        return AuctionSerializer(auction, context={"user": user}).data
 
-    def _handle_delete_auction(self, data):
+    async def _handle_delete_auction(self, data):
         """Delete an auction and its uploaded images from local or S3."""
 
         data = data.get("data")
@@ -423,264 +691,209 @@ class AuctionConsumer(WebsocketConsumer):
         user = self.user
 
         if not auction_id:
-            self._send_error("No auction_id provided")
+            await self._send_error("No auction_id provided")
             return
 
-        try:
-            auction = Auction.objects.get(pk=auction_id)
-        except Auction.DoesNotExist:
-            self._send_error(f"Auction {auction_id} not found")
-            return
+        await self._delete_auction(auction_id)
+        bid_engine.invalidate(auction_id)
 
-        if auction.seller != user:
-            self._send_error("Only the seller can delete the auction")
-            return
+        await self._broadcast_to_user(
+            "delete_auction",
+            {
+                "message": "Auction deleted successfully",
+                "status": "success",
+                "auction_id": auction_id,
+                "sellerId": f"{user.userId}",
+            },
+        )
 
-        # print("reach delete auction: ", auction_id)
+    @database_sync_to_async
+    def _delete_auction(self, auction_id):
+        auction = self._get_seller_auction(auction_id, "delete")
 
         # Delete all images (they are guaranteed to be user-uploaded)
         for img in auction.images.all():
             if img.image:
                 if MODE == "DEVELOPMENT":
-                    # print("reach delete image Dev: ", img.image.name)
                     # If in development, delete from local storage
                     file_path = os.path.join(settings.MEDIA_ROOT, img.image.name)
                     if os.path.isfile(file_path):
                         os.remove(file_path)
                 else:
-                    # print("reach delete image Prod: ", img.image.name)
                     # If in production, delete from S3
                     img.image.delete(save=False)  # Deletes from S3
 
             img.delete()
 
         auction.delete()
-        # print("auction deleted successful: ", auction_id)
 
-        self._broadcast_to_user(
-            "delete_auction",
-            {
-                "message": "Auction deleted successfully",
-                "status": "success",
-                "auction_id": auction_id,
-                "sellerId": f"{user.userId}",
-                # "sellerId": user.userId,
-            },
-        )
+    def _get_seller_auction(self, auction_id, action):
+        """Return the auction if the user is its seller."""
+        try:
+            auction = Auction.objects.get(pk=auction_id)
+        except Auction.DoesNotExist:
+            raise HandlerError(f"Auction {auction_id} not found")
 
-    def _handle_fetch_likes_auctions(self, data):
+        # Check if user is the seller
+        if auction.seller_id != self.user.pk:
+            raise HandlerError(f"Only the seller can {action} the auction")
+        return auction
 
-        user = self.user
+    async def _handle_fetch_likes_auctions(self, data):
         request_data = data.get("data", {})
         page = request_data.get("page", 1)
-        page_size = 10
-
-        start = (page - 1) * page_size
-        end = page * page_size + 1  # Fetch one extra to check for next page
-
-        # Base queryset: exclude the seller's own auctions
-        base_qs = Auction.objects.likes(user).order_by("-created_at")
-
-        # print(base_qs)
-
-        results = list(base_qs[start:end])
-        has_next = len(results) > page_size
 
-        paginated_auctions = results[:page_size]  # Trim the extra item if it exists
-        # print('reach: ', page, paginated_auctions)
-        serialized = AuctionSerializer(
-            paginated_auctions, context={"user": user}, many=True
+        auctions, next_page = await database_sync_to_async(self._serialize_page)(
+            Auction.objects.likes(self.user).order_by("-created_at"), page
         )
 
-        next_page = page + 1 if has_next else None
-
-        self._broadcast_to_user(
+        await self._broadcast_to_user(
             "likesAuctions",
             {
-                "auctions": serialized.data,
+                "auctions": auctions,
                 "nextPage": next_page,
                 "loaded": page != 1,
             },
         )
 
-    def _handle_fetch_bids_auctions(self, data):
-
-        user = self.user
+    async def _handle_fetch_bids_auctions(self, data):
         request_data = data.get("data", {})
         page = request_data.get("page", 1)
-        page_size = 10
-
-        start = (page - 1) * page_size
-        end = page * page_size + 1  # Fetch one extra to check for next page
 
         # users latest bids auctions
-        auctions = Auction.objects.user_latest_bids(user)
-
-        # auctions = Auction.objects.filter(id__in=auction_ids)
-
-        # print('_handle_fetch_bids_auctions: ',auctions)
-
-        results = list(auctions[start:end])
-        has_next = len(results) > page_size
-
-        paginated_auctions = results[:page_size]  # Trim the extra item if it exists
-        # print('reach: ', page, paginated_auctions)
-        serialized = AuctionSerializer(
-            paginated_auctions, context={"user": user}, many=True
+        auctions, next_page = await database_sync_to_async(self._serialize_page)(
+            Auction.objects.user_latest_bids(self.user), page
         )
 
-        next_page = page + 1 if has_next else None
-
-        self._broadcast_to_user(
+        await self._broadcast_to_user(
             "bidsAuctions",
             {
-                "auctions": serialized.data,
+                "auctions": auctions,
                 "nextPage": next_page,
                 "loaded": page != 1,
             },
         )
 
-    def _handle_fetch_sales_auctions(self, data):
-
-        user = self.user
+    async def _handle_fetch_sales_auctions(self, data):
         request_data = data.get("data", {})
         page = request_data.get("page", 1)
-        page_size = 10
-
-        start = (page - 1) * page_size
-        end = page * page_size + 1  # Fetch one extra to check for next page
 
         # users sales auctions
-        user_sales = Auction.objects.sales(user).order_by("-created_at")
-
-        # print('_handle_fetch_sales_auctions: ',user_sales)
-
-        results = list(user_sales[start:end])
-        has_next = len(results) > page_size
-
-        paginated_auctions = results[:page_size]  # Trim the extra item if it exists
-        # print('reach: ', page, paginated_auctions)
-        serialized = AuctionSerializer(
-            paginated_auctions, context={"user": user}, many=True
+        auctions, next_page = await database_sync_to_async(self._serialize_page)(
+            Auction.objects.sales(self.user).order_by("-created_at"), page
         )
 
-        next_page = page + 1 if has_next else None
-
-        self._broadcast_to_user(
+        await self._broadcast_to_user(
             "salesAuctions",
             {
-                "auctions": serialized.data,
+                "auctions": auctions,
                 "nextPage": next_page,
                 "loaded": page != 1,
             },
         )
 
-    def _handle_edit_auction(self, data):
+    async def _handle_edit_auction(self, data):
         """Handle auction editing requests."""
-        user = self.user
         data = data.get("data", {})
         auction_id = data.get("auction_id")
 
         if not auction_id:
-            self._send_error("No auction_id provided")
-            return
-
-        try:
-            auction = Auction.objects.get(pk=auction_id)
-        except Auction.DoesNotExist:
-            self._send_error(f"Auction {auction_id} not found")
-            return
-
-        # Check if user is the seller
-        if auction.seller != user:
-            self._send_error("Only the seller can edit the auction")
+            await self._send_error("No auction_id provided")
             return
 
         # Remove auction_id from data before serialization
         edit_data = {k: v for k, v in data.items() if k != "auction_id"}
 
         try:
-            serializer = AuctionUpdateSerializer(
-                auction, data=edit_data, context={"user": user}, partial=True
+            updated_auction, broadcast_data = await self._edit_auction(
+                auction_id, edit_data
             )
+            bid_engine.invalidate(auction_id)
 
-            if not serializer.is_valid():
-                error_msg = "Auction validation failed: " + str(serializer.errors)
-                self._send_error(error_msg)
-                return
-
-            updated_auction = serializer.save()
-
-            # Serialize and broadcast the updated auction
-            broadcast_data = AuctionSerializer(
-                updated_auction, context={"user": user}
-            ).data
-
-            self._broadcast_group("auction_updated", broadcast_data)
-            self._broadcast_to_user(
+            await self._broadcast_group(
+                "auction_updated", broadcast_data, lifecycle_groups(updated_auction)
+            )
+            await self._broadcast_to_user(
                 "edit_auction_success",
                 {"message": "Auction updated successfully", "auction": broadcast_data},
             )
 
+        except HandlerError:
+            raise
         except Exception as e:
             logger.error(f"Error editing auction: {str(e)}")
-            self._send_error(f"Failed to edit auction: {str(e)}")
+            await self._send_error(f"Failed to edit auction: {str(e)}")
+
+    @database_sync_to_async
+    def _edit_auction(self, auction_id, edit_data):
+        auction = self._get_seller_auction(auction_id, "edit")
 
-    def _handle_close_auction(self, data):
+        serializer = AuctionUpdateSerializer(
+            auction, data=edit_data, context={"user": self.user}, partial=True
+        )
+        if not serializer.is_valid():
+            raise HandlerError("Auction validation failed: " + str(serializer.errors))
+
+        updated_auction = serializer.save()
+
+        # Serialize and broadcast the updated auction
+        broadcast_data = AuctionSerializer(
+            updated_auction, context={"user": self.user}
+        ).data
+        return updated_auction, broadcast_data
+
+    async def _handle_close_auction(self, data):
         """Handle auction closing/cancellation requests."""
-        user = self.user
         data = data.get("data", {})
         auction_id = data.get("auction_id")
 
         if not auction_id:
-            self._send_error("No auction_id provided")
+            await self._send_error("No auction_id provided")
             return
 
         try:
-            auction = Auction.objects.get(pk=auction_id)
-        except Auction.DoesNotExist:
-            self._send_error(f"Auction {auction_id} not found")
-            return
+            auction, broadcast_data = await self._close_auction(auction_id)
+            bid_engine.invalidate(auction_id)
 
-        # Check if user is the seller
-        if auction.seller != user:
-            self._send_error("Only the seller can close the auction")
-            return
+            await self._broadcast_group(
+                "auction_closed", broadcast_data, lifecycle_groups(auction)
+            )
+            await self._broadcast_to_user(
+                "close_auction_success",
+                {"message": "Auction closed successfully", "auction": broadcast_data},
+            )
+
+        except HandlerError:
+            raise
+        except Exception as e:
+            logger.error(f"Error closing auction: {str(e)}")
+            await self._send_error(f"Failed to close auction: {str(e)}")
+
+    @database_sync_to_async
+    def _close_auction(self, auction_id):
+        auction = self._get_seller_auction(auction_id, "close")
 
         # Check if auction can be closed
         if auction.status == Auction.Status.CANCELLED:
-            self._send_error("Auction is already cancelled")
-            return
+            raise HandlerError("Auction is already cancelled")
 
         if auction.status == Auction.Status.ENDED:
-            self._send_error("Auction has already ended")
-            return
+            raise HandlerError("Auction has already ended")
 
         if auction.status == Auction.Status.COMPLETED:
-            self._send_error("Auction is already completed")
-            return
-
-        try:
-            # Close the auction
-            auction.status = Auction.Status.CANCELLED
-            auction.save()
-
-            # Serialize and broadcast the updated auction
-            broadcast_data = AuctionSerializer(auction, context={"user": user}).data
+            raise HandlerError("Auction is already completed")
 
-            self._broadcast_group("auction_closed", broadcast_data)
-            self._broadcast_to_user(
-                "close_auction_success",
-                {"message": "Auction closed successfully", "auction": broadcast_data},
-            )
+        # Close the auction
+        auction.status = Auction.Status.CANCELLED
+        # Only the status: the counters read above may be stale already
+        auction.save(update_fields=["status", "updated_at"])
 
-        except Exception as e:
-            logger.error(f"Error closing auction: {str(e)}")
-            self._send_error(f"Failed to close auction: {str(e)}")
+        # Serialize and broadcast the updated auction
+        broadcast_data = AuctionSerializer(auction, context={"user": self.user}).data
+        return auction, broadcast_data
 
-    def _handle_reopen_auction(self, data):
+    async def _handle_reopen_auction(self, data):
         """Handle auction reopening requests."""
-        user = self.user
         data = data.get("data", {})
         auction_id = data.get("auction_id")
         reopen_data = data.get("auction", {})
@@ -689,18 +902,7 @@ class AuctionConsumer(WebsocketConsumer):
         images = reopen_data.pop("image", [])
 
         if not auction_id:
-            self._send_error("No auction_id provided")
-            return
-
-        try:
-            auction = Auction.objects.get(pk=auction_id)
-        except Auction.DoesNotExist:
-            self._send_error(f"Auction {auction_id} not found")
-            return
-
-        # Check if user is the seller
-        if auction.seller != user:
-            self._send_error("Only the seller can reopen the auction")
+            await self._send_error("No auction_id provided")
             return
 
         if not isinstance(images, list):
@@ -709,142 +911,152 @@ class AuctionConsumer(WebsocketConsumer):
             raise ValueError("You can upload a maximum of 3 images")
 
         try:
-            with transaction.atomic():
-                # Update status to ongoing
-                auction.status = Auction.Status.ONGOING
-                auction.save()
-
-                serializer = AuctionUpdateSerializer(
-                    auction, data=reopen_data, context={"user": user}, partial=True
-                )
-                if not serializer.is_valid():
-                    self._send_error(
-                        "Auction validation failed: " + str(serializer.errors)
-                    )
-                    return
-
-                updated_auction = serializer.save()
-
-                # Track current images and changes
-                old_images = list(AuctionImage.objects.filter(auction=auction))
-                # new_image_urls = [img.get("uri") for img in images if img.get("uri")]
-                images_to_keep = []
-                base64_images = []
-
-                for img_data in images:
-                    uri = img_data.get("uri", "")
-                    if uri.startswith("/media/auction_images"):
-                        # Keep the image if it's one of the old ones
-                        images_to_keep.append(uri)
-                    elif uri.startswith("data:image"):
-                        base64_images.append(img_data)
-                    else:
-                        raise ValueError(f"Invalid image format: {uri}")
-
-                # Delete removed old images
-                for old_img in old_images:
-                    if old_img.image.url not in images_to_keep:
-                        old_img.image.delete(save=False)  # delete file from storage
-                        old_img.delete()
-
-                # Save new base64 images
-                for idx, img_data in enumerate(base64_images):
-                    try:
-                        base64_data = img_data.get("uri").split(",")[1]
-                        image_data = base64.b64decode(base64_data)
-                    except Exception as e:
-                        raise ValueError(f"Invalid base64 image at index {idx}: {e}")
-
-                    image_file = ContentFile(image_data, name=img_data.get("fileName"))
-                    AuctionImage.objects.create(
-                        auction=updated_auction,
-                        image=image_file,
-                        is_primary=(
-                            idx == 0 and not images_to_keep
-                        ),  # primary only if first new image
-                    )
+            updated_auction, broadcast_data = await self._reopen_auction(
+                auction_id, reopen_data, images
+            )
+            bid_engine.invalidate(auction_id)
 
-                # Broadcast result
-                broadcast_data = AuctionSerializer(
-                    updated_auction, context={"user": user}
-                ).data
-
-                self._broadcast_group("auction_reopened", broadcast_data)
-                self._broadcast_to_user(
-                    "reopen_auction_success",
-                    {
-                        "message": "Auction reopened successfully",
-                        "auction": broadcast_data,
-                    },
-                )
+            await self._broadcast_group(
+                "auction_reopened",
+                broadcast_data,
+                lifecycle_groups(updated_auction),
+            )
+            await self._broadcast_to_user(
+                "reopen_auction_success",
+                {
+                    "message": "Auction reopened successfully",
+                    "auction": broadcast_data,
+                },
+            )
+        except HandlerError:
+            raise
         except Exception as e:
             logger.error(f"Error reopening auction: {str(e)}")
-            self._send_error(f"Failed to reopen auction: {str(e)}")
+            await self._send_error(f"Failed to reopen auction: {str(e)}")
 
-    def _handle_my_auctions(self, data):
-        """Fetch auctions created by the user."""
-        user = self.user
-        # request_data = data.get("data", {})
-        # page = request_data.get("page", 1)
-        # page_size = 5
+    @database_sync_to_async
+    def _reopen_auction(self, auction_id, reopen_data, images):
+        auction = self._get_seller_auction(auction_id, "reopen")
+
+        with transaction.atomic():
+            # Update status to ongoing
+            auction.status = Auction.Status.ONGOING
+            auction.save(update_fields=["status", "updated_at"])
 
-        # start = (page - 1) * page_size
-        # end = page * page_size + 1
+            serializer = AuctionUpdateSerializer(
+                auction, data=reopen_data, context={"user": self.user}, partial=True
+            )
+            if not serializer.is_valid():
+                raise HandlerError(
+                    "Auction validation failed: " + str(serializer.errors)
+                )
+
+            updated_auction = serializer.save()
 
-        auctions = Auction.objects.filter(seller=user)
+            # Track current images and changes
+            old_images = list(AuctionImage.objects.filter(auction=auction))
+            images_to_keep = []
+            base64_images = []
+
+            for img_data in images:
+                uri = img_data.get("uri", "")
+                if uri.startswith("/media/auction_images"):
+                    # Keep the image if it's one of the old ones
+                    images_to_keep.append(uri)
+                elif uri.startswith("data:image"):
+                    base64_images.append(img_data)
+                else:
+                    raise ValueError(f"Invalid image format: {uri}")
+
+            # Delete removed old images
+            for old_img in old_images:
+                if old_img.image.url not in images_to_keep:
+                    old_img.image.delete(save=False)  # delete file from storage
+                    old_img.delete()
+
+            # Save new base64 images
+            for idx, img_data in enumerate(base64_images):
+                try:
+                    base64_data = img_data.get("uri").split(",")[1]
+                    image_data = base64.b64decode(base64_data)
+                except Exception as e:
+                    raise ValueError(f"Invalid base64 image at index {idx}: {e}")
+
+                image_file = ContentFile(image_data, name=img_data.get("fileName"))
+                AuctionImage.objects.create(
+                    auction=updated_auction,
+                    image=image_file,
+                    is_primary=(
+                        idx == 0 and not images_to_keep
+                    ),  # primary only if first new image
+                )
 
-        # Serialize and broadcast the updated auction
+        # Broadcast result
         broadcast_data = AuctionSerializer(
-            auctions, context={"user": user}, many=True
+            updated_auction, context={"user": self.user}
         ).data
+        return updated_auction, broadcast_data
+
+    async def _handle_my_auctions(self, data):
+        """Fetch auctions created by the user."""
+        await self._broadcast_to_user(
+            "my_auctions", {"auctions": await self._fetch_my_auctions()}
+        )
+
+    @database_sync_to_async
+    def _fetch_my_auctions(self):
+        auctions = Auction.objects.with_top_bid().filter(seller=self.user)
 
-        self._broadcast_to_user("my_auctions", {"auctions": broadcast_data})
+        return AuctionSerializer(auctions, context={"user": self.user}, many=True).data
 
-    def _handle_report_user(self, data):
+    async def _handle_report_user(self, data):
         pass
 
     # ----------------------
     #  Response Methods
     # ----------------------
 
-    def _send_search_results(self, results):
+    async def _send_search_results(self, results):
         """Send search results back to client."""
-        # print('send from server to client: ',results)
-        self.send(
-            text_data=json.dumps(
-                {"type": "search_results", "source": "search", "data": results}
-            )
+        await self._send_frame(
+            {"type": "search_results", "source": "search", "data": results}
+        )
+
+    async def _send_subscriptions(self):
+        """Tell the client which groups the connection is subscribed to."""
+        await self._send_frame(
+            {"source": "subscriptions", "data": sorted(self.subscriptions)}
         )
 
-    def _send_error(self, message):
+    async def _send_error(self, message):
         """Send error message to client."""
-        self.send(text_data=json.dumps({"type": "error", "message": message}))
+        await self._send_frame({"type": "error", "message": message})
+
+    async def _send_frame(self, frame):
+        """Send a reply to this connection only."""
+        self._record_reply(frame)
+        await self.send_json(frame)
 
-    def _reject_connection(self, reason):
+    async def _reject_connection(self, reason):
         """Reject WebSocket connection with reason."""
         print(f"🚨 WebSocket rejected: {reason}")
-        self.close()
+        await self.close()
 
     # ----------------------
     #  Group Broadcast Methods
     # ----------------------
 
-    def _broadcast_to_user(self, source, data):
-        """Send data to the user's personal group."""
+    async def _broadcast_to_user(self, source, data):
+        """Reply to this connection, copied to the user's other devices."""
+        self._record_reply({"source": source, "data": data})
 
         try:
-            async_to_sync(self.channel_layer.group_send)(
-                self.username,
-                {"type": "broadcast.message", "source": source, "data": data},
-            )
+            await self.send_reply(source, data)
         except Exception as e:
             logger.error(f"Error broadcasting message: {str(e)}")
-            print(f"Error broadcasting message: {str(e)}")
 
-            async_to_sync(self.channel_layer.group_send)(
-                self.username,
+            await self.send_json(
                 {
-                    "type": "broadcast.message",
                     "source": "proccessing_error",
                     "data": {
                         "status": "error",
@@ -852,26 +1064,24 @@ class AuctionConsumer(WebsocketConsumer):
                         "detail": str(e),  # optional: useful for debugging
                         "source": source,
                     },
-                },
+                }
             )
 
-    def _broadcast_group(self, source, data):
-        """Handler for group broadcast messages."""
+    async def _broadcast_group(self, source, data, groups):
+        """Send data to the connections subscribed to any of the groups."""
         try:
-            # Broadcast to all connected users in the group
-            async_to_sync(self.channel_layer.group_send)(
-                self.GROUP_NAME,
-                {"type": "broadcast.message", "source": source, "data": data},
-            )
+            # Encoded once for all the groups and all their members
+            event = broadcast_event(source, data)
+            for group in groups:
+                await group_send(self.channel_layer, group, event)
         except Exception as e:
             logger.error(f"Error broadcasting message: {str(e)}")
-            print(f"Error broadcasting message: {str(e)}")
 
-    def broadcast_message(self, event):
-        """Handle messages sent to the user's group."""
+    async def _broadcast_coalesced(self, key, source, data, groups):
+        """Send data to the groups, merged with other updates sharing key."""
         try:
-            self.send(
-                text_data=json.dumps({"source": event["source"], "data": event["data"]})
+            await broadcast_coalescer.submit(
+                self.channel_layer, key, groups, source, data
             )
         except Exception as e:
             logger.error(f"Error broadcasting message: {str(e)}")
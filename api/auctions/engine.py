@@ -0,0 +1,318 @@
+"""In-process bid engine.
+
+Every auction is owned by exactly one shard, picked by hashing its id. A shard
+is a single worker thread draining its own queue, so bids on the same auction
+are checked, ordered and persisted one after another instead of racing on the
+Auction row, while bids on different auctions run in parallel on other shards.
+
+The shard keeps the authoritative current price of the auctions it owns in
+memory and commits the bids it drained in one transaction per batch, so a hot
+auction costs one short write per batch rather than one row lock per bid. The
+commit goes through the conditional UPDATE of the bid service, so a price
+moved by another worker process is detected and the bids are checked again.
+
+Proxy bids of the auctions a shard owns are cached with their state, so a bid
+answered by the proxies is resolved in memory and committed together with the
+answer.
+"""
+
+import logging
+import queue
+import threading
+import zlib
+from collections import OrderedDict
+from concurrent.futures import Future, InvalidStateError
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .bidding import (
+    AuctionState,
+    BidConflict,
+    BidRejected,
+    accept_bid,
+    accept_proxy,
+    commit_bids,
+)
+from .bidding import reject as reject_bid
+
+logger = logging.getLogger(__name__)
+
+
+def _resolve(future, result):
+    """Set the result of a future, unless its waiter gave up and cancelled it."""
+    try:
+        future.set_result(result)
+    except InvalidStateError:
+        pass
+
+
+def _reject(future, exception):
+    """Set the exception of a future, unless its waiter gave up on it."""
+    try:
+        future.set_exception(exception)
+    except InvalidStateError:
+        pass
+
+
+@dataclass
+class _BidRequest:
+    auction_id: str
+    bidder: object
+    amount: object = None
+    future: Future = field(default_factory=Future)
+
+
+@dataclass
+class _ProxyRequest:
+    auction_id: str
+    bidder: object
+    max_amount: object
+    future: Future = field(default_factory=Future)
+
+
+@dataclass
+class _Invalidate:
+    auction_id: str
+
+
+class BidShard:
+    """A single worker thread owning a subset of the auctions."""
+
+    def __init__(self, index, batch_size, cache_size):
+        self.index = index
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self._queue = queue.SimpleQueue()
+        self._states = OrderedDict()
+        self._thread = threading.Thread(
+            target=self._run, name=f"bid-shard-{index}", daemon=True
+        )
+        self._thread.start()
+
+    def put(self, item):
+        self._queue.put(item)
+
+    def stop(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    # ----------------------
+    #  Worker loop
+    # ----------------------
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+
+            # Drain whatever queued up behind the first item so the batch is
+            # committed in a single transaction per auction.
+            batch = [item]
+            stop = False
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+
+            close_old_connections()
+            try:
+                self._process(batch)
+            except Exception as e:
+                logger.exception(f"Bid shard {self.index} failed: {str(e)}")
+                self._fail(batch)
+
+            if stop:
+                break
+
+        close_old_connections()
+
+    def _process(self, batch):
+        pending = OrderedDict()
+
+        for item in batch:
+            if isinstance(item, _Invalidate):
+                self._states.pop(item.auction_id, None)
+            else:
+                pending.setdefault(item.auction_id, []).append(item)
+
+        for auction_id, requests in pending.items():
+            try:
+                self._place(auction_id, requests)
+            except Exception:
+                # Whatever we believed about this auction is no longer reliable.
+                self._states.pop(auction_id, None)
+                raise
+
+    def _fail(self, batch):
+        for item in batch:
+            if not isinstance(item, _Invalidate) and not item.future.done():
+                _reject(
+                    item.future, BidRejected("Failed to place bid.", retryable=True)
+                )
+
+    # ----------------------
+    #  Bid rules
+    # ----------------------
+
+    def _get_state(self, auction_id):
+        state = self._states.get(auction_id)
+        if state is not None and timezone.now() >= state.end_time:
+            # Over by our copy, but a bid committed outside the engine (the
+            # REST endpoint, another process) may have extended it since
+            state = None
+        if state is None:
+            state = AuctionState.load(auction_id)
+            self._states[auction_id] = state
+            if len(self._states) > self.cache_size:
+                self._states.popitem(last=False)
+        else:
+            self._states.move_to_end(auction_id)
+        return state
+
+    def _place(self, auction_id, requests):
+        """Check the queued bids of one auction in order and commit them."""
+        # A request whose waiter timed out meanwhile is dropped, not committed
+        # behind its back; once running it can no longer be cancelled
+        requests = [
+            request
+            for request in requests
+            if request.future.set_running_or_notify_cancel()
+        ]
+        if not requests:
+            return
+
+        for attempt in range(settings.BID_CONFLICT_RETRIES + 1):
+            try:
+                state = self._get_state(auction_id)
+            except BidRejected as e:
+                for request in requests:
+                    _reject(request.future, reject_bid(auction_id, e))
+                return
+
+            persisted_sequence = state.bid_sequence
+            results = []
+            accepted = []
+            proxies = []
+            for request in requests:
+                try:
+                    if isinstance(request, _ProxyRequest):
+                        proxy, bids = accept_proxy(
+                            state, request.bidder, request.max_amount
+                        )
+                        proxies.append(proxy)
+                        results.append((proxy, bids))
+                    else:
+                        bids = accept_bid(state, request.bidder, request.amount)
+                        results.append(bids)
+                    accepted.extend(bids)
+                except BidRejected as e:
+                    results.append(e)
+
+            if accepted or proxies:
+                try:
+                    commit_bids(
+                        auction_id,
+                        state.persisted_price,
+                        persisted_sequence,
+                        accepted,
+                        proxies,
+                    )
+                except BidConflict:
+                    # Another worker moved the price, reload and check again.
+                    self._states.pop(auction_id, None)
+                    continue
+                state.persisted_price = state.current_price
+
+            for request, result in zip(requests, results):
+                # One by one: a waiter that timed out fails none of the others
+                if isinstance(result, BidRejected):
+                    _reject(request.future, reject_bid(auction_id, result))
+                else:
+                    _resolve(request.future, result)
+            return
+
+        busy = BidRejected("Auction is busy, please try again", retryable=True)
+        for request in requests:
+            _reject(request.future, reject_bid(auction_id, busy))
+
+
+class BidEngine:
+    """Routes bids to the shard owning their auction."""
+
+    def __init__(self, shards=None, batch_size=None, cache_size=None):
+        self.shard_count = shards or settings.BID_ENGINE_SHARDS
+        self.batch_size = batch_size or settings.BID_ENGINE_BATCH_SIZE
+        self.cache_size = cache_size or settings.BID_ENGINE_CACHE_SIZE
+        self._shards = None
+        self._lock = threading.Lock()
+
+    def _shard_for(self, auction_id):
+        if self._shards is None:
+            with self._lock:
+                if self._shards is None:
+                    self._shards = [
+                        BidShard(index, self.batch_size, self.cache_size)
+                        for index in range(self.shard_count)
+                    ]
+        index = zlib.crc32(str(auction_id).encode()) % self.shard_count
+        return self._shards[index]
+
+    def submit(self, auction_id, bidder, amount=None):
+        """Queue a bid and return a Future resolving to the committed bids.
+
+        The bids are the bid itself, followed by the answer of the proxies
+        when they outbid it.
+        """
+        auction_id = str(auction_id)
+        request = _BidRequest(auction_id=auction_id, bidder=bidder, amount=amount)
+        self._shard_for(auction_id).put(request)
+        return request.future
+
+    def place_bid(self, auction_id, bidder, amount=None):
+        """Place a bid and block until the owning shard has persisted it."""
+        future = self.submit(auction_id, bidder, amount)
+        return future.result(timeout=settings.BID_ENGINE_TIMEOUT)
+
+    def submit_proxy(self, auction_id, bidder, max_amount):
+        """Queue a proxy maximum and return a Future.
+
+        The Future resolves to the Proxy and the bids it placed, if it outbid
+        the leader.
+        """
+        auction_id = str(auction_id)
+        request = _ProxyRequest(
+            auction_id=auction_id, bidder=bidder, max_amount=max_amount
+        )
+        self._shard_for(auction_id).put(request)
+        return request.future
+
+    def set_proxy(self, auction_id, bidder, max_amount):
+        """Store a proxy maximum and block until it has been persisted."""
+        future = self.submit_proxy(auction_id, bidder, max_amount)
+        return future.result(timeout=settings.BID_ENGINE_TIMEOUT)
+
+    def invalidate(self, auction_id):
+        """Drop the cached state of an auction changed outside the engine."""
+        if self._shards is None:
+            # Nothing cached yet, and no reason to start the shards
+            return
+        auction_id = str(auction_id)
+        self._shard_for(auction_id).put(_Invalidate(auction_id))
+
+    def stop(self):
+        with self._lock:
+            shards, self._shards = self._shards, None
+        for shard in shards or []:
+            shard.stop()
+
+
+bid_engine = BidEngine()
@@ -0,0 +1,65 @@
+"""Compact auction events broadcast to the WebSocket clients.
+
+Unlike the AuctionSerializer snapshots, these carry only what changed. Every
+event has a version ``v`` and the auction ``seq`` (its bid_sequence); a client
+that sees a gap in ``seq`` asks for a snapshot with the ``fetch_auction``
+source instead of patching its local state. Bid deltas merged by the
+broadcast coalescer carry ``merged``, the number of bids they stand for, so
+``seq`` advancing by exactly ``merged`` is not a gap.
+"""
+
+from api.users.serializers import UserSummarySerializer
+
+EVENT_VERSION = 1
+
+
+def new_bid_event(bid, bidder, merged=1):
+    """Delta sent to the watchers of an auction when a bid is accepted.
+
+    merged is the number of bids committed together with bid, e.g. a bid and
+    the answer of the proxies, of which only the last one is sent.
+    """
+    return {
+        "v": EVENT_VERSION,
+        "auction_id": bid.auction_id,
+        "seq": bid.sequence,
+        "current_price": str(bid.amount),
+        "bidder": UserSummarySerializer(bidder).data,
+        "bid_count": bid.bid_count,
+        "placed_at": bid.placed_at.isoformat(),
+        "merged": merged,
+    }
+
+
+def auction_started_event(auction):
+    """Sent when the scheduler opens an auction at its start_time."""
+    return {
+        "v": EVENT_VERSION,
+        "auction_id": str(auction.pk),
+        "status": str(auction.status),
+        "start_time": auction.start_time.isoformat(),
+        "end_time": auction.end_time.isoformat(),
+    }
+
+
+def auction_ended_event(auction):
+    """Sent when the scheduler ends an auction at its end_time."""
+    top_bid = auction.top_bid
+    return {
+        "v": EVENT_VERSION,
+        "auction_id": str(auction.pk),
+        "status": str(auction.status),
+        "final_price": str(top_bid.amount) if top_bid else None,
+        "winner_id": str(top_bid.bidder_id) if top_bid else None,
+        "end_time": auction.end_time.isoformat(),
+    }
+
+
+def auction_extended_event(bid):
+    """Sent when a bid in the soft close window pushes the end_time out."""
+    return {
+        "v": EVENT_VERSION,
+        "auction_id": bid.auction_id,
+        "seq": bid.sequence,
+        "end_time": bid.end_time.isoformat(),
+    }
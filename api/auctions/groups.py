@@ -0,0 +1,61 @@
+"""Channel-layer groups the auction consumers subscribe to.
+
+A connection joins the group of an auction while its detail screen is open and
+the group of a category while that feed is open, "All" being its own category.
+Events are sent only to the groups interested in them:
+
+    new_auction                      -> category, all
+    new_bid                          -> auction, category
+    auction_updated/closed/reopened  -> auction, category, all
+"""
+
+import uuid
+
+ALL_CATEGORIES = "all"
+
+
+def auction_group(auction_id):
+    return f"auction.{auction_id}"
+
+
+def category_group(category_id=None):
+    return f"category.{category_id if category_id else ALL_CATEGORIES}"
+
+
+def parse_auction_id(value):
+    """Return the canonical auction id, or None when value is not one."""
+    try:
+        return str(uuid.UUID(str(value)))
+    except ValueError:
+        return None
+
+
+def parse_category(value):
+    """Return the category id of a feed filter, None standing for "All".
+
+    Accepts the {"key", "value"} dicts sent by the feed filters as well as a
+    bare id. Raises ValueError for anything else.
+    """
+    if isinstance(value, dict):
+        if value.get("value") == "All":
+            return None
+        value = value.get("key")
+    if value in (None, "", "All", ALL_CATEGORIES):
+        return None
+    return int(value)
+
+
+def new_auction_groups(auction):
+    return [category_group(auction.category_id), category_group()]
+
+
+def bid_groups(auction_id, category_id):
+    return [auction_group(auction_id), category_group(category_id)]
+
+
+def lifecycle_groups(auction):
+    return [
+        auction_group(auction.pk),
+        category_group(auction.category_id),
+        category_group(),
+    ]
@@ -3,7 +3,8 @@ import uuid
 from django.conf import settings
 from django.core.validators import MinValueValidator
 from django.db import models
-from django.db.models import OuterRef, Subquery
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
 from django.utils import timezone
 
 from .utils import upload_img
@@ -63,6 +64,42 @@ class AuctionQuerySet(models.QuerySet):
 
         return self.filter(seller=user)
 
+    def with_top_bid(self):
+        """Load the top bid shown on every auction card in the same query"""
+        return self.select_related("top_bid__bidder")
+
+    def rebuild_counters(self):
+        """Recompute the denormalized counters and top bid of the auctions."""
+        bids = Bid.objects.filter(auction=OuterRef("pk"))
+        bid_count = Coalesce(
+            Subquery(
+                bids.order_by()
+                .values("auction")
+                .annotate(total=Count("pk"))
+                .values("total")
+            ),
+            0,
+        )
+        watchers = Auction.watchers.through.objects.filter(auction=OuterRef("pk"))
+        watcher_count = Coalesce(
+            Subquery(
+                watchers.order_by()
+                .values("auction")
+                .annotate(total=Count("pk"))
+                .values("total")
+            ),
+            0,
+        )
+        top_bid = Subquery(bids.order_by("-amount", "placed_at").values("pk")[:1])
+
+        return self.update(
+            bid_count=bid_count,
+            watcher_count=watcher_count,
+            top_bid=top_bid,
+            # Never rewind the sequence clients already saw
+            bid_sequence=Greatest("bid_sequence", bid_count),
+        )
+
 
 class Auction(models.Model):
 
@@ -93,6 +130,20 @@ class Auction(models.Model):
         default=1.00,
         validators=[MinValueValidator(0.01)],
     )
+    # Incremented for every accepted bid, lets clients detect missed events
+    bid_sequence = models.PositiveIntegerField(default=0)
+    # Denormalized counters, maintained by the bid and watch paths and
+    # rebuilt by the rebuild_auction_counters command
+    bid_count = models.PositiveIntegerField(default=0)
+    watcher_count = models.PositiveIntegerField(default=0)
+    # Highest bid of the ledger, moved in the same transaction as the bid
+    top_bid = models.ForeignKey(
+        "Bid",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="+",
+    )
     status = models.CharField(
         max_length=20, choices=Status.choices, default=Status.DRAFT
     )
@@ -112,6 +163,10 @@ class Auction(models.Model):
     watchers = models.ManyToManyField("User", blank=True, related_name="watchlist")
     start_time = models.DateTimeField(default=timezone.now)
     end_time = models.DateTimeField()
+    # Soft close: a bid accepted in the last soft_close_window seconds pushes
+    # end_time out by soft_close_extension seconds, 0 turns it off
+    soft_close_window = models.PositiveIntegerField(default=0)
+    soft_close_extension = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     shipping_details = models.TextField(blank=True, null=True)
@@ -132,6 +187,9 @@ class Auction(models.Model):
             models.Index(fields=["status", "end_time"]),
             models.Index(fields=["seller"]),
             models.Index(fields=["category"]),
+            # Popularity sorts of the feeds
+            models.Index(fields=["status", "-bid_count"]),
+            models.Index(fields=["status", "-watcher_count"]),
         ]
 
     def __str__(self):
@@ -157,7 +215,7 @@ class Auction(models.Model):
         return self.end_time - self.start_time
 
     def get_highest_bid(self):
-        return self.bids.order_by("-amount").first()
+        return self.top_bid
 
 
 class AuctionImage(models.Model):
@@ -182,6 +240,7 @@ class AuctionImage(models.Model):
 
 
 class Bid(models.Model):
+    """Append-only bid ledger, every accepted bid is a new row."""
 
     # objects = BidQuerySet.as_manager()
 
@@ -196,19 +255,21 @@ class Bid(models.Model):
     class Meta:
         ordering = ["-placed_at"]
         get_latest_by = "placed_at"
+        indexes = [
+            # Highest bid and bid history of an auction
+            models.Index(fields=["auction", "-amount", "placed_at"]),
+            # Best bid of a user on an auction
+            models.Index(fields=["auction", "bidder", "-amount"]),
+            # Latest bids of an auction, embedded in its cards
+            models.Index(fields=["auction", "-placed_at"]),
+        ]
 
     def __str__(self):
         return f"${self.amount} on {self.auction.title} by {self.bidder}"
 
-    def save(self, *args, **kwargs):
-        # Set is_winner=False for all bids when saving a new winning bid
-        if self.is_winner:
-            self.auction.bids.exclude(id=self.id).update(is_winner=False)
-        super().save(*args, **kwargs)
-
     @property
     def is_highest_bid(self):
-        return self == self.auction.get_highest_bid()
+        return self.pk is not None and self.pk == self.auction.top_bid_id
 
     @property
     def was_outbid(self):
@@ -217,6 +278,36 @@ class Bid(models.Model):
         return False
 
 
+class ProxyBid(models.Model):
+    """The highest amount a bidder lets the engine bid for them on an auction."""
+
+    auction = models.ForeignKey(
+        Auction, on_delete=models.CASCADE, related_name="proxy_bids"
+    )
+    bidder = models.ForeignKey(
+        "User", on_delete=models.CASCADE, related_name="proxy_bids"
+    )
+    max_amount = models.DecimalField(
+        max_digits=12, decimal_places=2, validators=[MinValueValidator(0.01)]
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["auction", "bidder"], name="unique_proxy_bid"
+            ),
+        ]
+        indexes = [
+            # Proxies still able to outbid the current price
+            models.Index(fields=["auction", "-max_amount"]),
+        ]
+
+    def __str__(self):
+        return f"Up to ${self.max_amount} on {self.auction.title} by {self.bidder}"
+
+
 class AuctionTransaction(models.Model):
     auction = models.OneToOneField(
         Auction, on_delete=models.CASCADE, related_name="transaction"
@@ -0,0 +1,272 @@
+"""Auction lifecycle scheduler.
+
+Draft auctions open when their start_time passes and ongoing auctions end when
+their end_time passes. Only the deadlines falling within
+AUCTION_SCHEDULER_HORIZON are read, from the (status, end_time) index, and kept
+in a hashed timing wheel, so a tick only looks at the auctions due in that
+tick. The window is read again every AUCTION_SCHEDULER_REFRESH seconds to pick
+up new and edited auctions, and the same query rebuilds the wheel after a
+restart, overdue auctions included.
+
+Due auctions are moved in batched UPDATEs and the change is broadcast to their
+lifecycle groups. Their deadline is read again under a row lock before they
+move, an auction whose end_time was pushed back since it was scheduled goes
+back in the wheel instead of ending.
+"""
+
+import logging
+import math
+import threading
+from datetime import timedelta
+
+from api import metrics
+from api.realtime.codecs import broadcast_event
+from api.realtime.hub import group_send
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+
+from .events import auction_ended_event, auction_started_event
+from .groups import lifecycle_groups
+from .models import Auction, Bid
+
+logger = logging.getLogger(__name__)
+
+START = "start"
+END = "end"
+
+
+class TimingWheel:
+    """Hashed timing wheel of keyed deadlines.
+
+    A deadline due at tick t lands in slot ``t % slots``. Slots are visited one
+    tick after another and only hand out the entries whose tick has come, the
+    ones due in a later round stay put. Scheduling, rescheduling and cancelling
+    a key are O(1).
+    """
+
+    def __init__(self, tick, slots, now):
+        self.tick = tick
+        self.slots = [{} for _ in range(slots)]
+        self._where = {}
+        self._current = self._floor(now)
+
+    def __len__(self):
+        return len(self._where)
+
+    def __contains__(self, key):
+        return key in self._where
+
+    def _floor(self, when):
+        return math.floor(when.timestamp() / self.tick)
+
+    def schedule(self, key, when):
+        """Schedule key at when, replacing its previous deadline."""
+        self.cancel(key)
+        # Never fire early, and run overdue keys on the next tick
+        tick = max(math.ceil(when.timestamp() / self.tick), self._current)
+        slot = tick % len(self.slots)
+        self.slots[slot][key] = tick
+        self._where[key] = slot
+
+    def cancel(self, key):
+        slot = self._where.pop(key, None)
+        if slot is not None:
+            del self.slots[slot][key]
+
+    def advance(self, now):
+        """Remove and return the keys due up to now."""
+        target = self._floor(now)
+        if target < self._current:
+            return []
+
+        count = len(self.slots)
+        if target - self._current >= count:
+            # Fell a whole round behind, every slot is due once
+            visited = range(count)
+        else:
+            visited = (tick % count for tick in range(self._current, target + 1))
+
+        due = []
+        for index in visited:
+            slot = self.slots[index]
+            ready = [key for key, tick in slot.items() if tick <= target]
+            for key in ready:
+                del slot[key]
+                del self._where[key]
+            due.extend(ready)
+
+        self._current = target + 1
+        return due
+
+
+class AuctionScheduler:
+    """Opens and ends the auctions of the database on time."""
+
+    def __init__(
+        self,
+        tick=None,
+        slots=None,
+        horizon=None,
+        refresh=None,
+        batch_size=None,
+        channel_layer=None,
+    ):
+        self.tick = tick or settings.AUCTION_SCHEDULER_TICK
+        self.horizon = horizon or settings.AUCTION_SCHEDULER_HORIZON
+        self.refresh = refresh or settings.AUCTION_SCHEDULER_REFRESH
+        self.batch_size = batch_size or settings.AUCTION_SCHEDULER_BATCH_SIZE
+        self.channel_layer = channel_layer or get_channel_layer()
+        self.wheel = TimingWheel(
+            self.tick, slots or settings.AUCTION_SCHEDULER_SLOTS, timezone.now()
+        )
+        self._loaded_at = None
+
+    # ----------------------
+    #  Deadlines
+    # ----------------------
+
+    def load(self, now=None):
+        """Schedule every deadline falling within the horizon."""
+        now = now or timezone.now()
+        until = now + timedelta(seconds=self.horizon)
+
+        starts = Auction.objects.filter(
+            status=Auction.Status.DRAFT, start_time__lt=until
+        ).values_list("pk", "start_time")
+        ends = Auction.objects.filter(
+            status=Auction.Status.ONGOING, end_time__lt=until
+        ).values_list("pk", "end_time")
+
+        for pk, start_time in starts.iterator():
+            self.wheel.schedule((START, str(pk)), start_time)
+        for pk, end_time in ends.iterator():
+            self.wheel.schedule((END, str(pk)), end_time)
+
+        self._loaded_at = now
+        metrics.set_gauge("scheduler_deadlines", len(self.wheel))
+        return len(self.wheel)
+
+    def reschedule(self, auction_id, end_time):
+        """Move the end deadline of an auction, in O(1)."""
+        now = timezone.now()
+        if end_time < now + timedelta(seconds=self.horizon):
+            self.wheel.schedule((END, str(auction_id)), end_time)
+        else:
+            # Picked up again by the refresh once it enters the horizon
+            self.wheel.cancel((END, str(auction_id)))
+
+    # ----------------------
+    #  Ticks
+    # ----------------------
+
+    def run(self, stop=None):
+        """Tick until stop is set."""
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            close_old_connections()
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.exception(f"Auction scheduler tick failed: {str(e)}")
+            stop.wait(self.tick)
+        close_old_connections()
+
+    def run_once(self, now=None):
+        """Move the auctions due by now and return how many deadlines fired."""
+        now = now or timezone.now()
+        if (
+            self._loaded_at is None
+            or (now - self._loaded_at).total_seconds() >= self.refresh
+        ):
+            self.load(now)
+
+        due = self.wheel.advance(now)
+        starts = [auction_id for kind, auction_id in due if kind == START]
+        ends = [auction_id for kind, auction_id in due if kind == END]
+
+        for index in range(0, len(starts), self.batch_size):
+            self._start(starts[index : index + self.batch_size], now)
+        for index in range(0, len(ends), self.batch_size):
+            self._end(ends[index : index + self.batch_size], now)
+
+        return len(due)
+
+    def _start(self, auction_ids, now):
+        with transaction.atomic():
+            auctions = list(
+                Auction.objects.select_for_update()
+                .filter(pk__in=auction_ids, status=Auction.Status.DRAFT)
+                .only("id", "category_id", "start_time", "end_time")
+            )
+            started = self._split_due(auctions, "start_time", START, now)
+            Auction.objects.filter(pk__in=[a.pk for a in started]).update(
+                status=Auction.Status.ONGOING, updated_at=now
+            )
+
+        for auction in started:
+            auction.status = Auction.Status.ONGOING
+            self.reschedule(auction.pk, auction.end_time)
+            self._broadcast(
+                lifecycle_groups(auction),
+                "auction_started",
+                auction_started_event(auction),
+            )
+        metrics.increment("auctions_started", len(started))
+
+    def _end(self, auction_ids, now):
+        winners = Bid.objects.filter(pk=OuterRef("top_bid_id")).values("bidder_id")
+
+        with transaction.atomic():
+            auctions = list(
+                Auction.objects.select_for_update(of=("self",))
+                .select_related("top_bid")
+                .filter(pk__in=auction_ids, status=Auction.Status.ONGOING)
+                .only(
+                    "id",
+                    "category_id",
+                    "end_time",
+                    "top_bid__amount",
+                    "top_bid__bidder_id",
+                )
+            )
+            ended = self._split_due(auctions, "end_time", END, now)
+            Auction.objects.filter(pk__in=[a.pk for a in ended]).update(
+                status=Auction.Status.ENDED,
+                winner=Subquery(winners[:1]),
+                updated_at=now,
+            )
+            Bid.objects.filter(
+                pk__in=[a.top_bid_id for a in ended if a.top_bid_id]
+            ).update(is_winner=True)
+
+        for auction in ended:
+            auction.status = Auction.Status.ENDED
+            self._broadcast(
+                lifecycle_groups(auction), "auction_ended", auction_ended_event(auction)
+            )
+        metrics.increment("auctions_ended", len(ended))
+
+    def _split_due(self, auctions, field, kind, now):
+        """Return the auctions due by now, putting the others back in the wheel."""
+        due = []
+        for auction in auctions:
+            deadline = getattr(auction, field)
+            if deadline <= now:
+                due.append(auction)
+            elif kind == END:
+                self.reschedule(auction.pk, deadline)
+            else:
+                self.wheel.schedule((kind, str(auction.pk)), deadline)
+        return due
+
+    def _broadcast(self, groups, source, data):
+        event = broadcast_event(source, data)
+        for group in groups:
+            try:
+                async_to_sync(group_send)(self.channel_layer, group, event)
+            except Exception as e:
+                logger.error(f"Error broadcasting message: {str(e)}")
@@ -6,8 +6,10 @@ from api.auctions.models import (
     AuctionTransaction,
     Bid,
     Category,
+    ProxyBid,
 )
 from api.users.serializers import UserSerializer
+from django.conf import settings
 from django.db import IntegrityError
 from rest_framework import serializers
 
@@ -92,7 +94,7 @@ class AuctionSerializer(serializers.ModelSerializer):
     winner = UserSerializer(read_only=True)
     category = CategorySerializer(read_only=True)
     images = AuctionImageSerializer(many=True, read_only=True)
-    bids = BidSerializer(many=True, read_only=True)
+    bids = serializers.SerializerMethodField()
     highest_bid = serializers.SerializerMethodField()
     duration = serializers.SerializerMethodField()
     is_active = serializers.SerializerMethodField()
@@ -114,6 +116,9 @@ class AuctionSerializer(serializers.ModelSerializer):
             "starting_price",
             "current_price",
             "bid_increment",
+            "bid_sequence",
+            "bid_count",
+            "watcher_count",
             "status",
             "seller",
             "winner",
@@ -121,6 +126,8 @@ class AuctionSerializer(serializers.ModelSerializer):
             "watchers",
             "start_time",
             "end_time",
+            "soft_close_window",
+            "soft_close_extension",
             "created_at",
             "updated_at",
             "shipping_details",
@@ -137,6 +144,9 @@ class AuctionSerializer(serializers.ModelSerializer):
         read_only_fields = [
             "id",
             "current_price",
+            "bid_sequence",
+            "bid_count",
+            "watcher_count",
             "created_at",
             "updated_at",
             "highest_bid",
@@ -146,9 +156,21 @@ class AuctionSerializer(serializers.ModelSerializer):
             "user_bid",
         ]
 
+    # The ledger keeps every bid, only the latest ones are embedded
+    BIDS_LIMIT = 20
+
+    def get_bids(self, obj):
+        bids = list(
+            obj.bids.select_related("bidder").order_by("-placed_at")[: self.BIDS_LIMIT]
+        )
+        for bid in bids:
+            bid.auction = obj
+        return BidSerializer(bids, many=True, context=self.context).data
+
     def get_highest_bid(self, obj):
         highest_bid = obj.get_highest_bid()
         if highest_bid:
+            highest_bid.auction = obj
             return BidSerializer(highest_bid).data
         return None
 
@@ -217,6 +239,26 @@ class AuctionTransactionSerializer(serializers.ModelSerializer):
         return obj.final_price
 
 
+SOFT_CLOSE_EXTRA_KWARGS = {
+    "soft_close_window": {"max_value": settings.AUCTION_SOFT_CLOSE_MAX_WINDOW},
+    "soft_close_extension": {"max_value": settings.AUCTION_SOFT_CLOSE_MAX_EXTENSION},
+}
+
+
+def validate_soft_close(attrs, instance=None):
+    """Check the extension of a late bid does not exceed the window it falls in."""
+    window = attrs.get(
+        "soft_close_window", instance.soft_close_window if instance else 0
+    )
+    extension = attrs.get(
+        "soft_close_extension", instance.soft_close_extension if instance else 0
+    )
+    if extension > window:
+        raise serializers.ValidationError(
+            {"soft_close_extension": "Must not exceed soft_close_window"}
+        )
+
+
 class AuctionCreateSerializer(serializers.ModelSerializer):
     end_time = serializers.ListField(
         child=serializers.IntegerField(min_value=0), write_only=True
@@ -231,16 +273,23 @@ class AuctionCreateSerializer(serializers.ModelSerializer):
             "bid_increment",
             "category",
             "end_time",
+            "soft_close_window",
+            "soft_close_extension",
             "shipping_details",
             "payment_methods",
             "item_condition",
         ]
+        extra_kwargs = SOFT_CLOSE_EXTRA_KWARGS
 
     def validate_end_time(self, value):
         if not isinstance(value, list) or len(value) not in [2, 3, 4]:
             raise serializers.ValidationError("Invalid end_time format")
         return ConvertEndingTime(value)
 
+    def validate(self, attrs):
+        validate_soft_close(attrs)
+        return attrs
+
     def create(self, validated_data):
         # print('I got you: ',self.context['user'])
         validated_data["seller"] = self.context["user"]
@@ -272,10 +321,13 @@ class AuctionUpdateSerializer(serializers.ModelSerializer):
             "bid_increment",
             "category",
             "end_time",
+            "soft_close_window",
+            "soft_close_extension",
             "shipping_details",
             "payment_methods",
             "item_condition",
         ]
+        extra_kwargs = SOFT_CLOSE_EXTRA_KWARGS
 
     def validate_end_time(self, value):
         if not isinstance(value, list) or len(value) not in [2, 3, 4]:
@@ -300,18 +352,22 @@ class AuctionUpdateSerializer(serializers.ModelSerializer):
         if auction.status == Auction.Status.CANCELLED:
             raise serializers.ValidationError("Cannot edit cancelled auction")
 
+        validate_soft_close(attrs, auction)
         return attrs
 
     def update(self, instance, validated_data):
         """Update auction instance."""
         for attr, value in validated_data.items():
             setattr(instance, attr, value)
+        update_fields = [*validated_data, "updated_at"]
 
         # Update current_price if starting_price changed
         if "starting_price" in validated_data:
             instance.current_price = validated_data["starting_price"]
+            update_fields.append("current_price")
 
-        instance.save()
+        # Not the whole row, which would write back stale bid counters
+        instance.save(update_fields=update_fields)
         return instance
 
 
@@ -329,6 +385,18 @@ class BidCreateSerializer(serializers.ModelSerializer):
         return value
 
 
+class ProxyBidCreateSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ProxyBid
+        fields = ["max_amount"]
+
+    def validate_max_amount(self, value):
+        minimum = self.context["minimum"]
+        if value < minimum:
+            raise serializers.ValidationError(f"Maximum bid must be at least {minimum}")
+        return value
+
+
 class AuctionReportSerializer(serializers.ModelSerializer):
     class Meta:
         model = AuctionReport
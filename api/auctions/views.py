@@ -1,3 +1,10 @@
+import logging
+
+from api.realtime.codecs import broadcast_event
+from api.realtime.hub import group_send
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.contrib.auth import get_user_model
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
 from django.utils.timezone import localtime
@@ -7,6 +14,10 @@ from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 
+from . import bidding
+from .engine import bid_engine
+from .events import auction_extended_event, new_bid_event
+from .groups import bid_groups
 from .models import Auction, Category
 from .serializers import (
     AuctionCreateSerializer,
@@ -15,6 +26,8 @@ from .serializers import (
     CategorySerializer,
 )
 
+logger = logging.getLogger(__name__)
+
 
 @api_view(["POST"])
 @permission_classes([IsAuthenticated])
@@ -40,7 +53,7 @@ def create_auction(request):
 @permission_classes([IsAuthenticated])
 def get_auction(request, auctId):
     """Retrieve an auction"""
-    auction = get_object_or_404(Auction, pk=auctId)
+    auction = get_object_or_404(Auction.objects.with_top_bid(), pk=auctId)
     serializer = AuctionSerializer(auction)
     return Response(serializer.data, status=status.HTTP_200_OK)
 
@@ -72,35 +85,62 @@ def get_user_auctions(request):
 @permission_classes([IsAuthenticated])
 def place_bid(request, auctId):
     """Place a bid on an auction"""
-    auction = get_object_or_404(Auction, pk=auctId)
-
-    if request.user == auction.seller:
-        return Response(
-            {"error": "Sellers cannot bid on their own auctions"},
-            status=status.HTTP_403_FORBIDDEN,
-        )
 
     # The action of bidding more than the required bidding increment
     jump_bid = request.data.get("bid")
 
-    if jump_bid is None:
-        auction.current_price += auction.bid_increment
-    else:
-        if jump_bid > auction.current_price:
-            auction.current_price = jump_bid
-        else:
-            return Response(
-                {"error": "Bid must be higher than the current price"},
-                status=status.HTTP_400_BAD_REQUEST,
-            )
+    try:
+        bids = bidding.place_bid(auctId, request.user, jump_bid)
+    except bidding.BidRejected as e:
+        return Response(
+            {
+                "error": e.message,
+                "minimum": str(e.minimum) if e.minimum is not None else None,
+            },
+            status=status.HTTP_400_BAD_REQUEST,
+        )
 
-    auction.top_bidder = request.user
-    auction.save()
+    # The shard of the auction holds its price and end_time in memory
+    bid_engine.invalidate(auctId)
+    _broadcast_bids(bids, request.user)
 
-    serializer = AuctionSerializer(auction)
+    auction = get_object_or_404(Auction.objects.with_top_bid(), pk=auctId)
+    serializer = AuctionSerializer(auction, context={"user": request.user})
     return Response(serializer.data, status=status.HTTP_200_OK)
 
 
+def _broadcast_bids(bids, user):
+    """Broadcast committed bids as the auction consumer does."""
+    bid = bids[-1]
+    if bid.bidder_id == str(user.pk):
+        bidder = user
+    else:
+        # Placed by a proxy on behalf of another bidder
+        bidder = get_user_model().objects.get(pk=bid.bidder_id)
+
+    channel_layer = get_channel_layer()
+    groups = bid_groups(bid.auction_id, bid.category_id)
+    # Sent as is, not through the broadcast coalescer: it flushes on the event
+    # loop of the server, and a sync request only has one for the call
+    events = [
+        broadcast_event(
+            "new_bid", new_bid_event(bid, bidder, merged=len(bids)), key=bid.auction_id
+        )
+    ]
+    extended = [bid for bid in bids if bid.end_time is not None]
+    if extended:
+        events.append(
+            broadcast_event("auction_extended", auction_extended_event(extended[-1]))
+        )
+
+    for event in events:
+        for group in groups:
+            try:
+                async_to_sync(group_send)(channel_layer, group, event)
+            except Exception as e:
+                logger.error(f"Error broadcasting message: {str(e)}")
+
+
 def _handle_delete_auction(auction):
     # Delete all images from S3 for this auction
     for img in auction.images.all():
@@ -144,7 +184,7 @@ def update_auction(request, auctId):
 
     auction.name = request.data.get("name", auction.name)
     auction.description = request.data.get("description", auction.description)
-    auction.save()
+    auction.save(update_fields=["description", "updated_at"])
 
     serializer = AuctionSerializer(auction)
     return Response(serializer.data, status=status.HTTP_200_OK)
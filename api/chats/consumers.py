@@ -1,15 +1,18 @@
 import base64
-import json
 import logging
 import os
 from io import BytesIO
 
 import jwt
+from api import metrics
 from api.auctions.models import Auction
+from api.realtime.codecs import broadcast_event
+from api.realtime.connections import connection_registry
+from api.realtime.consumers import HandlerError, RealtimeConsumer
+from api.realtime.executors import ExecutorBusy, cpu_executor, db_executor
+from api.realtime.hub import group_send
 from api.users.models import User
 from api.users.serializers import UserSerializer
-from asgiref.sync import async_to_sync
-from channels.generic.websocket import WebsocketConsumer
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ObjectDoesNotExist
@@ -27,15 +30,47 @@ logger = logging.getLogger(__name__)
 MODE = settings.ENVIRONMENT
 
 
-class ChatConsumer(WebsocketConsumer):
-    """WebSocket consumer for handling real-time chat communication."""
+def _resize_thumbnail(base64_data):
+    """Decode a base64 image and return it resized to a thumbnail."""
+    # Remove metadata header if present
+    if "," in base64_data:
+        base64_data = base64_data.split(",")[1]
+
+    try:
+        image_data = base64.b64decode(base64_data)
+    except base64.binascii.Error as e:
+        raise ValueError("Invalid base64 base64_data") from e
+
+    # Load and resize the image using Pillow
+    try:
+        image = Image.open(BytesIO(image_data))
+        image.thumbnail((125, 125))
+    except UnidentifiedImageError:
+        raise ValueError("Cannot identify image file")
+
+    # Prepare file to be saved
+    output_io = BytesIO()
+    image_format = image.format or "JPEG"
+    image.save(output_io, format=image_format)
+    return output_io.getvalue()
+
+
+class ChatConsumer(RealtimeConsumer):
+    """WebSocket consumer for handling real-time chat communication.
+
+    Typing indicators are relayed straight from the event loop. The ORM work
+    of a handler runs on the bounded db executor and image resizing on the cpu
+    executor, so neither can hold up the relays and deliveries of others.
+    """
+
+    endpoint = "chats"
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.user = None
         self.username = None
 
-    def connect(self):
+    async def connect(self):
         """Authenticate and establish WebSocket connection."""
         print(settings.ENVIRONMENT == "DEVELOPMENT")
         try:
@@ -43,51 +78,51 @@ class ChatConsumer(WebsocketConsumer):
             if not token:
                 raise ValueError("No authentication token provided")
 
-            self.user = self._authenticate_token(token)
+            self.user = await self._authenticate_token(token)
             if not self.user:
                 raise ValueError("Invalid authentication credentials")
 
-            self._initialize_connection()
+            await self._initialize_connection()
             logger.info(f"✅ Authenticated WebSocket connection for user: {self.user}")
 
         except Exception as e:
             logger.error(f"🚨 WebSocket connection failed: {str(e)}")
-            self.close()
+            await self.close()
 
-    def disconnect(self, close_code):
+    async def disconnect(self, close_code):
         """Clean up on WebSocket disconnect."""
         if hasattr(self, "username") and self.username:
-            self._leave_group()
+            await self._leave_group()
             logger.info(f"User {self.username} disconnected with code: {close_code}")
 
-    def receive(self, text_data):
+    async def receive_json(self, content, **kwargs):
         """Handle incoming WebSocket messages."""
         try:
-            data = self._parse_message(text_data)
-            handler = self._get_message_handler(data.get("source"))
+            if not isinstance(content, dict):
+                raise ValueError("Message must be a JSON object")
+
+            # print('client receive data: ', content)
+
+            handler = self._get_message_handler(content.get("source"))
             if handler:
-                handler(data)
+                await handler(content)
             else:
-                self._send_error("Unsupported message type")
+                await self._send_error("Unsupported message type")
 
-        except json.JSONDecodeError:
-            self._send_error("Invalid message format")
+        except HandlerError as e:
+            await self._send_error(e.message)
+        except ExecutorBusy as e:
+            logger.warning(f"Refused {content.get('source')}: {str(e)}")
+            await self._send_error("Server busy, try again later")
         except Exception as e:
             logger.error(f"Error processing message: {str(e)}")
-            self._send_error("Internal server error")
+            await self._send_error("Internal server error")
 
     # ----------------------
     #  Authentication Helpers
     # ----------------------
 
-    def _extract_token(self):
-        """Extract token from query string."""
-        query_string = self.scope["query_string"].decode()
-        if "tokens=" in query_string:
-            return query_string.split("tokens=")[-1]
-        return None
-
-    def _authenticate_token(self, token):
+    async def _authenticate_token(self, token):
         """Validate JWT token and return user."""
         try:
             payload = jwt.decode(
@@ -96,7 +131,10 @@ class ChatConsumer(WebsocketConsumer):
                 algorithms=[os.getenv("JWT_ALGORITHM")],
                 options={"verify_signature": False},
             )
-            return get_user_model().objects.get(pk=payload["user_id"])
+            user = await get_user_model().objects.aget(pk=payload["user_id"])
+            # Closed when the token expires, unless a refresh_token comes first
+            self.arm_expiry(payload.get("exp"))
+            return user
         except jwt.ExpiredSignatureError:
             logger.warning("Expired authentication token")
         except jwt.DecodeError:
@@ -111,36 +149,25 @@ class ChatConsumer(WebsocketConsumer):
     #  Connection Management
     # ----------------------
 
-    def _initialize_connection(self):
+    async def _initialize_connection(self):
         """Set up user connection and groups."""
         self.scope["user"] = self.user
         self.username = self.user.username
 
         # Join user to their personal group
-        async_to_sync(self.channel_layer.group_add)(self.username, self.channel_name)
-        self.accept()
+        await self.group_add(self.username)
+        await self.register_connection(self.user)
+        await self.accept()
+        await self.resume(self.username)
 
-    def _leave_group(self):
+    async def _leave_group(self):
         """Remove connection from user group."""
-        async_to_sync(self.channel_layer.group_discard)(
-            self.username, self.channel_name
-        )
+        await self.group_discard(self.username)
 
     # ----------------------
     #  Message Handling
     # ----------------------
 
-    def _parse_message(self, text_data):
-        """Parse and validate incoming message."""
-        data = json.loads(text_data)
-
-        # print('client receive data: ', json.dumps(data, indent=2))
-        # print('client receive data: ', data)
-
-        if not isinstance(data, dict):
-            raise ValueError("Message must be a JSON object")
-        return data
-
     def _get_message_handler(self, message_type):
         """Get appropriate handler for message type."""
         handlers = {
@@ -154,40 +181,25 @@ class ChatConsumer(WebsocketConsumer):
         }
         return handlers.get(message_type)
 
-    def _handle_thumbnail_update(self, data):
+    async def _handle_thumbnail_update(self, data):
         """Update user thumbnail."""
-
-        user = self.user
-
         base64_data = data.get("base64")
         filename = data.get("filename")
 
         if not base64_data or not filename:
             raise ValueError("Missing required thumbnail data")
 
-        # Remove metadata header if present
-        if "," in base64_data:
-            base64_data = base64_data.split(",")[1]
-
-        try:
-            image_data = base64.b64decode(base64_data)
-        except base64.binascii.Error as e:
-            raise ValueError("Invalid base64 base64_data") from e
-
-        # Load and resize the image using Pillow
-        try:
-            image = Image.open(BytesIO(image_data))
-            image.thumbnail((125, 125))
-        except UnidentifiedImageError:
-            raise ValueError("Cannot identify image file")
+        # Decoding and resizing is CPU bound, saving goes through the ORM
+        image_data = await cpu_executor.run(_resize_thumbnail, base64_data)
+        serialized = await db_executor.run(
+            self._save_thumbnail, ContentFile(image_data, name=filename), filename
+        )
 
-        # Prepare file to be saved
-        output_io = BytesIO()
-        image_format = image.format or "JPEG"
-        image.save(output_io, format=image_format)
-        output_io.seek(0)
+        # Broadcast update
+        await self._broadcast_to_user("thumbnail", serialized)
 
-        resized_image_file = ContentFile(output_io.read(), name=filename)
+    def _save_thumbnail(self, resized_image_file, filename):
+        user = self.user
 
         # Delete previous thumbnail if it's not the default
         current_thumbnail = user.thumbnail.name
@@ -210,16 +222,20 @@ class ChatConsumer(WebsocketConsumer):
         # Save new image
         user.thumbnail.save(filename, resized_image_file, save=True)
 
-        # Broadcast update
-        serialized = UserSerializer(user)
-        self._broadcast_to_user("thumbnail", serialized.data)
+        return UserSerializer(user).data
 
-    def _handle_fetch_conversations(self, data):
+    async def _handle_fetch_conversations(self, data):
         """Fetches the list of conversation the user had."""
-        user = self.user
         request_data = data.get("data", {})
         page = request_data.get("page", 1)
-        page_size = 20
+
+        conversations = await db_executor.run(self._fetch_conversations, page)
+
+        # print('serialized: ', conversations)
+        await self._broadcast_to_user("conversationsList", conversations)
+
+    def _fetch_conversations(self, page, page_size=20):
+        user = self.user
 
         start = (page - 1) * page_size
         end = page * page_size + 1  # Fetch one extra to check for next page
@@ -252,23 +268,18 @@ class ChatConsumer(WebsocketConsumer):
 
         has_next = base_qs.count() > page_size
 
-        # print('serialized: ', serialized.data)
-        self._broadcast_to_user(
-            "conversationsList",
-            {
-                "data": serialized.data,
-                "pagination": {
-                    "hasNext": has_next,
-                    "nextPage": next_page,
-                    "loaded": page != 1,
-                },
+        return {
+            "data": serialized.data,
+            "pagination": {
+                "hasNext": has_next,
+                "nextPage": next_page,
+                "loaded": page != 1,
             },
-        )
+        }
 
-    def _handle_message_send(self, data):
+    async def _handle_message_send(self, data):
         """Handle message send by a user to another user."""
         # print(data)
-        user = self.user
         request_data = data.get("data", {})
         ConnectionId = request_data.get("connectionId")
         content = request_data.get("content")
@@ -279,12 +290,34 @@ class ChatConsumer(WebsocketConsumer):
         #     f"Message send by {user.username} to connection {ConnectionId}: {content}"
         # )
 
+        delivery = await db_executor.run(
+            self._create_message, ConnectionId, content, auctionId
+        )
+        if delivery is None:
+            return
+        recipient, sender_data, recipient_data = delivery
+
+        # Broadcast to sender user the message
+        await self._broadcast_to_user("message_send", sender_data)
+
+        # Broadcast to the recipient user the message, when connected
+        if recipient_data is not None:
+            await self._broadcast_to_recipient(
+                recipient, "message_send", recipient_data
+            )
+
+    def _create_message(self, ConnectionId, content, auctionId):
+        """Save a message and serialize it for its sender and its recipient."""
+        user = self.user
+
         try:
-            connection = Connection.objects.get(pk=ConnectionId)
+            connection = Connection.objects.select_related("sender", "receiver").get(
+                pk=ConnectionId
+            )
             # print('existing: ',connection)
         except Connection.DoesNotExist:
             print("Error: couldn't find connection")
-            return
+            return None
 
         # If auctionId is provided, check if the auction exists
         if auctionId:
@@ -292,7 +325,7 @@ class ChatConsumer(WebsocketConsumer):
                 auction = Auction.objects.get(pk=auctionId)
             except Auction.DoesNotExist:
                 print("Error: couldn't find auction")
-                return
+                return None
 
         message = Message.objects.create(
             connection=connection,
@@ -310,42 +343,50 @@ class ChatConsumer(WebsocketConsumer):
         serialized_message = MessageSerializer(message, context={"user": user})
 
         serialized_friend = UserSerializer(recipient)
-        data = {
+        sender_data = {
             "connectionId": ConnectionId,
             "message": serialized_message.data,
             "friend": serialized_friend.data,
         }
 
-        # Broadcast to sender user the message
-        self._broadcast_to_user("message_send", data)
+        if not connection_registry.is_online(recipient.username):
+            # Fetched with the conversation when the recipient connects
+            metrics.increment("presence_skipped", source="message_send")
+            return recipient.username, sender_data, None
 
         # send new message to receiver
         serialized_message = MessageSerializer(message, context={"user": recipient})
 
         serialized_friend = UserSerializer(user)
-        data = {
+        recipient_data = {
             "connectionId": ConnectionId,
             "message": serialized_message.data,
             "friend": serialized_friend.data,
         }
 
-        # Broadcast to the recipient user the message
-        self._broadcast_to_recipient(recipient.username, "message_send", data)
+        return recipient.username, sender_data, recipient_data
 
-    def _handle_fetch_chat(self, data):
+    async def _handle_fetch_chat(self, data):
         """Fetchs the list of message a user had 2 users had."""
-
-        user = self.user
         request_data = data.get("data", {})
         ConnectionId = request_data.get("connectionId")
         page = request_data.get("page")
-        page_size = 12
+
+        data = await db_executor.run(self._fetch_chat, ConnectionId, page)
+        if data is None:
+            return
+
+        # send back to the requestor
+        await self._broadcast_to_user("fetchChatMessages", data)
+
+    def _fetch_chat(self, ConnectionId, page, page_size=12):
+        user = self.user
 
         try:
             connection = Connection.objects.get(pk=ConnectionId)
         except Connection.DoesNotExist:
             print("Error: couldn't find connection")
-            return
+            return None
 
         start = (page - 1) * page_size
         end = page * page_size
@@ -353,7 +394,7 @@ class ChatConsumer(WebsocketConsumer):
         # Check if the user is part of the connection
         # Safeguard against unauthorized access
         if user not in [connection.sender, connection.receiver]:
-            return self._send_error("Access denied")
+            raise HandlerError("Access denied")
 
         # Get messages per pagination
         base_qs = Message.objects.filter(connection=connection)
@@ -383,7 +424,7 @@ class ChatConsumer(WebsocketConsumer):
         next_page = page + 1 if has_next else None
 
         # print("base_qs.count(): ", base_qs.count())
-        data = {
+        return {
             "connectionId": ConnectionId,
             "messages": serialized_messages.data,
             "friend": serialized_friend.data,
@@ -395,26 +436,38 @@ class ChatConsumer(WebsocketConsumer):
             },
         }
 
-        # send back to the requestor
-        self._broadcast_to_user("fetchChatMessages", data)
-
-    def _handle_new_connection(self, data):
-        sender = self.user
+    async def _handle_new_connection(self, data):
         request_data = data.get("data", {})
         receiver_id = request_data.get("receiver_id")
         content = request_data.get("content", "").strip()
         auction_id = request_data.get("auctionId")  # Optional
 
         if not receiver_id or not content:
-            self._send_error("Receiver ID and content are required.")
+            await self._send_error("Receiver ID and content are required.")
             return
 
+        receiver, sender_data, receiver_data = await db_executor.run(
+            self._create_connection, receiver_id, content, auction_id
+        )
+
+        # Notify sender
+        await self._broadcast_to_user("new_connection", sender_data)
+
+        # Notify receiver, when connected
+        if receiver_data is not None:
+            await self._broadcast_to_recipient(
+                receiver.username, "new_connection", receiver_data
+            )
+
+    def _create_connection(self, receiver_id, content, auction_id):
+        """Open a connection with its first message, serialized for both users."""
+        sender = self.user
+
         try:
             receiver = User.objects.get(pk=receiver_id)
         except User.DoesNotExist:
             logger.error(f"Receiver with ID {receiver_id} not found.")
-            self._send_error("Recipient user not found.")
-            return
+            raise HandlerError("Recipient user not found.")
 
         # 🚫 Check for existing connection (sender <-> receiver or receiver <-> sender)
         existing_connection = Connection.objects.filter(
@@ -424,8 +477,7 @@ class ChatConsumer(WebsocketConsumer):
         if existing_connection:
             logger.info(f"Connection already exists between {sender} and {receiver}")
             # Optional: Send a notice instead of creating
-            self._send_error("Connection already exists.")
-            return
+            raise HandlerError("Connection already exists.")
 
         try:
             with transaction.atomic():
@@ -439,39 +491,36 @@ class ChatConsumer(WebsocketConsumer):
                 )
         except Exception as e:
             logger.error(f"Failed to create connection or message: {str(e)}")
-            self._send_error("Could not create new connection.")
-            return
+            raise HandlerError("Could not create new connection.")
 
         # 🔄 Broadcast setup
         message_for_sender = MessageSerializer(message, context={"user": sender}).data
-        message_for_receiver = MessageSerializer(
-            message, context={"user": receiver}
-        ).data
-
         connection_for_sender = ConversationSerializer(
             connection, context={"user": sender}
         ).data
+        friend_for_sender = UserSerializer(receiver).data
+        sender_data = {
+            "connection": connection_for_sender,
+            "message": message_for_sender,
+            "friend": friend_for_sender,
+        }
+
+        if not connection_registry.is_online(receiver.username):
+            # Listed with the conversations when the receiver connects
+            metrics.increment("presence_skipped", source="new_connection")
+            return receiver, sender_data, None
+
+        message_for_receiver = MessageSerializer(
+            message, context={"user": receiver}
+        ).data
         connection_for_receiver = ConversationSerializer(
             connection, context={"user": receiver}
         ).data
-
-        friend_for_sender = UserSerializer(receiver).data
         friend_for_receiver = UserSerializer(sender).data
 
-        # Notify sender
-        self._broadcast_to_user(
-            "new_connection",
-            {
-                "connection": connection_for_sender,
-                "message": message_for_sender,
-                "friend": friend_for_sender,
-            },
-        )
-
-        # Notify receiver
-        self._broadcast_to_recipient(
-            receiver.username,
-            "new_connection",
+        return (
+            receiver,
+            sender_data,
             {
                 "connection": connection_for_receiver,
                 "message": message_for_receiver,
@@ -479,7 +528,7 @@ class ChatConsumer(WebsocketConsumer):
             },
         )
 
-    def _handle_typing_indicator(self, data):
+    async def _handle_typing_indicator(self, data):
         """Handle the message typing animation."""
 
         user = self.user
@@ -487,69 +536,61 @@ class ChatConsumer(WebsocketConsumer):
         ConnectionId = request_data.get("connectionId")
         recipient_username = request_data.get("username")
 
+        if not await self.is_online(recipient_username):
+            metrics.increment("presence_skipped", source="typingIndicator")
+            return
+
         data = {"username": user.username, "connectionId": ConnectionId}
 
-        self._broadcast_to_recipient(recipient_username, "typingIndicator", data)
+        # A pure relay, awaited on the event loop without touching a thread.
+        # Keyed by typist, a slow recipient only gets their latest indicator.
+        await self._broadcast_to_recipient(
+            recipient_username, "typingIndicator", data, key=user.username
+        )
 
-    def _handle_read_messages(self, data):
+    async def _handle_read_messages(self, data):
         """Handle marking messages as read."""
-        user = self.user
         request_data = data.get("data", {})
         connection_id = request_data.get("connectionId")
 
+        await db_executor.run(self._mark_read, connection_id)
+
+        # # Notify both users about the read status
+        # data = {
+        #     "connectionId": connection_id,
+        #     "readBy": user.username,
+        #     "unreadCount": 0,  # All messages are now read
+        # }
+
+        await self._broadcast_to_user("mark_read_messages", {})
+
+    def _mark_read(self, connection_id):
+        user = self.user
+
         try:
             connection = Connection.objects.get(pk=connection_id)
         except Connection.DoesNotExist:
             logger.error(f"Connection with ID {connection_id} not found.")
-            self._send_error("Connection not found.")
-            return
+            raise HandlerError("Connection not found.")
 
         # Check if the user is part of the connection
         if user not in [connection.sender, connection.receiver]:
-            return self._send_error("Access denied")
+            raise HandlerError("Access denied")
 
         # Mark all unread messages as read
         unread_messages = connection.messages.filter(isRead=False, user__is_active=True)
         unread_messages.update(isRead=True)
 
-        # # Notify both users about the read status
-        # data = {
-        #     "connectionId": connection_id,
-        #     "readBy": user.username,
-        #     "unreadCount": 0,  # All messages are now read
-        # }
-
-        self._broadcast_to_user("mark_read_messages", {})
-
     # ----------------------
     #  Response Methods
     # ----------------------
 
-    def _broadcast_to_user(self, source, data):
-        """Send data to the user's personal group."""
-        async_to_sync(self.channel_layer.group_send)(
-            self.username, {"type": "broadcast.message", "source": source, "data": data}
-        )
+    async def _broadcast_to_user(self, source, data):
+        """Reply to this connection, copied to the user's other devices."""
+        await self.send_reply(source, data)
 
-    def _broadcast_to_recipient(self, recipient, source, data):
+    async def _broadcast_to_recipient(self, recipient, source, data, key=None):
         """Send data to the user's personal group."""
-        async_to_sync(self.channel_layer.group_send)(
-            recipient, {"type": "broadcast.message", "source": source, "data": data}
+        await group_send(
+            self.channel_layer, recipient, broadcast_event(source, data, key=key)
         )
-
-    def _send_error(self, message):
-        """Send error message to client."""
-        self.send(text_data=json.dumps({"type": "error", "message": message}))
-
-    # ----------------------
-    #  Group Message Handlers
-    # ----------------------
-
-    def broadcast_message(self, event):
-        """Handle messages sent to the user's group."""
-        try:
-            self.send(
-                text_data=json.dumps({"source": event["source"], "data": event["data"]})
-            )
-        except Exception as e:
-            logger.error(f"Error broadcasting message: {str(e)}")
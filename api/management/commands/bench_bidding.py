@@ -0,0 +1,263 @@
+import asyncio
+import json
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+
+from channels.layers import InMemoryChannelLayer, channel_layers
+from channels.testing import WebsocketCommunicator
+from django.core.management.base import BaseCommand
+from django.db.backends.signals import connection_created
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+
+from api.auctions.engine import bid_engine
+from api.auctions.models import Auction, Category
+from api.users.models import User
+
+PREFIX = "bench_bidding"
+
+
+class QueryCounter:
+    """Counts the queries run on every database connection, in any thread."""
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def install(self, sender, connection, **kwargs):
+        # Fired again every time a worker thread reconnects
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+
+class Client:
+    """A simulated user bidding over its own WebSocket connection."""
+
+    def __init__(self, application, user, origin, timeout):
+        self.user = user
+        self.timeout = timeout
+        self.communicator = WebsocketCommunicator(
+            application,
+            f"/ws/auctions/?tokens={AccessToken.for_user(user)}",
+            headers=[(b"origin", origin.encode()), (b"host", b"localhost")],
+        )
+        self.latencies = []
+        self.accepted = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.bytes = 0
+
+    async def receive(self, timeout):
+        # Reading the output queue directly, a receive timeout on the
+        # communicator itself would cancel the consumer.
+        while True:
+            message = await asyncio.wait_for(
+                self.communicator.output_queue.get(), timeout
+            )
+            if message["type"] == "websocket.send":
+                payload = message.get("text") or message.get("bytes") or ""
+                self.bytes += len(payload)
+                return payload
+
+    async def run(self, auction_ids, bids):
+        connected, _ = await self.communicator.connect()
+        if not connected:
+            raise RuntimeError(f"{self.user.username} could not connect")
+
+        for auction_id in auction_ids:
+            await self.communicator.send_json_to(
+                {"source": "subscribe", "data": {"auction_id": auction_id}}
+            )
+
+        for _ in range(bids):
+            auction_id = random.choice(auction_ids)
+            sent_at = timezone.now()
+            started = time.perf_counter()
+            await self.communicator.send_json_to(
+                {"source": "place_bid", "data": {"auction_id": auction_id}}
+            )
+            await self._wait_for_broadcast(auction_id, sent_at, started)
+
+    async def _wait_for_broadcast(self, auction_id, sent_at, started):
+        """Wait for the broadcast carrying our bid, or for its rejection."""
+        deadline = started + self.timeout
+        while True:
+            remaining = deadline - time.perf_counter()
+            try:
+                payload = await self.receive(max(remaining, 0))
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                return
+
+            message = json.loads(payload) if isinstance(payload, str) else {}
+            source = message.get("source")
+            data = message.get("data") or {}
+            if not isinstance(data, dict) or data.get("auction_id") != auction_id:
+                continue
+
+            if source == "bid_rejected":
+                self.rejected += 1
+                return
+            # A coalesced broadcast includes our bid when its newest bid was
+            # placed after we sent ours.
+            placed_at = data.get("placed_at")
+            if source == "new_bid" and datetime.fromisoformat(placed_at) >= sent_at:
+                self.accepted += 1
+                self.latencies.append(time.perf_counter() - started)
+                return
+
+    async def close(self):
+        # Count whatever was broadcast to us after our last bid
+        while True:
+            try:
+                await self.receive(0.2)
+            except asyncio.TimeoutError:
+                break
+        await self.communicator.disconnect()
+
+
+def _percentile(values, percent):
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test AuctionConsumer with simulated clients bidding over "
+        "WebSockets, reporting throughput, bid to broadcast latency, queries "
+        "and outbound bytes per bid."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--clients", type=int, default=50)
+        parser.add_argument("--auctions", type=int, default=5)
+        parser.add_argument(
+            "--bids", type=int, default=20, help="Bids placed by each client."
+        )
+        parser.add_argument("--layer", choices=["memory", "redis"], default="memory")
+        parser.add_argument("--redis-url", default="redis://127.0.0.1:6379")
+        parser.add_argument(
+            "--timeout",
+            type=float,
+            default=5,
+            help="Seconds a client waits for the broadcast of its bid.",
+        )
+        parser.add_argument(
+            "--origin",
+            default="http://localhost",
+            help="Origin header, must match ALLOWED_HOSTS.",
+        )
+
+    def handle(self, *args, **options):
+        channel_layers.set("default", self._channel_layer(options))
+
+        seller, users, auctions = self._create_data(options)
+        try:
+            report = asyncio.run(self._bench(users, auctions, options))
+        finally:
+            bid_engine.stop()
+            Auction.objects.filter(seller=seller).delete()
+            User.objects.filter(username__startswith=PREFIX).delete()
+
+        self._write_report(report, options)
+
+    def _channel_layer(self, options):
+        if options["layer"] == "memory":
+            return InMemoryChannelLayer()
+
+        from channels_redis.core import RedisChannelLayer
+
+        return RedisChannelLayer(hosts=[options["redis_url"]])
+
+    def _create_data(self, options):
+        seller = User.objects.create_user(
+            f"{PREFIX}_seller", f"{PREFIX}_seller@example.com", None
+        )
+        users = [
+            User.objects.create_user(
+                f"{PREFIX}_{index}", f"{PREFIX}_{index}@example.com", None
+            )
+            for index in range(options["clients"])
+        ]
+        category, _ = Category.objects.get_or_create(name=PREFIX)
+        auctions = Auction.objects.bulk_create(
+            Auction(
+                title=f"Bench {index}",
+                description="Bidding benchmark",
+                starting_price=1,
+                current_price=1,
+                bid_increment=1,
+                seller=seller,
+                category=category,
+                status=Auction.Status.ONGOING,
+                end_time=timezone.now() + timedelta(hours=1),
+            )
+            for index in range(options["auctions"])
+        )
+        return seller, users, [str(auction.pk) for auction in auctions]
+
+    async def _bench(self, users, auction_ids, options):
+        from auctionBackend.asgi import application
+
+        clients = [
+            Client(application, user, options["origin"], options["timeout"])
+            for user in users
+        ]
+        queries = QueryCounter()
+        connection_created.connect(queries.install)
+        try:
+            started = time.perf_counter()
+            await asyncio.gather(
+                *(client.run(auction_ids, options["bids"]) for client in clients)
+            )
+            elapsed = time.perf_counter() - started
+            await asyncio.gather(*(client.close() for client in clients))
+        finally:
+            connection_created.disconnect(queries.install)
+
+        return {
+            "elapsed": elapsed,
+            "accepted": sum(client.accepted for client in clients),
+            "rejected": sum(client.rejected for client in clients),
+            "timeouts": sum(client.timeouts for client in clients),
+            "latencies": sorted(
+                latency for client in clients for latency in client.latencies
+            ),
+            "queries": queries.count,
+            "bytes": sum(client.bytes for client in clients),
+        }
+
+    def _write_report(self, report, options):
+        accepted = report["accepted"]
+        latencies = report["latencies"]
+        per_bid = max(accepted, 1)
+
+        self.stdout.write(
+            f"{options['clients']} clients, {options['auctions']} auctions, "
+            f"{options['layer']} channel layer"
+        )
+        self.stdout.write(
+            f"Accepted {accepted} bids in {report['elapsed']:.2f} s "
+            f"({accepted / report['elapsed']:.1f} bids/s), "
+            f"{report['rejected']} rejected, {report['timeouts']} timed out"
+        )
+        self.stdout.write(
+            "Bid to broadcast "
+            + ", ".join(
+                f"p{percent} {_percentile(latencies, percent) * 1000:.1f} ms"
+                for percent in (50, 95, 99)
+            )
+        )
+        self.stdout.write(
+            f"{report['queries'] / per_bid:.2f} queries per bid, "
+            f"{report['bytes'] / per_bid:.0f} outbound bytes per bid "
+            f"({report['bytes']} total)"
+        )
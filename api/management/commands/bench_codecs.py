@@ -0,0 +1,157 @@
+import time
+from datetime import timedelta
+
+import msgpack
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from api.auctions.events import new_bid_event
+from api.auctions.models import Auction, Bid, Category
+from api.auctions.serializers import AuctionSerializer
+from api.chats.models import Connection, Message
+from api.chats.serializers import MessageSerializer
+from api.realtime.codecs import json_codec, msgpack_codec
+from api.users.serializers import UserSerializer
+from api.users.models import User
+
+PREFIX = "bench_codecs"
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the size and the encode/decode time of JSON and MessagePack "
+        "frames on realistic payloads. Everything is rolled back at the end."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--bids", type=int, default=5, help="Bids on each listed auction."
+        )
+        parser.add_argument(
+            "--seconds",
+            type=float,
+            default=0.5,
+            help="Time spent timing each codec on each payload.",
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            payloads = self._payloads(options)
+            transaction.set_rollback(True)
+
+        codecs = [
+            ("json", json_codec.encode, json_codec.decode),
+            ("msgpack", msgpack_codec.encode, msgpack_codec.decode),
+            # What the ext types cost and save, against plain MessagePack
+            ("msgpack, no ext", msgpack.packb, msgpack.unpackb),
+        ]
+        self.stdout.write(
+            f"{'payload':<20}{'codec':<17}{'bytes':>8}{'ratio':>7}"
+            f"{'encode':>11}{'decode':>11}"
+        )
+        for name, frame in payloads:
+            expected = json_codec.decode(json_codec.encode(frame))
+            json_size = None
+            for codec, encode, decode in codecs:
+                encoded = encode(frame)
+                if decode(encoded) != expected:
+                    raise RuntimeError(f"{name} does not round trip with {codec}")
+                size = len(encoded.encode() if isinstance(encoded, str) else encoded)
+                json_size = json_size or size
+
+                self.stdout.write(
+                    f"{name:<20}{codec:<17}{size:>8}{size / json_size:>7.2f}"
+                    f"{self._time(encode, frame, options['seconds']):>9.1f}us"
+                    f"{self._time(decode, encoded, options['seconds']):>9.1f}us"
+                )
+
+    def _payloads(self, options):
+        seller = User.objects.create_user(
+            f"{PREFIX}_seller", f"{PREFIX}_seller@example.com", None
+        )
+        bidders = [
+            User.objects.create_user(
+                f"{PREFIX}_{index}", f"{PREFIX}_{index}@example.com", None
+            )
+            for index in range(options["bids"])
+        ]
+        category, _ = Category.objects.get_or_create(name=PREFIX)
+
+        auctions = []
+        for index in range(10):
+            auction = Auction.objects.create(
+                title=f"Bench auction {index}",
+                description="A used car in good condition, serviced last month.",
+                starting_price=1000,
+                current_price=1000,
+                bid_increment=25,
+                seller=seller,
+                category=category,
+                status=Auction.Status.ONGOING,
+                end_time=timezone.now() + timedelta(days=3),
+            )
+            for amount, bidder in enumerate(bidders, start=1):
+                bid = Bid.objects.create(
+                    auction=auction, bidder=bidder, amount=1000 + 25 * amount
+                )
+            auction.top_bid = bid
+            auction.current_price = bid.amount
+            auction.save()
+            auctions.append(auction)
+
+        connection = Connection.objects.create(sender=seller, receiver=bidders[0])
+        messages = [
+            Message.objects.create(
+                connection=connection,
+                user=seller if index % 2 else bidders[0],
+                content="Is the car still available? I can pick it up tomorrow.",
+                auction=auctions[0] if index == 0 else None,
+            )
+            for index in range(12)
+        ]
+
+        auctions_list = AuctionSerializer(
+            auctions, context={"user": bidders[0]}, many=True
+        ).data
+        chat_messages = MessageSerializer(
+            messages, context={"user": seller}, many=True
+        ).data
+        bid.sequence = len(bidders)
+        bid.bid_count = len(bidders)
+        bid.auction_id = str(bid.auction_id)
+        new_bid = new_bid_event(bid, bidders[-1])
+
+        return [
+            (
+                "auctionsList",
+                {
+                    "source": "auctionsList",
+                    "data": {"auctions": auctions_list, "nextPage": 2, "loaded": False},
+                },
+            ),
+            (
+                "fetchChatMessages",
+                {
+                    "source": "fetchChatMessages",
+                    "data": {
+                        "connectionId": str(connection.pk),
+                        "messages": chat_messages,
+                        "friend": UserSerializer(bidders[0]).data,
+                    },
+                },
+            ),
+            ("new_bid", {"source": "new_bid", "data": new_bid}),
+        ]
+
+    def _time(self, func, value, seconds):
+        """Microseconds per call of func(value), averaged over seconds."""
+        calls = 0
+        started = time.perf_counter()
+        while True:
+            for _ in range(10):
+                func(value)
+            calls += 10
+            elapsed = time.perf_counter() - started
+            if elapsed >= seconds:
+                return elapsed / calls * 1e6
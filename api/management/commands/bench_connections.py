@@ -0,0 +1,204 @@
+import asyncio
+import json
+import time
+
+from asgiref.sync import async_to_sync
+from channels.generic.websocket import WebsocketConsumer
+from channels.layers import InMemoryChannelLayer, channel_layers
+from channels.routing import URLRouter
+from channels.security.websocket import AllowedHostsOriginValidator
+from channels.testing import WebsocketCommunicator
+from django.core.management.base import BaseCommand
+from django.urls import path
+from django_channels_jwt_auth_middleware.auth import JWTAuthMiddlewareStack
+from rest_framework_simplejwt.tokens import AccessToken
+
+from api.users.models import User
+
+PREFIX = "bench_connections"
+
+
+class SyncBaselineConsumer(WebsocketConsumer):
+    """The path a frame took through the sync AuctionConsumer, for comparison.
+
+    As before the async rewrite, each frame holds a thread of the sync
+    executor and channel layer calls block it through async_to_sync. Only
+    what the bench exercises is kept: authenticating, joining the personal
+    group and answering an unsubscribe with the subscriptions.
+    """
+
+    def connect(self):
+        query_string = self.scope["query_string"].decode()
+        token = query_string.split("tokens=")[-1].split("&")[0]
+        user_id = AccessToken(token, verify=False)["user_id"]
+        self.username = User.objects.get(pk=user_id).username
+        async_to_sync(self.channel_layer.group_add)(self.username, self.channel_name)
+        self.accept()
+
+    def disconnect(self, close_code):
+        async_to_sync(self.channel_layer.group_discard)(
+            self.username, self.channel_name
+        )
+
+    def receive(self, text_data=None, bytes_data=None):
+        json.loads(text_data)
+        self.send(text_data=json.dumps({"source": "subscriptions", "data": []}))
+
+
+def _percentile(values, percent):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+class Command(BaseCommand):
+    help = (
+        "Open WebSocket connections in steps and measure a round trip on all of "
+        "them at every step, to find how many concurrent connections one "
+        "process sustains. Run it with --consumer sync, then without, to compare "
+        "with the sync consumer the async one replaced."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--connections", type=int, default=2000)
+        parser.add_argument(
+            "--step", type=int, default=250, help="Connections opened per step."
+        )
+        parser.add_argument(
+            "--users", type=int, default=50, help="Users the connections share."
+        )
+        parser.add_argument(
+            "--threshold-ms",
+            type=float,
+            default=500,
+            help="p95 round trip above which the process is saturated.",
+        )
+        parser.add_argument("--path", default="/ws/auctions/")
+        parser.add_argument(
+            "--consumer",
+            choices=["async", "sync"],
+            default="async",
+            help="The consumer of --path, or SyncBaselineConsumer to compare "
+            "against the sync consumer it replaced.",
+        )
+        parser.add_argument(
+            "--admission",
+            action="store_true",
+            help="Keep the admission limits, which otherwise refuse the "
+            "connections of the shared users long before the process saturates.",
+        )
+        parser.add_argument("--layer", choices=["memory", "redis"], default="memory")
+        parser.add_argument("--redis-url", default="redis://127.0.0.1:6379")
+        parser.add_argument(
+            "--origin",
+            default="http://localhost",
+            help="Origin header, must match ALLOWED_HOSTS.",
+        )
+
+    def handle(self, *args, **options):
+        if options["layer"] == "memory":
+            layer = InMemoryChannelLayer()
+        else:
+            from channels_redis.core import RedisChannelLayer
+
+            layer = RedisChannelLayer(hosts=[options["redis_url"]])
+        channel_layers.set("default", layer)
+
+        users = [
+            User.objects.create_user(
+                f"{PREFIX}_{index}", f"{PREFIX}_{index}@example.com", None
+            )
+            for index in range(options["users"])
+        ]
+        try:
+            asyncio.run(self._bench(users, options))
+        finally:
+            User.objects.filter(username__startswith=PREFIX).delete()
+
+    async def _bench(self, users, options):
+        from auctionBackend.asgi import application
+
+        websocket = application.application_mapping["websocket"]
+        if not options["admission"]:
+            # The AdmissionMiddleware in front of the rest of the stack
+            websocket = websocket.inner
+        if options["consumer"] == "sync":
+            # Behind the same middleware as the routes of the application
+            route = path(options["path"].lstrip("/"), SyncBaselineConsumer.as_asgi())
+            websocket = AllowedHostsOriginValidator(
+                JWTAuthMiddlewareStack(URLRouter([route]))
+            )
+        tokens = [str(AccessToken.for_user(user)) for user in users]
+        origin = options["origin"].encode()
+        communicators = []
+        sustained = 0
+
+        try:
+            while len(communicators) < options["connections"]:
+                opening = [
+                    WebsocketCommunicator(
+                        websocket,
+                        f"{options['path']}?tokens="
+                        f"{tokens[(len(communicators) + index) % len(tokens)]}",
+                        headers=[(b"origin", origin), (b"host", b"localhost")],
+                    )
+                    for index in range(options["step"])
+                ]
+                connect_times = await asyncio.gather(
+                    *(self._connect(communicator) for communicator in opening)
+                )
+                communicators.extend(opening)
+
+                round_trips = await asyncio.gather(
+                    *(self._round_trip(communicator) for communicator in communicators)
+                )
+                failed = round_trips.count(None)
+                round_trips = [rtt for rtt in round_trips if rtt is not None]
+                p95 = _percentile(round_trips, 95) * 1000
+
+                self.stdout.write(
+                    f"{len(communicators)} connections: "
+                    f"connect p95 {_percentile(connect_times, 95) * 1000:.1f} ms, "
+                    f"round trip p50 {_percentile(round_trips, 50) * 1000:.1f} ms "
+                    f"p95 {p95:.1f} ms, {failed} failed"
+                )
+                if failed or p95 > options["threshold_ms"]:
+                    break
+                sustained = len(communicators)
+        finally:
+            await asyncio.gather(
+                *(communicator.disconnect() for communicator in communicators),
+                return_exceptions=True,
+            )
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{options['consumer'].capitalize()} consumer: "
+                f"sustained {sustained} connections under "
+                f"{options['threshold_ms']:.0f} ms p95"
+            )
+        )
+
+    async def _connect(self, communicator):
+        started = time.perf_counter()
+        connected, _ = await communicator.connect(timeout=30)
+        if not connected:
+            raise RuntimeError("Connection refused")
+        return time.perf_counter() - started
+
+    async def _round_trip(self, communicator, timeout=10):
+        """Time an unsubscribe, answered without touching the database."""
+        started = time.perf_counter()
+        await communicator.send_json_to({"source": "unsubscribe", "data": {}})
+        try:
+            while True:
+                # Reading the output queue directly, a receive timeout on the
+                # communicator itself would cancel the consumer.
+                message = await asyncio.wait_for(
+                    communicator.output_queue.get(), timeout
+                )
+                if message["type"] == "websocket.send":
+                    return time.perf_counter() - started
+        except asyncio.TimeoutError:
+            return None
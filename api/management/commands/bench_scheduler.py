@@ -0,0 +1,128 @@
+import random
+import time
+from datetime import timedelta
+
+from channels.layers import InMemoryChannelLayer
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from api.auctions.models import Auction, Category
+from api.auctions.scheduler import AuctionScheduler
+from api.users.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the auction scheduler with many auctions ending in the same "
+        "minute, some of them extended by the soft close. Everything is rolled "
+        "back at the end."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--auctions",
+            type=int,
+            default=5000,
+            help="Number of auctions ending in the benchmarked minute.",
+        )
+        parser.add_argument(
+            "--extended",
+            type=float,
+            default=0.2,
+            help="Share of the auctions extended by a late bid.",
+        )
+        parser.add_argument(
+            "--extension",
+            type=int,
+            default=30,
+            help="Seconds a soft close extension adds.",
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self._run(options)
+            transaction.set_rollback(True)
+
+    def _run(self, options):
+        count = options["auctions"]
+        extension = timedelta(seconds=options["extension"])
+        now = timezone.now()
+        minute = now + timedelta(minutes=5)
+
+        seller = User.objects.create_user(
+            "bench_scheduler", "bench_scheduler@example.com", None
+        )
+        category, _ = Category.objects.get_or_create(name="bench_scheduler")
+        Auction.objects.bulk_create(
+            (
+                Auction(
+                    title=f"Bench {index}",
+                    description="Scheduler benchmark",
+                    starting_price=1,
+                    current_price=1,
+                    seller=seller,
+                    category=category,
+                    status=Auction.Status.ONGOING,
+                    end_time=minute + timedelta(seconds=60 * index / count),
+                    soft_close_window=60,
+                    soft_close_extension=options["extension"],
+                )
+                for index in range(count)
+            ),
+            batch_size=1000,
+        )
+
+        scheduler = AuctionScheduler(
+            tick=1, horizon=3600, refresh=3600, channel_layer=InMemoryChannelLayer()
+        )
+        started = time.perf_counter()
+        loaded = scheduler.load(now)
+        self._report(f"Loaded {loaded} deadlines", started)
+
+        # Late bids push some auctions out, like the soft close does
+        extended = random.sample(
+            list(Auction.objects.filter(seller=seller).values_list("pk", "end_time")),
+            int(count * options["extended"]),
+        )
+        for pk, end_time in extended:
+            Auction.objects.filter(pk=pk).update(end_time=end_time + extension)
+        started = time.perf_counter()
+        for pk, end_time in extended:
+            scheduler.reschedule(pk, end_time + extension)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"Rescheduled {len(extended)} deadlines in {elapsed * 1000:.2f} ms "
+            f"({elapsed / max(len(extended), 1) * 1e6:.2f} us each)"
+        )
+
+        ticks = []
+        fired = 0
+        second = minute
+        # One extra tick, deadlines fire on the first tick at or after them
+        last = minute + timedelta(seconds=61) + extension
+        with CaptureQueriesContext(connection) as queries:
+            while second <= last:
+                started = time.perf_counter()
+                fired += scheduler.run_once(second)
+                ticks.append(time.perf_counter() - started)
+                second += timedelta(seconds=1)
+
+        ended = Auction.objects.filter(
+            seller=seller, status=Auction.Status.ENDED
+        ).count()
+        ticks.sort()
+        self.stdout.write(
+            f"Fired {fired} deadlines over {len(ticks)} ticks, {ended} auctions "
+            f"ended with {len(queries)} queries"
+        )
+        self.stdout.write(
+            f"Tick p50 {ticks[len(ticks) // 2] * 1000:.2f} ms, "
+            f"p99 {ticks[int(len(ticks) * 0.99)] * 1000:.2f} ms, "
+            f"max {ticks[-1] * 1000:.2f} ms"
+        )
+
+    def _report(self, message, started):
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f"{message} in {elapsed * 1000:.2f} ms")
@@ -0,0 +1,242 @@
+import asyncio
+import base64
+import json
+import time
+from io import BytesIO
+
+from channels.layers import InMemoryChannelLayer, channel_layers
+from channels.testing import WebsocketCommunicator
+from django.core.management.base import BaseCommand
+from PIL import Image
+from rest_framework_simplejwt.tokens import AccessToken
+
+from api.chats.models import Connection
+from api.users.models import User
+
+PREFIX = "bench_typing"
+
+
+def _percentile(values, percent):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the typing indicator relay latency of ChatConsumer, idle and "
+        "while other clients send messages and upload thumbnails."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--pairs", type=int, default=20, help="Users typing to each other."
+        )
+        parser.add_argument(
+            "--typing", type=int, default=50, help="Typing frames sent per pair."
+        )
+        parser.add_argument(
+            "--load-clients",
+            type=int,
+            default=20,
+            help="Clients sending messages and thumbnails during the loaded run.",
+        )
+        parser.add_argument(
+            "--image-size",
+            type=int,
+            default=512,
+            help="Side in pixels of the uploaded thumbnail source images.",
+        )
+        parser.add_argument(
+            "--rate",
+            type=float,
+            default=10,
+            help="Messages and thumbnails per second sent by all load clients.",
+        )
+        parser.add_argument("--layer", choices=["memory", "redis"], default="memory")
+        parser.add_argument("--redis-url", default="redis://127.0.0.1:6379")
+        parser.add_argument(
+            "--origin",
+            default="http://localhost",
+            help="Origin header, must match ALLOWED_HOSTS.",
+        )
+
+    def handle(self, *args, **options):
+        if options["layer"] == "memory":
+            layer = InMemoryChannelLayer()
+        else:
+            from channels_redis.core import RedisChannelLayer
+
+            layer = RedisChannelLayer(hosts=[options["redis_url"]])
+        channel_layers.set("default", layer)
+
+        users = [
+            User.objects.create_user(
+                f"{PREFIX}_{index}", f"{PREFIX}_{index}@example.com", None
+            )
+            for index in range(2 * (options["pairs"] + options["load_clients"]))
+        ]
+        try:
+            asyncio.run(self._bench(users, options))
+        finally:
+            for user in User.objects.filter(username__startswith=PREFIX):
+                if user.thumbnail.name.startswith("thumbnails/"):
+                    user.thumbnail.delete(save=False)
+            User.objects.filter(username__startswith=PREFIX).delete()
+
+    async def _bench(self, users, options):
+        from auctionBackend.asgi import application
+
+        origin = options["origin"].encode()
+        communicators = {}
+        for user in users:
+            communicator = WebsocketCommunicator(
+                application,
+                f"/ws/chat/?tokens={AccessToken.for_user(user)}",
+                headers=[(b"origin", origin), (b"host", b"localhost")],
+            )
+            connected, _ = await communicator.connect(timeout=30)
+            if not connected:
+                raise RuntimeError(f"{user.username} could not connect")
+            communicators[user.username] = communicator
+
+        pairs = options["pairs"]
+        typists = [(users[2 * i], users[2 * i + 1]) for i in range(pairs)]
+        loaders = [
+            (users[2 * i], users[2 * i + 1]) for i in range(pairs, len(users) // 2)
+        ]
+        connection_ids = await self._create_connections(loaders)
+        image = self._image(options["image_size"])
+
+        try:
+            idle = await self._typing(typists, communicators, options["typing"])
+            self._report("Idle", idle)
+
+            stop = asyncio.Event()
+            load = [
+                asyncio.create_task(
+                    self._load(
+                        communicators[sender.username],
+                        connection_id,
+                        image,
+                        len(loaders) / options["rate"],
+                        stop,
+                    )
+                )
+                for (sender, _), connection_id in zip(loaders, connection_ids)
+            ]
+            started = time.perf_counter()
+            loaded = await self._typing(typists, communicators, options["typing"])
+            elapsed = time.perf_counter() - started
+            stop.set()
+            sent = await asyncio.gather(*load)
+
+            self._report("Loaded", loaded)
+            self.stdout.write(
+                f"Load: {sum(count for count, _ in sent)} messages and "
+                f"{sum(count for _, count in sent)} thumbnails in {elapsed:.2f} s"
+            )
+        finally:
+            await asyncio.gather(
+                *(communicator.disconnect() for communicator in communicators.values()),
+                return_exceptions=True,
+            )
+
+    async def _create_connections(self, loaders):
+        from channels.db import database_sync_to_async
+
+        @database_sync_to_async
+        def create():
+            return [
+                str(Connection.objects.create(sender=sender, receiver=receiver).pk)
+                for sender, receiver in loaders
+            ]
+
+        return await create()
+
+    def _image(self, size):
+        """A thumbnail frame carrying a noisy PNG, as costly to resize as a photo."""
+        output = BytesIO()
+        Image.effect_noise((size, size), 64).convert("RGB").save(output, "PNG")
+        # Encoded once, the client side of the benchmark shares the event loop
+        return json.dumps(
+            {
+                "source": "thumbnail",
+                "base64": base64.b64encode(output.getvalue()).decode(),
+                "filename": "bench.png",
+            }
+        )
+
+    async def _typing(self, typists, communicators, count):
+        latencies = await asyncio.gather(
+            *(
+                self._type(
+                    communicators[sender.username],
+                    communicators[receiver.username],
+                    receiver.username,
+                    count,
+                )
+                for sender, receiver in typists
+            )
+        )
+        return [latency for pair in latencies for latency in pair]
+
+    async def _type(self, sender, receiver, username, count, timeout=10):
+        latencies = []
+        for _ in range(count):
+            started = time.perf_counter()
+            await sender.send_json_to(
+                {
+                    "source": "message_typing",
+                    "data": {"connectionId": None, "username": username},
+                }
+            )
+            # Reading the output queue directly, a receive timeout on the
+            # communicator itself would cancel the consumer.
+            message = await asyncio.wait_for(receiver.output_queue.get(), timeout)
+            if message["type"] == "websocket.send":
+                latencies.append(time.perf_counter() - started)
+        return latencies
+
+    async def _load(self, communicator, connection_id, image, interval, stop):
+        """Alternate between sending a message and uploading a thumbnail."""
+        messages = thumbnails = 0
+        while not stop.is_set():
+            started = time.perf_counter()
+            await communicator.send_json_to(
+                {
+                    "source": "message_send",
+                    "data": {"connectionId": connection_id, "content": "Hello"},
+                }
+            )
+            await self._wait_for(communicator, "message_send")
+            messages += 1
+
+            await communicator.send_to(text_data=image)
+            await self._wait_for(communicator, "thumbnail")
+            thumbnails += 1
+
+            # Paced, so the offered load is the same whatever the consumer
+            await asyncio.sleep(max(interval - (time.perf_counter() - started), 0))
+        return messages, thumbnails
+
+    async def _wait_for(self, communicator, source, timeout=30):
+        while True:
+            message = await asyncio.wait_for(communicator.output_queue.get(), timeout)
+            if message["type"] != "websocket.send":
+                continue
+            frame = json.loads(message["text"])
+            if frame.get("type") == "error":
+                raise RuntimeError(frame["message"])
+            if frame.get("source") == source:
+                return
+
+    def _report(self, label, latencies):
+        self.stdout.write(
+            f"{label} typing relay over {len(latencies)} frames: "
+            + ", ".join(
+                f"p{percent} {_percentile(latencies, percent) * 1000:.1f} ms"
+                for percent in (50, 95, 99)
+            )
+        )
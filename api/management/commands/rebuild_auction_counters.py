@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from api.auctions.models import Auction
+
+
+class Command(BaseCommand):
+    help = "Recompute bid_count, watcher_count and top_bid of every auction."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Number of auctions updated per statement.",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        ids = Auction.objects.order_by("pk").values_list("pk", flat=True)
+
+        total = 0
+        last_id = None
+        while True:
+            # Keyset pagination keeps every batch an index range scan
+            batch_qs = ids if last_id is None else ids.filter(pk__gt=last_id)
+            batch = list(batch_qs[:batch_size])
+            if not batch:
+                break
+
+            total += Auction.objects.filter(pk__in=batch).rebuild_counters()
+            last_id = batch[-1]
+            self.stdout.write(f"Rebuilt {total} auctions")
+
+        self.stdout.write(self.style.SUCCESS(f"Done, {total} auctions rebuilt."))
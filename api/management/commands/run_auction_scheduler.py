@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from api.auctions.scheduler import AuctionScheduler
+
+
+class Command(BaseCommand):
+    help = "Open and end auctions when their start_time and end_time pass."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Run a single pass over the overdue auctions and exit.",
+        )
+
+    def handle(self, *args, **options):
+        scheduler = AuctionScheduler()
+        loaded = scheduler.load()
+        self.stdout.write(f"Loaded {loaded} upcoming deadlines")
+
+        if options["once"]:
+            fired = scheduler.run_once()
+            self.stdout.write(self.style.SUCCESS(f"Done, {fired} deadlines fired."))
+            return
+
+        try:
+            scheduler.run()
+        except KeyboardInterrupt:
+            self.stdout.write("Auction scheduler stopped.")
@@ -0,0 +1,83 @@
+"""Process-local counters and gauges.
+
+Values live in the memory of the worker process that recorded them, which is
+enough to spot contention and slow clients on a given worker without pulling
+in a metrics backend.
+
+A label with no bound on its values, such as an auction id, would make the
+counters grow for the life of the process. Those go through increment_top(),
+which only keeps the TOP_KEYS largest counts of a counter.
+"""
+
+import threading
+from collections import defaultdict
+
+# Values of an unbounded label kept per counter
+TOP_KEYS = 100
+
+_lock = threading.Lock()
+_counters = defaultdict(int)
+_gauges = {}
+# Counter keys of each (name, label) tracked by increment_top()
+_top_keys = defaultdict(set)
+
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def increment(name, value=1, **labels):
+    """Add value to the counter identified by name and labels."""
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] += value
+
+
+def increment_top(name, label, value, amount=1):
+    """Add amount to the counter of name for one value of an unbounded label.
+
+    The counter without the label counts every value. Past TOP_KEYS values,
+    the smallest count is dropped to make room for a new value, so the hot
+    ones stay listed while a long tail of single events does not pile up.
+    """
+    total = _key(name, {})
+    key = _key(name, {label: value})
+    with _lock:
+        _counters[total] += amount
+        keys = _top_keys[(name, label)]
+        if key not in keys:
+            if len(keys) >= TOP_KEYS:
+                smallest = min(keys, key=_counters.__getitem__)
+                keys.discard(smallest)
+                del _counters[smallest]
+            keys.add(key)
+        _counters[key] += amount
+
+
+def set_gauge(name, value, **labels):
+    """Set the gauge identified by name and labels to value."""
+    key = _key(name, labels)
+    with _lock:
+        _gauges[key] = value
+
+
+def add_to_gauge(name, value, **labels):
+    """Move the gauge identified by name and labels by value."""
+    key = _key(name, labels)
+    with _lock:
+        _gauges[key] = _gauges.get(key, 0) + value
+
+
+def snapshot():
+    """Return every counter and gauge as JSON serializable lists."""
+    with _lock:
+        counters = list(_counters.items())
+        gauges = list(_gauges.items())
+
+    def _rows(items):
+        return [
+            {"name": name, "labels": dict(labels), "value": value}
+            for (name, labels), value in sorted(items)
+        ]
+
+    return {"counters": _rows(counters), "gauges": _rows(gauges)}
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-17 17:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0004_message_isread"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="auction",
+            name="bid_sequence",
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
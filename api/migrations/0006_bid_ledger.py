@@ -0,0 +1,59 @@
+# Generated by Django 5.1.7 on 2026-10-17 17:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def set_top_bids(apps, schema_editor):
+    """Point every auction at its highest existing bid."""
+    Auction = apps.get_model("api", "Auction")
+    Bid = apps.get_model("api", "Bid")
+
+    top_bids = Bid.objects.filter(auction=OuterRef("pk")).order_by(
+        "-amount", "placed_at"
+    )
+    Auction.objects.update(top_bid=Subquery(top_bids.values("pk")[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0005_auction_bid_sequence"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="auction",
+            name="top_bid",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to="api.bid",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="bid",
+            index=models.Index(
+                fields=["auction", "-amount", "placed_at"],
+                name="api_bid_auction_75a2ec_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="bid",
+            index=models.Index(
+                fields=["auction", "bidder", "-amount"],
+                name="api_bid_auction_6f3d56_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="bid",
+            index=models.Index(
+                fields=["auction", "-placed_at"],
+                name="api_bid_auction_9bfb06_idx",
+            ),
+        ),
+        migrations.RunPython(set_top_bids, migrations.RunPython.noop),
+    ]
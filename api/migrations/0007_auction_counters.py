@@ -0,0 +1,64 @@
+# Generated by Django 5.1.7 on 2026-10-17 17:52
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_bids_and_watchers(apps, schema_editor):
+    """Fill the new counters from the existing bids and watchers."""
+    Auction = apps.get_model("api", "Auction")
+    Bid = apps.get_model("api", "Bid")
+
+    bids = (
+        Bid.objects.filter(auction=OuterRef("pk"))
+        .order_by()
+        .values("auction")
+        .annotate(total=Count("pk"))
+        .values("total")
+    )
+    watchers = (
+        Auction.watchers.through.objects.filter(auction=OuterRef("pk"))
+        .order_by()
+        .values("auction")
+        .annotate(total=Count("pk"))
+        .values("total")
+    )
+    Auction.objects.update(
+        bid_count=Coalesce(Subquery(bids), 0),
+        watcher_count=Coalesce(Subquery(watchers), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0006_bid_ledger"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="auction",
+            name="bid_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="auction",
+            name="watcher_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name="auction",
+            index=models.Index(
+                fields=["status", "-bid_count"], name="api_auction_status_4a56e5_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="auction",
+            index=models.Index(
+                fields=["status", "-watcher_count"],
+                name="api_auction_status_f1ecd5_idx",
+            ),
+        ),
+        migrations.RunPython(count_bids_and_watchers, migrations.RunPython.noop),
+    ]
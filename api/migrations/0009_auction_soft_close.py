@@ -0,0 +1,23 @@
+# Generated by Django 5.1.7 on 2026-10-17 18:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0008_proxy_bid"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="auction",
+            name="soft_close_extension",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="auction",
+            name="soft_close_window",
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
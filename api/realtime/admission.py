@@ -0,0 +1,217 @@
+"""Admission control in front of the WebSocket routes.
+
+After a deploy or a Redis blip every client reconnects at once, and each
+handshake decodes a token, queries the user and joins groups. AdmissionMiddleware
+wraps the WebSocket application and lets handshakes in at a pace the process
+can take:
+
+- at most REALTIME_HANDSHAKE_RATE handshakes a second, per process; a handshake
+  over the rate waits its turn, up to REALTIME_HANDSHAKE_QUEUE_TIMEOUT seconds,
+  so a burst is spread out rather than passed on
+- at most REALTIME_MAX_HANDSHAKES handshakes in progress at once, per process
+- per client IP and per user, token buckets refilled at REALTIME_IP_CONNECT_RATE
+  and REALTIME_USER_CONNECT_RATE a second and holding up to the matching
+  ``_BURST``, so a client reconnecting in a loop cannot take everyone's turn;
+  the user is only known, and charged, from a token with a valid signature
+
+The IP of a client is the one uvicorn puts in the scope. Behind the proxy of
+the hosting platform it must trust the proxy's X-Forwarded-For, which is what
+``--proxy-headers --forwarded-allow-ips`` in the Procfile is for: the private
+ranges by default, FORWARDED_ALLOW_IPS for a proxy elsewhere. Otherwise every
+client has the proxy's IP and shares one bucket; set REALTIME_IP_CONNECT_RATE
+to 0 to turn the IP limit off rather than run it that way.
+
+A refused handshake is accepted then closed with code 4429, the reason holding
+the seconds to wait before retrying. The delay carries random jitter so the
+clients refused together do not come back together.
+"""
+
+import asyncio
+import logging
+import random
+import time
+from collections import OrderedDict
+
+from api import metrics
+from django.conf import settings
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+logger = logging.getLogger(__name__)
+
+# Close code telling a client to reconnect after the seconds in the reason
+RETRY_LATER_CLOSE_CODE = 4429
+
+
+class TokenBucket:
+    """Allows rate events a second on average, and bursts of up to burst."""
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def reserve(self, now, max_wait=0):
+        """Take a token, returning the seconds to wait for it; None if too long.
+
+        The token may be one refilled within max_wait seconds, taken ahead.
+        """
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        wait = max(1 - self.tokens, 0) / self.rate
+        if wait > max_wait:
+            return None
+        self.tokens -= 1
+        return wait
+
+    def retry_after(self):
+        """Seconds until the next token is refilled."""
+        return max(1 - self.tokens, 0) / self.rate
+
+
+class _Buckets:
+    """Token buckets by key, those of the least recently seen keys dropped."""
+
+    max_keys = 100000
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._buckets = OrderedDict()
+
+    def take(self, key, now):
+        """Take a token of key's bucket, returning None or the seconds to wait."""
+        bucket = self._buckets.pop(key, None) or TokenBucket(self.rate, self.burst, now)
+        self._buckets[key] = bucket
+        if len(self._buckets) > self.max_keys:
+            # A dropped bucket comes back full, erring on the side of the client
+            self._buckets.popitem(last=False)
+        if bucket.reserve(now) is None:
+            return bucket.retry_after()
+        return None
+
+
+def _client_ip(scope):
+    client = scope.get("client")
+    return client[0] if client else None
+
+
+def _user_id(scope):
+    # Verified: ids are public (every new_bid carries the bidder's), so a key
+    # taken from an unsigned claim would let anyone drain another user's bucket
+    query_string = scope.get("query_string", b"").decode()
+    if "tokens=" not in query_string:
+        return None
+    token = query_string.split("tokens=")[-1].split("&")[0]
+    try:
+        return AccessToken(token).get(api_settings.USER_ID_CLAIM)
+    except TokenError:
+        return None
+
+
+class AdmissionMiddleware:
+    """Paces and limits the WebSocket handshakes of the inner application."""
+
+    def __init__(self, inner):
+        self.inner = inner
+        self.max_handshakes = settings.REALTIME_MAX_HANDSHAKES
+        self.queue_timeout = settings.REALTIME_HANDSHAKE_QUEUE_TIMEOUT
+        rate = settings.REALTIME_HANDSHAKE_RATE
+        self._rate = TokenBucket(rate, rate, time.monotonic())
+        self._ips = None
+        if settings.REALTIME_IP_CONNECT_RATE > 0:
+            self._ips = _Buckets(
+                settings.REALTIME_IP_CONNECT_RATE, settings.REALTIME_IP_CONNECT_BURST
+            )
+        self._users = _Buckets(
+            settings.REALTIME_USER_CONNECT_RATE, settings.REALTIME_USER_CONNECT_BURST
+        )
+        self._loop = None
+        self._slots = None
+        self.in_progress = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "websocket":
+            return await self.inner(scope, receive, send)
+
+        now = time.monotonic()
+        for reason, buckets, key in (
+            ("ip", self._ips, _client_ip(scope)),
+            ("user", self._users, _user_id(scope)),
+        ):
+            if buckets is None or key is None:
+                continue
+            retry_after = buckets.take(key, now)
+            if retry_after is not None:
+                return await self._refuse(receive, send, reason, retry_after)
+
+        wait = self._rate.reserve(now, self.queue_timeout)
+        if wait is None:
+            return await self._refuse(receive, send, "rate", self._rate.retry_after())
+        if wait:
+            metrics.increment("handshakes_paced")
+            await asyncio.sleep(wait)
+
+        self._bind()
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            return await self._refuse(receive, send, "busy", self.queue_timeout)
+        self._set_in_progress(1)
+
+        released = False
+
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                self._slots.release()
+                self._set_in_progress(-1)
+
+        async def admitted_send(message):
+            # The handshake is over once the connection is accepted or refused
+            if message["type"] in ("websocket.accept", "websocket.close"):
+                release()
+            await send(message)
+
+        metrics.increment("handshakes_admitted")
+        try:
+            return await self.inner(scope, receive, admitted_send)
+        finally:
+            release()
+
+    def _bind(self):
+        # As the broadcast hub, the semaphore belongs to its event loop
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._slots = asyncio.Semaphore(self.max_handshakes)
+            self.in_progress = 0
+
+    def _set_in_progress(self, delta):
+        self.in_progress += delta
+        metrics.set_gauge("handshakes_in_progress", self.in_progress)
+
+    async def _refuse(self, receive, send, reason, retry_after):
+        """Close the connection with the seconds to wait, jittered, as reason."""
+        # Up to twice the wait, spreading the retries of clients refused together
+        retry_after = max(retry_after, 1) * (1 + random.random())
+        metrics.increment("handshakes_refused", reason=reason)
+        logger.warning(
+            f"Refused WebSocket handshake ({reason}), retry in {retry_after:.1f}s"
+        )
+
+        message = await receive()
+        if message["type"] != "websocket.connect":
+            return
+        # A close code only reaches the client of an accepted connection
+        await send({"type": "websocket.accept"})
+        await send(
+            {
+                "type": "websocket.close",
+                "code": RETRY_LATER_CLOSE_CODE,
+                "reason": f"{retry_after:.1f}",
+            }
+        )
@@ -0,0 +1,287 @@
+"""Wire formats of the WebSocket frames.
+
+JSON text frames are the default. A client offering the ``quickauct.msgpack``
+subprotocol at connect gets MessagePack binary frames instead, where UUIDs,
+decimals and datetimes are packed into ext types:
+
+=====  =========  ==========================================================
+code   type       payload
+=====  =========  ==========================================================
+1      UUID       the 16 bytes of the UUID
+2      Decimal    MessagePack array ``[scale, unscaled integer]``
+3      datetime   big endian int64 microseconds since the epoch (UTC), int16
+                  UTC offset in minutes and a flags byte: 1 when the text has
+                  microseconds, 4 when it has milliseconds, 2 when the offset
+                  is written ``Z``
+=====  =========  ==========================================================
+
+The payloads are mostly serializer output, where these values are already
+strings, so strings in their canonical text form (lowercase UUIDs, plain
+decimals, ISO 8601 datetimes) are packed too. Every ext type decodes back to
+the exact text the JSON frame would carry, so both kinds of clients see the
+same values and the server treats incoming frames of either format alike.
+
+Looking for those strings makes packing a large payload slower than JSON in
+exchange for about a third fewer bytes on the wire; recurring strings are
+cached to keep that cost down. ``manage.py bench_codecs`` measures both.
+"""
+
+import datetime
+import functools
+import json
+import re
+import struct
+import uuid
+from decimal import Decimal
+
+import msgpack
+from django.core.serializers.json import DjangoJSONEncoder
+
+MSGPACK_SUBPROTOCOL = "quickauct.msgpack"
+
+EXT_UUID = 1
+EXT_DECIMAL = 2
+EXT_DATETIME = 3
+
+_DATETIME_HAS_MICROSECONDS = 1
+_DATETIME_ZULU = 2
+_DATETIME_HAS_MILLISECONDS = 4
+
+_UUID_RE = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}")
+_DECIMAL_RE = re.compile(r"-?(?:0|[1-9][0-9]*)\.[0-9]+")
+_DATETIME_RE = re.compile(
+    r"[0-9]{4}-[0-9]{2}-[0-9]{2}T[0-9]{2}:[0-9]{2}:[0-9]{2}(\.[0-9]{3}|\.[0-9]{6})?"
+    r"(Z|[+-][0-9]{2}:[0-9]{2})"
+)
+_DATETIME_STRUCT = struct.Struct(">qhB")
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+class CodecError(ValueError):
+    """Raised when an incoming frame cannot be decoded."""
+
+
+class JSONCodec:
+    """Text frames, the default wire format."""
+
+    name = "json"
+    subprotocol = None
+    binary = False
+
+    def encode(self, content):
+        return json.dumps(content, cls=DjangoJSONEncoder)
+
+    def stamp(self, frame, key, value):
+        """Add a key to an encoded object, without encoding it again."""
+        return f"{{{json.dumps(key)}: {json.dumps(value)}, {frame[1:]}"
+
+    def decode(self, data):
+        try:
+            return json.loads(data)
+        except json.JSONDecodeError as e:
+            raise CodecError(str(e)) from e
+
+
+class MsgpackCodec:
+    """Binary frames with compact UUIDs, decimals and datetimes."""
+
+    name = "msgpack"
+    subprotocol = MSGPACK_SUBPROTOCOL
+    binary = True
+
+    def encode(self, content):
+        return msgpack.packb(_compact(content), default=_pack_ext)
+
+    def stamp(self, frame, key, value):
+        """Add a key to an encoded map, without encoding it again."""
+        header = frame[0]
+        if 0x80 <= header < 0x8F:
+            # A fixmap with room for one more key
+            return (
+                bytes((header + 1,))
+                + msgpack.packb(key)
+                + msgpack.packb(value)
+                + frame[1:]
+            )
+        return self.encode(dict(self.decode(frame), **{key: value}))
+
+    def decode(self, data):
+        try:
+            return msgpack.unpackb(data, ext_hook=_unpack_ext)
+        except (ValueError, msgpack.UnpackException) as e:
+            raise CodecError(str(e)) from e
+
+
+json_codec = JSONCodec()
+msgpack_codec = MsgpackCodec()
+
+CODECS = (json_codec, msgpack_codec)
+
+
+def negotiate(subprotocols):
+    """Return the codec of the first supported subprotocol, JSON otherwise."""
+    if MSGPACK_SUBPROTOCOL in subprotocols:
+        return msgpack_codec
+    return json_codec
+
+
+def broadcast_event(source, data, key=None):
+    """Build a broadcast.message channel layer event for a frame.
+
+    The frame is encoded here once, as JSON, and receivers send it as is.
+    Without this every member of a group would encode the same data again,
+    and the channel layer would pack the whole dict once per member instead
+    of a string. The frames of other codecs are only derived from it by the
+    processes with a connection using them, see event_frame().
+
+    key lets a newer frame of the same source replace this one while it waits
+    to be sent to a slow client, see api.realtime.outbox.
+    """
+    content = {"source": source, "data": data}
+    return {
+        "type": "broadcast.message",
+        "source": source,
+        "key": key,
+        "encoded": True,
+        "frames": {json_codec.name: json_codec.encode(content)},
+    }
+
+
+def event_frame(event, codec):
+    """The frame of a broadcast event in codec, encoded on first use.
+
+    Kept in the event, which the hub hands to every local member of a group,
+    so it is encoded once per process and event whatever the members.
+    """
+    frames = event["frames"]
+    frame = frames.get(codec.name)
+    if frame is None:
+        # Packing the decoded JSON gives the same frame as packing the data:
+        # the values the codec compacts are the strings JSON turns them into
+        frame = frames[codec.name] = codec.encode(
+            json_codec.decode(frames[json_codec.name])
+        )
+    return frame
+
+
+# ----------------------
+#  Ext types
+# ----------------------
+
+
+def _compact(value):
+    """Replace canonical UUID, decimal and datetime strings by ext types."""
+    # Exact type checks first, this runs on every value of every frame
+    kind = type(value)
+    if kind is str:
+        return _compact_str(value) if len(value) <= 40 else value
+    if kind is dict or isinstance(value, dict):
+        return {key: _compact(item) for key, item in value.items()}
+    if kind is list or isinstance(value, (list, tuple)):
+        return [_compact(item) for item in value]
+    return value
+
+
+@functools.lru_cache(maxsize=4096)
+def _compact_str(value):
+    # Cached: the same ids, prices and timestamps recur in and across frames
+    length = len(value)
+    if length == 36 and value[8] == "-" and _UUID_RE.fullmatch(value):
+        return msgpack.ExtType(EXT_UUID, bytes.fromhex(value.replace("-", "")))
+    if 20 <= length <= 32 and value[10:11] == "T":
+        match = _DATETIME_RE.fullmatch(value)
+        if match:
+            return _pack_datetime_text(value, match.group(1)) or value
+    if "." in value and _DECIMAL_RE.fullmatch(value):
+        return _pack_decimal_text(value)
+    return value
+
+
+def _pack_ext(value):
+    """msgpack default hook for values JSON would need DjangoJSONEncoder for."""
+    if isinstance(value, uuid.UUID):
+        return msgpack.ExtType(EXT_UUID, value.bytes)
+    if isinstance(value, Decimal):
+        return _compact_str(str(value))
+    if isinstance(value, datetime.datetime):
+        return _compact_str(DjangoJSONEncoder().default(value))
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not serializable")
+
+
+def _pack_decimal_text(text):
+    integer, fraction = text.split(".")
+    unscaled = int(integer + fraction)
+    if unscaled == 0 and text.startswith("-"):
+        # The sign of -0.00 would be lost
+        return text
+    if not -(2**63) <= unscaled < 2**64:
+        # Beyond what msgpack packs as an int, e.g. digits in a chat message
+        return text
+    return msgpack.ExtType(EXT_DECIMAL, msgpack.packb([len(fraction), unscaled]))
+
+
+def _pack_datetime_text(text, fraction):
+    if text.endswith("-00:00"):
+        # Would come back as +00:00
+        return None
+    try:
+        parsed = datetime.datetime.fromisoformat(text.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+
+    offset = parsed.utcoffset()
+    micros = (parsed - _EPOCH) // datetime.timedelta(microseconds=1)
+    flags = 0
+    if fraction and len(fraction) == 7:
+        flags |= _DATETIME_HAS_MICROSECONDS
+    elif fraction:
+        flags |= _DATETIME_HAS_MILLISECONDS
+    if text.endswith("Z"):
+        flags |= _DATETIME_ZULU
+    payload = _DATETIME_STRUCT.pack(
+        micros, offset // datetime.timedelta(minutes=1), flags
+    )
+    return msgpack.ExtType(EXT_DATETIME, payload)
+
+
+def _unpack_ext(code, data):
+    # A malformed payload fails in struct, msgpack or the arithmetic, and has
+    # to reach the consumer as a frame it cannot decode
+    try:
+        return _unpack_ext_value(code, data)
+    except (
+        struct.error,
+        msgpack.UnpackException,
+        TypeError,
+        ValueError,
+        OverflowError,
+    ) as e:
+        raise CodecError(f"Invalid ext type {code}: {str(e)}") from e
+
+
+@functools.lru_cache(maxsize=4096)
+def _unpack_ext_value(code, data):
+    if code == EXT_UUID:
+        text = data.hex()
+        return f"{text[:8]}-{text[8:12]}-{text[12:16]}-{text[16:20]}-{text[20:]}"
+    if code == EXT_DECIMAL:
+        scale, unscaled = msgpack.unpackb(data)
+        digits = str(abs(unscaled)).rjust(scale + 1, "0")
+        sign = "-" if unscaled < 0 else ""
+        return f"{sign}{digits[:-scale]}.{digits[-scale:]}"
+    if code == EXT_DATETIME:
+        micros, offset, flags = _DATETIME_STRUCT.unpack(data)
+        tz = datetime.timezone(datetime.timedelta(minutes=offset))
+        value = (_EPOCH + datetime.timedelta(microseconds=micros)).astimezone(tz)
+        timespec = "seconds"
+        if flags & _DATETIME_HAS_MICROSECONDS:
+            timespec = "microseconds"
+        elif flags & _DATETIME_HAS_MILLISECONDS:
+            timespec = "milliseconds"
+        text = value.isoformat(timespec=timespec)
+        if flags & _DATETIME_ZULU:
+            text = text[:-6] + "Z"
+        return text
+    return msgpack.ExtType(code, data)
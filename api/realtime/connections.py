@@ -0,0 +1,166 @@
+"""Open connections and presence of each user.
+
+A reply to a request is written straight to the socket that asked, and a copy
+goes through the channel layer only when the user has other connections to the
+same endpoint (another device) to show it on. A chat event for a user with no
+connection at all is not serialized nor published: what is durable in it is
+already in the database, and the client fetches it when it connects. Both
+decisions take a count of the connections of each user, kept here.
+
+Counts are kept in process. When REALTIME_REGISTRY_CACHE_ALIAS names a Django
+cache, they are kept in it instead so the connections of every worker process
+are counted; deployments running more than one process must set it, e.g. to a
+cache on the Redis of the channel layer. Every process then refreshes the
+counts of its own connections each REALTIME_PRESENCE_HEARTBEAT seconds, and a
+count nobody refreshed for three heartbeats expires, so the users of a process
+that died do not stay online.
+
+A shared count sums the shares of several processes, and after the cache is
+flushed each of them must add its share back: the first to refresh would
+otherwise recreate the count, and the touches of the others succeed on it.
+Each process keeps a key of its own along with the counts, and finding that
+key gone tells it to add back the share of every count it holds.
+"""
+
+import asyncio
+import logging
+import threading
+import uuid
+
+from api import metrics
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+# Heartbeats a shared count may miss before it expires
+MISSED_HEARTBEATS = 3
+
+
+def connection_key(endpoint, user_id):
+    return f"connections:{endpoint}:{user_id}"
+
+
+def presence_key(username):
+    # By username, the key of the personal group events are published to
+    return f"presence:{username}"
+
+
+def process_key(process_id):
+    return f"connections:process:{process_id}"
+
+
+class ConnectionRegistry:
+    """Number of open connections of each user, per endpoint and in all."""
+
+    def __init__(self, cache_alias=None, heartbeat=None):
+        if cache_alias is None:
+            cache_alias = settings.REALTIME_REGISTRY_CACHE_ALIAS
+        self.cache = caches[cache_alias] if cache_alias else None
+        self.heartbeat = heartbeat or settings.REALTIME_PRESENCE_HEARTBEAT
+        self.ttl = self.heartbeat * MISSED_HEARTBEATS
+        # Connections of this process, whatever the cache holds
+        self._counts = {}
+        self._lock = threading.Lock()
+        # Gone from the cache when it lost the shares of this process
+        self._process_key = process_key(uuid.uuid4().hex)
+        self._process_key_set = False
+        self._heartbeat_task = None
+
+    @property
+    def shared(self):
+        """Whether calls go through the shared cache, off the event loop."""
+        return self.cache is not None
+
+    def register(self, user, endpoint):
+        """Count a new connection, returning the user's connections to endpoint."""
+        metrics.add_to_gauge("registered_connections", 1)
+        self._add(presence_key(user.username), 1)
+        return self._add(connection_key(endpoint, user.pk), 1)
+
+    def unregister(self, user, endpoint):
+        """Forget a closed connection, returning those still open to endpoint."""
+        metrics.add_to_gauge("registered_connections", -1)
+        self._add(presence_key(user.username), -1)
+        return self._add(connection_key(endpoint, user.pk), -1)
+
+    def is_online(self, username):
+        """Whether the user has a connection open to any endpoint."""
+        key = presence_key(username)
+        with self._lock:
+            if self._counts.get(key, 0) > 0:
+                return True
+        if self.cache is None:
+            return False
+        return (self.cache.get(key) or 0) > 0
+
+    def _add(self, key, delta):
+        with self._lock:
+            count = self._counts.get(key, 0) + delta
+            if count > 0:
+                self._counts[key] = count
+            else:
+                self._counts.pop(key, None)
+        if self.cache is None:
+            return max(count, 0)
+
+        if not self._process_key_set:
+            self._process_key_set = True
+            self.cache.set(self._process_key, 1, self.ttl)
+        if delta > 0:
+            self.cache.add(key, 0, self.ttl)
+            count = self.cache.incr(key, delta)
+            self.cache.touch(key, self.ttl)
+        else:
+            try:
+                count = self.cache.decr(key, -delta)
+            except ValueError:
+                # Expired meanwhile
+                count = 0
+        return max(count, 0)
+
+    # ----------------------
+    #  Heartbeat
+    # ----------------------
+
+    def start_heartbeat(self):
+        """Refresh the shared counts from the running event loop."""
+        if self.cache is None:
+            return
+        loop = asyncio.get_running_loop()
+        task = self._heartbeat_task
+        if task is None or task.done() or task.get_loop() is not loop:
+            self._heartbeat_task = loop.create_task(self._beat())
+
+    async def _beat(self):
+        while True:
+            await asyncio.sleep(self.heartbeat)
+            try:
+                await sync_to_async(self.refresh, thread_sensitive=False)()
+            except Exception as e:
+                logger.error(f"Error refreshing connection counts: {str(e)}")
+
+    def refresh(self):
+        """Push back the expiry of the counts of this process's connections."""
+        with self._lock:
+            counts = list(self._counts.items())
+        if self._process_key_set and not self.cache.touch(self._process_key, self.ttl):
+            # The cache was flushed: add our share back, whoever recreates a count
+            logger.warning("Connection counts lost from the cache, restoring them")
+            for key, count in counts:
+                self._restore(key, count)
+            self.cache.set(self._process_key, 1, self.ttl)
+            return
+        for key, count in counts:
+            if not self.cache.touch(key, self.ttl):
+                # Expired or evicted alone: restore our share
+                self._restore(key, count)
+
+    def _restore(self, key, count):
+        self.cache.add(key, 0, self.ttl)
+        self.cache.incr(key, count)
+        self.cache.touch(key, self.ttl)
+
+
+connection_registry = ConnectionRegistry()
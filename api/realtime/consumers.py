@@ -0,0 +1,386 @@
+"""Building blocks shared by the WebSocket consumers."""
+
+import asyncio
+import logging
+import time
+from urllib.parse import parse_qs
+
+from api import metrics
+from asgiref.sync import sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .codecs import CodecError, broadcast_event, event_frame, json_codec, negotiate
+from .connections import connection_registry
+from .eventlog import event_log
+from .heartbeat import heartbeat
+from .hub import broadcast_hub, group_send
+from .outbox import Outbox, SlowClient
+
+logger = logging.getLogger(__name__)
+
+# Close code of a client disconnected for staying behind, see api.realtime.outbox
+SLOW_CLIENT_CLOSE_CODE = 4008
+# Close code of a connection whose access token expired without a refresh
+TOKEN_EXPIRED_CLOSE_CODE = 4001
+# Close code of a connection reaped for staying quiet, see api.realtime.heartbeat
+IDLE_CLOSE_CODE = 4002
+
+
+class HandlerError(Exception):
+    """Raised by a message handler to send its message back as an error."""
+
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message
+
+
+def parse_since(value):
+    """Parse the seq a client resumes from, None when not given."""
+    if value is None or value == "":
+        return None
+    since = int(value)
+    if since < 0:
+        raise ValueError(f"Invalid since {value}")
+    return since
+
+
+class RealtimeConsumer(AsyncJsonWebsocketConsumer):
+    """Base of the WebSocket consumers.
+
+    The wire format is negotiated at connect from the subprotocols the client
+    offers, see api.realtime.codecs: JSON text frames by default, MessagePack
+    binary frames for ``quickauct.msgpack``. Handlers only ever see and send
+    decoded content through receive_json and send_json.
+
+    Groups are joined with group_add and group_discard, which go through the
+    broadcast hub of the process (api.realtime.hub) rather than giving every
+    connection its own membership in the channel layer.
+
+    Replies go straight to the socket with send_reply, see
+    api.realtime.connections; ``endpoint`` tells apart the connections of a
+    user the copies are for.
+
+    Frames are not sent as they are produced but queued in the outbox of the
+    connection (api.realtime.outbox), which a writer task drains as fast as
+    the client reads them.
+
+    A client reconnecting with ``?since=<seq>`` gets the broadcasts it missed
+    in a group when it joins it again, see resume() and api.realtime.eventlog.
+
+    The connection closes when the access token it authenticated with
+    expires. Before then the client sends a fresh one in a ``refresh_token``
+    frame, ``{"source": "refresh_token", "data": {"token": "<access>"}}``,
+    and the connection stays open until the new token expires in turn.
+
+    A client quiet for a while is sent ``ping`` frames it answers with
+    ``pong``. Once it has answered one, the connection is reaped when it
+    stays silent, see api.realtime.heartbeat.
+    """
+
+    codec = json_codec
+    endpoint = "realtime"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._hub_groups = set()
+        self._registered_user = None
+        self.reply_group = None
+        # Open connections of the user to this endpoint, this one included
+        self.connection_count = 1
+        self._outbox = None
+        self._writer = None
+        # Last seq the client saw before reconnecting, None for a fresh start
+        self.resume_since = None
+        self._expiry = None
+        # Monotonic times of the last frame received and the last ping sent
+        self.last_seen = time.monotonic()
+        self.last_ping = 0
+        # Set by the first pong: only a client known to answer pings is reaped
+        self.answers_pings = False
+
+    async def websocket_connect(self, message):
+        self.codec = negotiate(self.scope.get("subprotocols") or [])
+        query = parse_qs(self.scope["query_string"].decode())
+        try:
+            self.resume_since = parse_since(query.get("since", [None])[0])
+        except ValueError:
+            pass
+        self._outbox = Outbox(self._write, codec=self.codec)
+        self._writer = asyncio.ensure_future(self._outbox.run())
+        await super().websocket_connect(message)
+
+    async def websocket_disconnect(self, message):
+        try:
+            await super().websocket_disconnect(message)
+        finally:
+            await self._release()
+
+    async def _release(self):
+        heartbeat.unwatch(self)
+        self.arm_expiry(None)
+        self._stop_writer()
+        if self._registered_user:
+            await self._unregister_connection()
+        # Whatever groups disconnect() did not leave
+        for group in list(self._hub_groups):
+            await self.group_discard(group)
+
+    async def accept(self, subprotocol=None, headers=None):
+        """Accept the connection, confirming the negotiated subprotocol."""
+        await super().accept(subprotocol or self.codec.subprotocol, headers)
+        heartbeat.watch(self)
+
+    async def receive(self, text_data=None, bytes_data=None, **kwargs):
+        self.last_seen = time.monotonic()
+        # Text frames are always JSON, binary ones use the negotiated codec
+        try:
+            if text_data is not None:
+                content = json_codec.decode(text_data)
+            else:
+                content = self.codec.decode(bytes_data)
+        except CodecError:
+            await self._send_error("Invalid message format")
+            return
+
+        # Frames of the connection itself, whatever consumer or stream it carries
+        source = content.get("source") if isinstance(content, dict) else None
+        if source == "pong":
+            self.answers_pings = True
+            return
+        if source == "ping":
+            await self.send_json({"source": "pong"})
+            return
+        if source == "refresh_token":
+            await self._handle_refresh_token(content)
+            return
+        await self.receive_json(content, **kwargs)
+
+    async def send_json(self, content, close=False):
+        """Encode content with the negotiated codec and send it."""
+        source = content.get("source") if isinstance(content, dict) else None
+        await self.send_encoded(self.codec.encode(content), close, source)
+
+    async def send_encoded(self, frame, close=False, source=None, key=None):
+        """Queue a frame already encoded with the codec of this connection.
+
+        source and key pick how the frame is queued, see api.realtime.outbox.
+        """
+        if close:
+            await self._write(frame)
+            await self.close()
+            return
+        if self._writer is None:
+            # The connection is closing
+            return
+
+        try:
+            self._outbox.put(frame, source, key)
+        except SlowClient as e:
+            logger.warning(f"Disconnecting slow client {self.channel_name}: {e}")
+            metrics.increment("slow_clients_disconnected")
+            self._stop_writer()
+            await self.close(code=SLOW_CLIENT_CLOSE_CODE)
+
+    async def _write(self, frame):
+        if self.codec.binary:
+            await self.send(bytes_data=frame)
+        else:
+            await self.send(text_data=frame)
+
+    def _stop_writer(self):
+        if self._writer is not None:
+            self._writer.cancel()
+            self._writer = None
+        if self._outbox is not None:
+            self._outbox.clear()
+
+    async def group_add(self, group):
+        """Receive the broadcasts sent to group."""
+        await broadcast_hub.join(group, self)
+        self._hub_groups.add(group)
+
+    async def group_discard(self, group):
+        """Stop receiving the broadcasts sent to group."""
+        self._hub_groups.discard(group)
+        await broadcast_hub.leave(group, self)
+
+    # ----------------------
+    #  Connection Registry
+    # ----------------------
+
+    async def register_connection(self, user):
+        """Count the connection as one of user's, for send_reply and presence."""
+        self.reply_group = f"{self.endpoint}.{user.pk}"
+        await self.group_add(self.reply_group)
+        self._registered_user = user
+        self.connection_count = await self._call_registry(
+            connection_registry.register, user, self.endpoint
+        )
+        connection_registry.start_heartbeat()
+        if self.connection_count > 1:
+            await self._announce_connections(self.connection_count)
+
+    async def _unregister_connection(self):
+        user, self._registered_user = self._registered_user, None
+        remaining = await self._call_registry(
+            connection_registry.unregister, user, self.endpoint
+        )
+        await self.group_discard(self.reply_group)
+        if remaining:
+            await self._announce_connections(remaining)
+
+    async def is_online(self, username):
+        """Whether the user has a connection open, for events only they see."""
+        return await self._call_registry(connection_registry.is_online, username)
+
+    async def _call_registry(self, func, *args):
+        # A shared registry goes through a cache, keep it off the event loop
+        if connection_registry.shared:
+            return await sync_to_async(func, thread_sensitive=False)(*args)
+        return func(*args)
+
+    async def _announce_connections(self, count):
+        # Every connection of the user keeps the count to decide on copies
+        await group_send(
+            self.channel_layer,
+            self.reply_group,
+            {"type": "user.connections", "count": count},
+        )
+
+    async def user_connections(self, event):
+        """Handle a change in the number of connections of the user."""
+        self.connection_count = event["count"]
+
+    async def send_reply(self, source, data):
+        """Send a reply to this socket, copied to the user's other ones.
+
+        The copy goes through the channel layer only when the user has other
+        connections to this endpoint; the common case costs no round trip.
+        """
+        if self.connection_count <= 1:
+            await self.send_json({"source": source, "data": data})
+            return
+
+        event = dict(broadcast_event(source, data), origin=self.channel_name)
+        await self.send_encoded(event_frame(event, self.codec), source=source)
+        await group_send(self.channel_layer, self.reply_group, event)
+
+    async def resume(self, group, since=None):
+        """Send the broadcasts to group after since, the connect one by default.
+
+        Call it once joined to group, so nothing falls between the replayed
+        and the live events; a client may get an event twice and drops the
+        seq it already has.
+        """
+        if since is None:
+            since = self.resume_since
+        if since is None:
+            return
+
+        events, complete = await event_log(self.channel_layer).replay(group, since)
+        metrics.increment("events_replayed", len(events))
+        if not complete:
+            metrics.increment("resyncs_required")
+            await self.send_json(
+                {"source": "resync_required", "data": {"group": group, "since": since}}
+            )
+            return
+        for event in events:
+            await self.broadcast_message(event)
+
+    # ----------------------
+    #  Heartbeat
+    # ----------------------
+
+    async def ping(self):
+        """Ask a quiet client for a sign of life."""
+        await self.send_json({"source": "ping"})
+
+    async def reap(self):
+        """Drop a client that stayed silent, leaving its groups right away."""
+        logger.info(f"Reaping idle connection {self.channel_name}")
+        metrics.increment("connections_reaped", endpoint=self.endpoint)
+        # Not waiting for the disconnect a vanished client may never trigger
+        await self._release()
+        await self.close(code=IDLE_CLOSE_CODE)
+
+    # ----------------------
+    #  Token Expiry
+    # ----------------------
+
+    def arm_expiry(self, exp):
+        """Close the connection at exp, in seconds since the epoch; None disarms."""
+        if self._expiry is not None:
+            self._expiry.cancel()
+            self._expiry = None
+        if exp is not None:
+            self._expiry = asyncio.ensure_future(self._expire_at(exp))
+
+    async def _expire_at(self, exp):
+        await asyncio.sleep(max(exp - time.time(), 0))
+        self._expiry = None
+        metrics.increment("tokens_expired", endpoint=self.endpoint)
+        logger.info(f"Closing {self.channel_name}: access token expired")
+        self._stop_writer()
+        await self.close(code=TOKEN_EXPIRED_CLOSE_CODE)
+
+    async def _handle_refresh_token(self, content):
+        """Re-arm the expiry of the connection from a new access token."""
+        data = content.get("data")
+        token = data.get("token") if isinstance(data, dict) else None
+        user = self.scope.get("user")
+        try:
+            if not token:
+                raise TokenError("No token provided")
+            access = AccessToken(token)
+        except TokenError as e:
+            logger.warning(f"Refused token refresh: {str(e)}")
+            await self._send_error("Invalid token")
+            return
+
+        user_id = getattr(user, api_settings.USER_ID_FIELD, None)
+        if user_id is None or str(access.get(api_settings.USER_ID_CLAIM)) != str(
+            user_id
+        ):
+            # A token of another user would hand them this connection
+            await self._send_error("Invalid token")
+            return
+
+        self.arm_expiry(access["exp"])
+        metrics.increment("token_refreshes", endpoint=self.endpoint)
+        await self.send_json(
+            {"source": "token_refreshed", "data": {"expiresAt": access["exp"]}}
+        )
+
+    def _extract_token(self):
+        """Extract token from query string."""
+        query_string = self.scope["query_string"].decode()
+        if "tokens=" in query_string:
+            return query_string.split("tokens=")[-1].split("&")[0]
+        return None
+
+    async def _send_error(self, message):
+        """Send error message to client."""
+        await self.send_json({"type": "error", "message": message})
+
+    async def broadcast_message(self, event):
+        """Handle messages sent to the groups the connection is in."""
+        if event.get("origin") == self.channel_name:
+            # A copy of a reply this connection already sent
+            return
+        try:
+            if event.get("encoded"):
+                frame = event_frame(event, self.codec)
+                if event.get("seq"):
+                    frame = self.codec.stamp(frame, "seq", event["seq"])
+                await self.send_encoded(
+                    frame, source=event["source"], key=event.get("key")
+                )
+            else:
+                # Sent by a producer that does not encode its frames
+                await self.send_json({"source": event["source"], "data": event["data"]})
+        except Exception as e:
+            logger.error(f"Error broadcasting message: {str(e)}")
@@ -0,0 +1,135 @@
+"""Sequence numbers and replay of group broadcasts.
+
+Every broadcast sent with api.realtime.hub.group_send gets the next number of
+a sequence shared by all groups, and is kept with it in a bounded log of its
+group, the last REALTIME_EVENT_LOG_SIZE events. The frames carry the number as
+``seq``. A client reconnecting with ``?since=<seq>``, the last number it saw,
+is sent the events of its groups numbered after it instead of refetching its
+lists, and ``resync_required`` for a group whose log no longer goes back that
+far.
+
+With channels_redis the sequence and the logs are kept in the Redis of the
+channel layer, so every process, the scheduler included, numbers and logs
+into the same place; a single script appends, trims and numbers an event in
+one round trip. With any other layer they are kept in process.
+
+The log of a group expires REALTIME_EVENT_LOG_TTL seconds after its last event,
+so a client gone for longer than that should refetch rather than resume.
+Typing indicators and copies of replies are not numbered nor logged.
+"""
+
+import threading
+from collections import OrderedDict, deque
+
+from channels_redis.core import RedisChannelLayer
+from django.conf import settings
+
+# Appends an event to the log of a group and returns its number. KEYS: the
+# sequence, the log and the number of the newest event trimmed from the log.
+# ARGV: the serialized event, the size and the TTL of the log.
+_APPEND_SCRIPT = """
+local seq = redis.call('INCR', KEYS[1])
+redis.call('LPUSH', KEYS[2], seq .. ':' .. ARGV[1])
+if redis.call('LLEN', KEYS[2]) > tonumber(ARGV[2]) then
+    local trimmed = redis.call('RPOP', KEYS[2])
+    redis.call('SET', KEYS[3], string.match(trimmed, '^(%d+):'))
+end
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+redis.call('EXPIRE', KEYS[3], ARGV[3])
+return seq
+"""
+
+
+class MemoryEventLog:
+    """Sequence and group logs kept in process."""
+
+    # Logs kept, those of the least recently active groups are dropped first
+    max_groups = 10000
+
+    def __init__(self, size=None):
+        self.size = size or settings.REALTIME_EVENT_LOG_SIZE
+        self._seq = 0
+        # group -> (deque of (seq, event), newest seq trimmed from it)
+        self._logs = OrderedDict()
+        # Newest seq of the dropped logs, what a group without a log misses
+        self._dropped = 0
+        self._lock = threading.Lock()
+
+    async def append(self, group, event):
+        """Number event and keep it in the log of group."""
+        with self._lock:
+            self._seq += 1
+            entries, trimmed = self._logs.pop(group, None) or (deque(), self._dropped)
+            entries.append((self._seq, event))
+            if len(entries) > self.size:
+                trimmed = entries.popleft()[0]
+            self._logs[group] = (entries, trimmed)
+            if len(self._logs) > self.max_groups:
+                dropped, _ = self._logs.popitem(last=False)[1]
+                self._dropped = max(self._dropped, dropped[-1][0])
+            return self._seq
+
+    async def replay(self, group, since):
+        """Events of group numbered after since, and whether none are missing."""
+        with self._lock:
+            entries, trimmed = self._logs.get(group) or ((), self._dropped)
+            events = [dict(event, seq=seq) for seq, event in entries if seq > since]
+            return events, trimmed <= since
+
+
+class RedisEventLog:
+    """Sequence and group logs kept in the Redis of a channels_redis layer."""
+
+    def __init__(self, channel_layer, size=None, ttl=None):
+        self.channel_layer = channel_layer
+        self.size = size or settings.REALTIME_EVENT_LOG_SIZE
+        self.ttl = ttl or settings.REALTIME_EVENT_LOG_TTL
+        self.prefix = f"{channel_layer.prefix}:events"
+
+    async def append(self, group, event):
+        """Number event and keep it in the log of group."""
+        # On the first host, the keys of a script must live on one server
+        connection = self.channel_layer.connection(0)
+        return await connection.eval(
+            _APPEND_SCRIPT,
+            3,
+            f"{self.prefix}:seq",
+            f"{self.prefix}:log:{group}",
+            f"{self.prefix}:trimmed:{group}",
+            self.channel_layer.serialize(event),
+            self.size,
+            self.ttl,
+        )
+
+    async def replay(self, group, since):
+        """Events of group numbered after since, and whether none are missing."""
+        connection = self.channel_layer.connection(0)
+        async with connection.pipeline(transaction=True) as pipe:
+            pipe.lrange(f"{self.prefix}:log:{group}", 0, -1)
+            pipe.get(f"{self.prefix}:trimmed:{group}")
+            entries, trimmed = await pipe.execute()
+
+        events = []
+        # Newest first in the list
+        for entry in reversed(entries):
+            seq, _, data = entry.partition(b":")
+            if int(seq) > since:
+                events.append(dict(self.channel_layer.deserialize(data), seq=int(seq)))
+        return events, int(trimmed or 0) <= since
+
+
+_logs = {}
+_logs_lock = threading.Lock()
+
+
+def event_log(channel_layer):
+    """The event log of channel_layer."""
+    with _logs_lock:
+        log = _logs.get(id(channel_layer))
+        if log is None or log[0] is not channel_layer:
+            if isinstance(channel_layer, RedisChannelLayer):
+                log = (channel_layer, RedisEventLog(channel_layer))
+            else:
+                log = (channel_layer, MemoryEventLog())
+            _logs[id(channel_layer)] = log
+        return log[1]
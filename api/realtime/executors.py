@@ -0,0 +1,120 @@
+"""Bounded pools for the blocking work of realtime consumers.
+
+Consumers run on the event loop and hand their blocking work to one of two
+pools: ``db_executor``, a thread pool for the ORM, and ``cpu_executor``, a
+process pool for CPU heavy work such as resizing images, which would otherwise
+hold the GIL the event loop needs. Each pool has a fixed number of workers and
+a bounded backlog, so a burst of slow requests queues up behind its own pool
+instead of starving everything else, and past the backlog new jobs are refused
+with ExecutorBusy rather than queued without limit.
+"""
+
+import asyncio
+import functools
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from api import metrics
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+
+class ExecutorBusy(Exception):
+    """Raised when an executor already has its maximum backlog."""
+
+
+class BoundedExecutor:
+    """A worker pool refusing work past workers + backlog jobs in flight.
+
+    Jobs of a process pool are pickled, so they must be module level
+    functions taking picklable arguments and must not use the ORM. Its
+    processes run with the given niceness, so on a busy host the event loop
+    gets the CPU first.
+    """
+
+    def __init__(
+        self, name, workers, backlog, database=False, processes=False, niceness=0
+    ):
+        self.name = name
+        self.workers = workers
+        self.limit = workers + backlog
+        self.database = database
+        self.processes = processes
+        self.niceness = niceness
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._pool = None
+
+    async def run(self, func, *args, **kwargs):
+        """Run func in the pool and return its result."""
+        with self._lock:
+            if self._in_flight >= self.limit:
+                metrics.increment("executor_rejected", executor=self.name)
+                raise ExecutorBusy(f"The {self.name} executor is busy")
+            self._in_flight += 1
+        metrics.add_to_gauge("executor_in_flight", 1, executor=self.name)
+
+        try:
+            if self.processes:
+                return await asyncio.get_running_loop().run_in_executor(
+                    self._get_pool(), functools.partial(func, *args, **kwargs)
+                )
+            if self.database:
+                func = functools.partial(self._run_database, func)
+            return await sync_to_async(
+                func, thread_sensitive=False, executor=self._get_pool()
+            )(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+            metrics.add_to_gauge("executor_in_flight", -1, executor=self.name)
+
+    def _get_pool(self):
+        # Created on first use, so worker processes fork from a process that
+        # is already serving rather than at import time.
+        with self._lock:
+            if self._pool is None:
+                if self.processes:
+                    self._pool = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        initializer=os.nice,
+                        initargs=(self.niceness,),
+                    )
+                else:
+                    self._pool = ThreadPoolExecutor(
+                        max_workers=self.workers,
+                        thread_name_prefix=f"realtime-{self.name}",
+                    )
+            return self._pool
+
+    @staticmethod
+    def _run_database(func, *args, **kwargs):
+        # Same connection handling as channels' database_sync_to_async
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True)
+
+
+db_executor = BoundedExecutor(
+    "db",
+    settings.REALTIME_DB_WORKERS,
+    settings.REALTIME_EXECUTOR_BACKLOG,
+    database=True,
+)
+cpu_executor = BoundedExecutor(
+    "cpu",
+    settings.REALTIME_CPU_WORKERS,
+    settings.REALTIME_EXECUTOR_BACKLOG,
+    processes=True,
+    niceness=settings.REALTIME_CPU_NICENESS,
+)
@@ -0,0 +1,94 @@
+"""Detection and reaping of connections whose client went quiet.
+
+A socket whose client vanished without closing (a phone losing its network, a
+suspended laptop) is only noticed by the server when a write to it fails, and
+meanwhile stays in its groups and keeps costing every broadcast sent to them.
+
+Every frame a client sends counts as a sign of life. The heartbeat of the
+process sends a ``ping`` frame to a connection quiet for REALTIME_PING_INTERVAL
+seconds, which the client answers with ``pong``. A connection still quiet
+after REALTIME_IDLE_TIMEOUT seconds is reaped: it leaves its groups and its
+count of connections at once, then is closed.
+
+Only a connection whose client has answered a ``pong`` at least once is
+reaped. Clients released before the heartbeat ignore ``ping`` frames and may
+stay quiet for long while still there; theirs are left to the WebSocket pings
+of uvicorn, which drop the connection once its client stops answering them.
+
+One task per process looks over all of its connections, rather than a timer
+per connection.
+"""
+
+import asyncio
+import logging
+import time
+
+from api import metrics
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class Heartbeat:
+    """Pings the quiet connections of this process and reaps the silent ones."""
+
+    def __init__(self, interval=None, idle_timeout=None):
+        self.interval = interval or settings.REALTIME_PING_INTERVAL
+        self.idle_timeout = idle_timeout or settings.REALTIME_IDLE_TIMEOUT
+        self._connections = set()
+        self._loop = None
+        self._task = None
+
+    def watch(self, consumer):
+        """Start watching an accepted connection."""
+        self._bind()
+        self._connections.add(consumer)
+        metrics.set_gauge("connections_live", len(self._connections))
+        if self._task is None:
+            self._task = self._loop.create_task(self._run())
+
+    def unwatch(self, consumer):
+        """Stop watching a closed connection."""
+        if consumer in self._connections:
+            self._connections.discard(consumer)
+            metrics.set_gauge("connections_live", len(self._connections))
+
+    def _bind(self):
+        # As the broadcast hub, state belongs to the loop it was created on
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._connections = set()
+            self._task = None
+
+    async def _run(self):
+        # Often enough for a ping to go out within half an interval of due
+        tick = min(self.interval, self.idle_timeout) / 2
+        while True:
+            await asyncio.sleep(tick)
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"Error sweeping connections: {str(e)}")
+
+    async def sweep(self):
+        """Ping the quiet connections and reap the silent ones."""
+        now = time.monotonic()
+        for consumer in list(self._connections):
+            quiet = now - consumer.last_seen
+            try:
+                if quiet >= self.idle_timeout and consumer.answers_pings:
+                    self.unwatch(consumer)
+                    await consumer.reap()
+                elif (
+                    quiet >= self.interval and now - consumer.last_ping >= self.interval
+                ):
+                    consumer.last_ping = now
+                    await consumer.ping()
+            except Exception as e:
+                logger.error(
+                    f"Error checking connection {consumer.channel_name}: {str(e)}"
+                )
+
+
+heartbeat = Heartbeat()
@@ -0,0 +1,152 @@
+"""Per-process fan-out of channel layer groups to local sockets.
+
+Consumers do not join channel layer groups with their own channel. They join
+the broadcast hub of their process instead, and the hub joins each group once,
+with a single channel of its own, when its first local socket joins. An event
+sent to a group then reaches the channel layer once per server process holding
+members of the group, and the hub hands it to each of its local sockets in
+memory. With channels_redis, the Redis work of a broadcast grows with the
+number of server processes rather than with the number of connected users.
+
+Since one hub channel receives the events of every group of its process,
+events must say which group they were sent to: send them with group_send()
+below rather than with the channel layer directly. It also numbers and logs
+broadcasts for clients to resume from, see api.realtime.eventlog.
+"""
+
+import asyncio
+import logging
+
+from api import metrics
+from channels.consumer import get_handler_name
+from channels.layers import DEFAULT_CHANNEL_LAYER, get_channel_layer
+
+from .eventlog import event_log
+from .outbox import EPHEMERAL, SOURCE_POLICIES
+
+logger = logging.getLogger(__name__)
+
+
+async def group_send(channel_layer, group, event):
+    """Send event to group, for the hub of every process to fan it out."""
+    if _resumable(event):
+        try:
+            seq = await event_log(channel_layer).append(group, event)
+            event = dict(event, seq=seq)
+        except Exception as e:
+            # Still delivered live, only not replayable
+            logger.error(f"Error logging event for {group}: {str(e)}")
+    await channel_layer.group_send(group, dict(event, group=group))
+
+
+def _resumable(event):
+    # Broadcasts, but not copies of replies nor frames only worth sending live
+    return (
+        event.get("encoded")
+        and "origin" not in event
+        and SOURCE_POLICIES.get(event["source"]) != EPHEMERAL
+    )
+
+
+class BroadcastHub:
+    """Holds the channel layer groups of the sockets of this process."""
+
+    def __init__(self, alias=DEFAULT_CHANNEL_LAYER):
+        self.alias = alias
+        self.channel_name = None
+        self._channel_layer = None
+        self._members = {}
+        self._loop = None
+        self._lock = None
+        self._tasks = []
+
+    async def join(self, group, consumer):
+        """Add consumer to group, joining the group on first local member."""
+        self._bind()
+        async with self._lock:
+            await self._start()
+            members = self._members.get(group)
+            if members is None:
+                await self._channel_layer.group_add(group, self.channel_name)
+                members = self._members[group] = set()
+                metrics.set_gauge("hub_groups", len(self._members))
+            members.add(consumer)
+
+    async def leave(self, group, consumer):
+        """Remove consumer from group, leaving the group with its last member."""
+        if self._loop is not asyncio.get_running_loop():
+            return
+        async with self._lock:
+            members = self._members.get(group)
+            if not members or consumer not in members:
+                return
+            members.discard(consumer)
+            if not members:
+                del self._members[group]
+                metrics.set_gauge("hub_groups", len(self._members))
+                await self._channel_layer.group_discard(group, self.channel_name)
+
+    def _bind(self):
+        # State belongs to the event loop it was created on; a new loop (a
+        # restarted server, tests) starts over with a new channel.
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._lock = asyncio.Lock()
+            self._members = {}
+            self._tasks = []
+            self.channel_name = None
+
+    async def _start(self):
+        if self.channel_name is not None:
+            return
+        self._channel_layer = get_channel_layer(self.alias)
+        self.channel_name = await self._channel_layer.new_channel("hub")
+        self._tasks = [
+            self._loop.create_task(self._read()),
+            self._loop.create_task(self._refresh()),
+        ]
+
+    async def _read(self):
+        while True:
+            try:
+                event = await self._channel_layer.receive(self.channel_name)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error receiving hub events: {str(e)}")
+                await asyncio.sleep(1)
+                continue
+            await self._deliver(event)
+
+    async def _deliver(self, event):
+        group = event.get("group")
+        members = self._members.get(group)
+        if not members:
+            if group is None:
+                logger.warning(f"Dropped hub event without a group: {event['type']}")
+            return
+
+        metrics.increment("hub_events")
+        handler_name = get_handler_name(event)
+        # Copied, sockets may leave the group while a send is awaited
+        for consumer in list(members):
+            try:
+                await getattr(consumer, handler_name)(event)
+            except Exception as e:
+                logger.error(f"Error delivering hub event: {str(e)}")
+
+    async def _refresh(self):
+        # channels_redis forgets group members after group_expiry seconds,
+        # while the hub channel can stay in a group for the life of the process
+        interval = getattr(self._channel_layer, "group_expiry", 86400) / 2
+        while True:
+            await asyncio.sleep(interval)
+            for group in list(self._members):
+                try:
+                    await self._channel_layer.group_add(group, self.channel_name)
+                except Exception as e:
+                    logger.error(f"Error refreshing hub group {group}: {str(e)}")
+
+
+broadcast_hub = BroadcastHub()
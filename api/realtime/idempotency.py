@@ -0,0 +1,100 @@
+"""Deduplication of retried WebSocket requests.
+
+Clients may tag a message with a ``requestId``. The first message with a given
+id runs its handler and the frames sent back to the client are stored under the
+id; a retry of the same message gets those frames again without running the
+handler, so it does not touch the database or repeat a side effect.
+
+Entries live in a bounded in-process LRU and expire after IDEMPOTENCY_TTL
+seconds. When IDEMPOTENCY_CACHE_ALIAS names a Django cache, entries are also
+shared through it so a retry reaching another worker process is caught too.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from api import metrics
+from django.conf import settings
+from django.core.cache import caches
+
+# Seconds a request being handled holds its id, a crashed worker releases it
+PENDING_TTL = 30
+
+_PENDING = "__pending__"
+
+
+def idempotency_key(user_id, source, request_id):
+    """Scope a client request id to its user and message source."""
+    return f"idempotency:{user_id}:{source}:{request_id}"
+
+
+class IdempotencyStore:
+    """Bounded TTL store of the replies sent for each request id."""
+
+    def __init__(self, max_entries=None, ttl=None, cache_alias=None):
+        self.max_entries = max_entries or settings.IDEMPOTENCY_MAX_ENTRIES
+        self.ttl = ttl or settings.IDEMPOTENCY_TTL
+        if cache_alias is None:
+            cache_alias = settings.IDEMPOTENCY_CACHE_ALIAS
+        self.cache = caches[cache_alias] if cache_alias else None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def claim(self, key):
+        """Try to become the handler of a request.
+
+        Returns ``(True, None)`` when the caller should handle the request,
+        ``(False, frames)`` when it was already handled and ``(False, None)``
+        while another handler is still on it.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= now:
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return False, _frames(entry[1])
+            self._store(key, _PENDING, now + PENDING_TTL)
+
+        if self.cache is not None and not self.cache.add(key, _PENDING, PENDING_TTL):
+            frames = self.cache.get(key)
+            with self._lock:
+                if frames is None or frames == _PENDING:
+                    # Handled elsewhere, do not keep a local claim on it
+                    self._entries.pop(key, None)
+                else:
+                    self._store(key, frames, now + self.ttl)
+            return False, _frames(frames)
+
+        return True, None
+
+    def complete(self, key, frames):
+        """Store the frames sent for a claimed request."""
+        with self._lock:
+            self._store(key, frames, time.monotonic() + self.ttl)
+        if self.cache is not None:
+            self.cache.set(key, frames, self.ttl)
+
+    def release(self, key):
+        """Give up a claim, e.g. when the handler failed, so a retry runs it."""
+        with self._lock:
+            self._entries.pop(key, None)
+        if self.cache is not None:
+            self.cache.delete(key)
+
+    def _store(self, key, value, expires_at):
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        metrics.set_gauge("idempotency_entries", len(self._entries))
+
+
+def _frames(value):
+    return None if value is None or value == _PENDING else value
+
+
+idempotency_store = IdempotencyStore()
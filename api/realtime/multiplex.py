@@ -0,0 +1,101 @@
+"""Several consumers carried as streams of a single WebSocket.
+
+A MultiplexedConsumer authenticates once and holds one socket and one outbox,
+and runs the handlers of other consumer classes as its streams. Each stream is
+an instance of its consumer class mixed with Substream: it keeps its own state
+(subscriptions, reply group, count of connections) while its frames go out
+through the outbox of the connection, tagged with the name of the stream, and
+the frames the client sends with that ``stream`` field come in to it.
+
+A stream registers under the endpoint of its consumer class, so replies are
+copied between it and the user's connections to the standalone route, and
+presence counts it as one of the user's connections.
+"""
+
+import logging
+
+from .consumers import RealtimeConsumer
+
+logger = logging.getLogger(__name__)
+
+
+class Substream:
+    """Mixin running a consumer class as one stream of a MultiplexedConsumer.
+
+    Comes first in the bases, ahead of the consumer class, e.g.
+    ``class AuctionStream(Substream, AuctionConsumer)``.
+    """
+
+    def attach(self, connection, name, user):
+        """Bind the stream to the connection, authenticated as user."""
+        self.connection = connection
+        self.stream = name
+        self.scope = connection.scope
+        self.channel_layer = connection.channel_layer
+        # Copies of replies sent by any stream of the connection are its own
+        self.channel_name = connection.channel_name
+        self.codec = connection.codec
+        self.resume_since = connection.resume_since
+        self.user = user
+        self.username = user.username
+
+    async def detach(self, close_code):
+        """Run the consumer's disconnect and leave what it left behind."""
+        try:
+            await self.disconnect(close_code)
+        finally:
+            await self._release()
+
+    async def send_encoded(self, frame, close=False, source=None, key=None):
+        """Queue a frame in the outbox of the connection, tagged with the stream."""
+        frame = self.codec.stamp(frame, "stream", self.stream)
+        await self.connection.send_encoded(frame, close, source, key)
+
+    async def close(self, code=None, reason=None):
+        await self.connection.close(code, reason)
+
+
+class MultiplexedConsumer(RealtimeConsumer):
+    """Base of a consumer carrying the streams of ``stream_consumers``.
+
+    Maps the name of each stream to its Substream class. Once the user is
+    authenticated, open_streams() attaches one of each to the connection.
+    """
+
+    stream_consumers = {}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.streams = {}
+
+    async def open_streams(self, user):
+        """Attach a stream of each consumer class, registered for user."""
+        for name, stream_class in self.stream_consumers.items():
+            stream = stream_class()
+            stream.attach(self, name, user)
+            self.streams[name] = stream
+            await stream.register_connection(user)
+
+    async def _release(self):
+        # Reaped: the groups and counts to leave are those of the streams
+        for stream in self.streams.values():
+            await stream._release()
+        await super()._release()
+
+    async def disconnect(self, close_code):
+        """Close every stream of the connection."""
+        for name, stream in self.streams.items():
+            try:
+                await stream.detach(close_code)
+            except Exception as e:
+                logger.error(f"Error closing stream {name}: {str(e)}")
+
+    async def receive_json(self, content, **kwargs):
+        """Hand the frame to the stream it names."""
+        stream = None
+        if isinstance(content, dict):
+            stream = self.streams.get(content.get("stream"))
+        if stream is None:
+            await self._send_error("Unsupported stream")
+            return
+        await stream.receive_json(content, **kwargs)
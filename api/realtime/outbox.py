@@ -0,0 +1,150 @@
+"""Bounded queue of the frames waiting to be written to one socket.
+
+Every frame for a connection is put in its Outbox, and a writer task sends
+them one at a time, waiting for each send to complete. A client that reads
+slowly therefore holds up its own queue only, and what is queued for it is
+bounded by policies picked by the source of each frame:
+
+``coalesce``   a frame replaces the queued frame with the same source and key,
+               e.g. the newest ``new_bid`` of an auction replaces the older one;
+               the ``merged`` count of the older one is added to it, so the
+               client does not take the jump in ``seq`` for a gap
+``ephemeral``  a frame replaces the queued one with the same key, is dropped
+               when the queue is full and is not sent once stale, e.g. typing
+``reliable``   the default, the frame is never dropped, e.g. ``message_send``
+
+A queue holding REALTIME_OUTBOX_LIMIT frames or more is behind. A client still
+behind after REALTIME_SLOW_CLIENT_TIMEOUT seconds, or twice the limit behind,
+is disconnected rather than buffered for without limit.
+
+The queue only grows when the server's send waits for the socket, as it does
+with uvicorn's websockets implementation. Daphne takes every frame at once
+and buffers it itself, which is why the Procfile serves with uvicorn.
+"""
+
+import asyncio
+import itertools
+import time
+from collections import OrderedDict
+
+from api import metrics
+from django.conf import settings
+
+COALESCE = "coalesce"
+EPHEMERAL = "ephemeral"
+RELIABLE = "reliable"
+
+SOURCE_POLICIES = {
+    "new_bid": COALESCE,
+    "typingIndicator": EPHEMERAL,
+    "message_send": RELIABLE,
+}
+
+# Seconds after which an ephemeral frame is no longer worth sending
+EPHEMERAL_TTL = 2
+
+
+class SlowClient(Exception):
+    """Raised when the client of an outbox stayed behind for too long."""
+
+
+class Outbox:
+    """The frames queued for one socket, written by run()."""
+
+    def __init__(self, send, limit=None, timeout=None, codec=None):
+        self._send = send
+        # Decodes coalesced frames to add up their counts, None to skip that
+        self.codec = codec
+        self.limit = limit or settings.REALTIME_OUTBOX_LIMIT
+        if timeout is None:
+            timeout = settings.REALTIME_SLOW_CLIENT_TIMEOUT
+        self.timeout = timeout
+        # slot -> (frame, source, policy, queued at), in sending order
+        self._frames = OrderedDict()
+        self._slots = itertools.count()
+        self._ready = asyncio.Event()
+        self._behind_since = None
+
+    def __len__(self):
+        return len(self._frames)
+
+    def put(self, frame, source=None, key=None):
+        """Queue frame, raising SlowClient when the client stays behind."""
+        policy = SOURCE_POLICIES.get(source, RELIABLE)
+        now = time.monotonic()
+
+        if policy != RELIABLE and key is not None:
+            slot = (source, key)
+            if slot in self._frames:
+                # Takes the place of the older frame in the queue
+                if policy == COALESCE:
+                    frame = self._merge(self._frames[slot][0], frame)
+                self._frames[slot] = (frame, source, policy, now)
+                metrics.increment("outbox_replaced", source=source)
+                return
+        else:
+            slot = next(self._slots)
+
+        if len(self._frames) >= self.limit:
+            if policy == EPHEMERAL:
+                metrics.increment("outbox_dropped", source=source, reason="full")
+                return
+            self._check_behind(now)
+
+        self._frames[slot] = (frame, source, policy, now)
+        metrics.add_to_gauge("outbox_frames", 1)
+        self._ready.set()
+
+    def _merge(self, older, newer):
+        """newer, standing for the updates of older too."""
+        if self.codec is None:
+            return newer
+        try:
+            older_data = self.codec.decode(older)["data"]
+            content = self.codec.decode(newer)
+            merged = content["data"]["merged"] + older_data["merged"]
+        except (KeyError, TypeError, ValueError):
+            # Not a counted update
+            return newer
+        content["data"]["merged"] = merged
+        return self.codec.encode(content)
+
+    def clear(self):
+        metrics.add_to_gauge("outbox_frames", -len(self._frames))
+        self._frames.clear()
+        self._set_behind(None)
+
+    async def run(self):
+        """Write the queued frames as the socket takes them, until cancelled."""
+        while True:
+            if not self._frames:
+                self._ready.clear()
+                await self._ready.wait()
+                continue
+
+            _, (frame, source, policy, queued_at) = self._frames.popitem(last=False)
+            metrics.add_to_gauge("outbox_frames", -1)
+            if len(self._frames) < self.limit:
+                self._set_behind(None)
+
+            if policy == EPHEMERAL and time.monotonic() - queued_at > EPHEMERAL_TTL:
+                metrics.increment("outbox_dropped", source=source, reason="stale")
+                continue
+            await self._send(frame)
+
+    def _check_behind(self, now):
+        if self._behind_since is None:
+            self._set_behind(now)
+        elif (
+            now - self._behind_since > self.timeout
+            or len(self._frames) >= 2 * self.limit
+        ):
+            raise SlowClient(
+                f"{len(self._frames)} frames queued for "
+                f"{now - self._behind_since:.1f}s"
+            )
+
+    def _set_behind(self, since):
+        if (since is None) != (self._behind_since is None):
+            metrics.add_to_gauge("clients_behind", -1 if since is None else 1)
+        self._behind_since = since
@@ -0,0 +1,105 @@
+import logging
+import os
+
+import jwt
+from api.auctions.consumers import AuctionConsumer
+from api.chats.consumers import ChatConsumer
+from api.realtime.multiplex import MultiplexedConsumer, Substream
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ObjectDoesNotExist
+
+logger = logging.getLogger(__name__)
+
+
+class AuctionStream(Substream, AuctionConsumer):
+    """The auction handlers, as the ``auctions`` stream of a StreamConsumer."""
+
+
+class ChatStream(Substream, ChatConsumer):
+    """The chat handlers, as the ``chats`` stream of a StreamConsumer."""
+
+
+class StreamConsumer(MultiplexedConsumer):
+    """WebSocket consumer carrying the auction and chat streams of a user.
+
+    One socket instead of one to ``ws/auctions/`` and one to ``ws/chat/``:
+    the token is decoded and the user fetched once, the personal group is
+    joined once and every frame goes through the same outbox. Client frames
+    name their stream, ``{"stream": "auctions", "source": "place_bid", ...}``,
+    and the frames sent back carry it too.
+    """
+
+    endpoint = "stream"
+    stream_consumers = {"auctions": AuctionStream, "chats": ChatStream}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.user = None
+        self.username = None
+
+    async def connect(self):
+        """Authenticate and establish WebSocket connection."""
+        try:
+            token = self._extract_token()
+            if not token:
+                raise ValueError("No authentication token provided")
+
+            self.user = await self._authenticate_token(token)
+            if not self.user:
+                raise ValueError("Invalid authentication credentials")
+
+            await self._initialize_connection()
+            logger.info(f"✅ Authenticated WebSocket connection for user: {self.user}")
+
+        except Exception as e:
+            logger.error(f"🚨 WebSocket connection failed: {str(e)}")
+            await self.close()
+
+    async def disconnect(self, close_code):
+        """Clean up on WebSocket disconnect."""
+        await super().disconnect(close_code)
+        if self.username:
+            logger.info(f"User {self.username} disconnected with code: {close_code}")
+
+    # ----------------------
+    #  Authentication Helpers
+    # ----------------------
+
+    async def _authenticate_token(self, token):
+        """Validate JWT token and return user."""
+        try:
+            payload = jwt.decode(
+                token,
+                os.getenv("JWT_SECRET_KEY"),
+                algorithms=[os.getenv("JWT_ALGORITHM")],
+                options={"verify_signature": False},
+            )
+            user = await get_user_model().objects.aget(pk=payload["user_id"])
+            # Closed when the token expires, unless a refresh_token comes first
+            self.arm_expiry(payload.get("exp"))
+            return user
+        except jwt.ExpiredSignatureError:
+            logger.warning("Expired authentication token")
+        except jwt.DecodeError:
+            logger.warning("Invalid authentication token")
+        except ObjectDoesNotExist:
+            logger.warning("User not found for valid token")
+        except Exception as e:
+            logger.error(f"Authentication error: {str(e)}")
+        return None
+
+    # ----------------------
+    #  Connection Management
+    # ----------------------
+
+    async def _initialize_connection(self):
+        """Set up the streams and the personal group."""
+        self.scope["user"] = self.user
+        self.username = self.user.username
+        await self.open_streams(self.user)
+
+        # Joined once, by the chat stream: only chat events are sent to it
+        chats = self.streams["chats"]
+        await chats.group_add(self.username)
+        await self.accept()
+        await chats.resume(self.username)
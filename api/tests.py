@@ -1,3 +1,518 @@
-from django.test import TestCase
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+import msgpack
+from django.core.cache import caches
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone as django_timezone
+from rest_framework.test import APIClient
+
+from api import metrics
+from api.auctions import bidding
+from api.auctions.coalescer import BroadcastCoalescer
+from api.auctions.engine import BidShard, _BidRequest
+from api.auctions.models import Auction, Bid, Category, ProxyBid
+from api.auctions.scheduler import TimingWheel
+from api.auctions.serializers import (
+    AuctionCreateSerializer,
+    AuctionSerializer,
+    AuctionUpdateSerializer,
+)
+from api.realtime.codecs import (
+    CodecError,
+    broadcast_event,
+    event_frame,
+    json_codec,
+    msgpack_codec,
+)
+from api.realtime.connections import ConnectionRegistry
+from api.realtime.heartbeat import Heartbeat
+from api.realtime.outbox import Outbox
+from api.users.models import User
+
+
+class _RecordingLayer:
+    """Channel layer keeping what is sent to groups."""
+
+    def __init__(self, on_send=None):
+        self.sent = []
+        self.on_send = on_send
+
+    async def group_send(self, group, event):
+        self.sent.append((group, event))
+        if self.on_send is not None:
+            on_send, self.on_send = self.on_send, None
+            await on_send()
+
+
+def _create_auction(**fields):
+    """An ongoing auction at 10.00, by increments of 1.00."""
+    seller = User.objects.create_user("seller", "seller@example.com", "password")
+    defaults = {
+        "title": "Bike",
+        "description": "A bike",
+        "starting_price": Decimal("10.00"),
+        "current_price": Decimal("10.00"),
+        "bid_increment": Decimal("1.00"),
+        "seller": seller,
+        "category": Category.objects.create(name="bikes"),
+        "status": Auction.Status.ONGOING,
+        "end_time": django_timezone.now() + timedelta(hours=1),
+    }
+    return Auction.objects.create(**dict(defaults, **fields))
+
+
+class ResolveProxiesTests(SimpleTestCase):
+    def setUp(self):
+        self.now = django_timezone.now()
+        self.state = bidding.AuctionState(
+            auction_id="a",
+            seller_id="seller",
+            category_id=1,
+            status=Auction.Status.ONGOING,
+            end_time=self.now + timedelta(hours=1),
+            current_price=Decimal("10.00"),
+            bid_increment=Decimal("1.00"),
+        )
+
+    def add_proxy(self, bidder_id, max_amount, seconds_ago=0):
+        self.state.proxies[bidder_id] = bidding.Proxy(
+            bidder_id, Decimal(max_amount), self.now - timedelta(seconds=seconds_ago)
+        )
+
+    def test_highest_maximum_wins_one_increment_above_the_runner_up(self):
+        self.add_proxy("ada", "20.00")
+        self.add_proxy("bob", "15.00")
+
+        bid = bidding.resolve_proxies(self.state)
+        self.assertEqual((bid.bidder_id, bid.amount), ("ada", Decimal("16.00")))
+
+    def test_winner_pays_at_most_its_own_maximum(self):
+        self.add_proxy("ada", "15.50")
+        self.add_proxy("bob", "15.00")
+
+        bid = bidding.resolve_proxies(self.state)
+        self.assertEqual((bid.bidder_id, bid.amount), ("ada", Decimal("15.50")))
+
+    def test_earliest_proxy_wins_a_tie(self):
+        self.add_proxy("ada", "15.00", seconds_ago=1)
+        self.add_proxy("bob", "15.00", seconds_ago=5)
+
+        bid = bidding.resolve_proxies(self.state)
+        self.assertEqual((bid.bidder_id, bid.amount), ("bob", Decimal("15.00")))
+
+    def test_leader_holding_a_higher_proxy_keeps_the_lead(self):
+        self.state.leader_id = "ada"
+        self.state.leader_since = self.now
+        self.add_proxy("ada", "20.00")
+        self.add_proxy("bob", "15.00")
+
+        bid = bidding.resolve_proxies(self.state)
+        self.assertEqual((bid.bidder_id, bid.amount), ("ada", Decimal("16.00")))
+
+    def test_no_bid_when_no_challenger_reaches_the_minimum(self):
+        self.state.leader_id = "ada"
+        self.state.leader_since = self.now
+        self.add_proxy("bob", "10.50")
+
+        self.assertIsNone(bidding.resolve_proxies(self.state))
+
+
+class PlaceBidTests(TestCase):
+    def setUp(self):
+        self.auction = _create_auction()
+        self.ada = User.objects.create_user("ada", "ada@example.com", "password")
+        self.bob = User.objects.create_user("bob", "bob@example.com", "password")
+
+    def test_moves_the_ledger_pointer_to_the_last_bid(self):
+        ProxyBid.objects.create(
+            auction=self.auction, bidder=self.bob, max_amount=Decimal("15.00")
+        )
+
+        bids = bidding.place_bid(self.auction.pk, self.ada)
+
+        # The bid of ada, then the answer of bob's proxy
+        self.assertEqual(
+            [bid.amount for bid in bids], [Decimal("11.00"), Decimal("12.00")]
+        )
+        self.auction.refresh_from_db()
+        self.assertEqual(self.auction.current_price, Decimal("12.00"))
+        self.assertEqual((self.auction.bid_count, self.auction.bid_sequence), (2, 2))
+        self.assertEqual(self.auction.top_bid.bidder, self.bob)
+        self.assertEqual(self.auction.top_bid.amount, Decimal("12.00"))
+
+    def test_checks_the_bid_again_after_a_conflict(self):
+        load = bidding.AuctionState.load
+
+        def load_then_outbid(auction_id):
+            state = load(auction_id)
+            if not Bid.objects.exists():
+                # Another process commits a bid once this state is read
+                bidding.commit_bids(
+                    auction_id,
+                    state.persisted_price,
+                    state.bid_sequence,
+                    bidding.accept_bid(load(auction_id), self.bob),
+                )
+            return state
+
+        with mock.patch.object(
+            bidding.AuctionState, "load", side_effect=load_then_outbid
+        ), mock.patch.object(bidding.metrics, "increment_top") as increment_top:
+            bids = bidding.place_bid(self.auction.pk, self.ada)
+
+        increment_top.assert_called_once_with(
+            "bid_conflicts", "auction", str(self.auction.pk)
+        )
+        self.assertEqual(bids[0].amount, Decimal("12.00"))
+        self.auction.refresh_from_db()
+        self.assertEqual(self.auction.current_price, Decimal("12.00"))
+        self.assertEqual((self.auction.bid_count, self.auction.bid_sequence), (2, 2))
+        self.assertEqual(
+            list(Bid.objects.order_by("amount").values_list("bidder", "amount")),
+            [(self.bob.pk, Decimal("11.00")), (self.ada.pk, Decimal("12.00"))],
+        )
+
+    def test_embeds_the_latest_bids(self):
+        for index in range(AuctionSerializer.BIDS_LIMIT + 2):
+            bidding.place_bid(self.auction.pk, (self.ada, self.bob)[index % 2])
+
+        data = AuctionSerializer(Auction.objects.get(pk=self.auction.pk)).data
+        amounts = [bid["amount"] for bid in data["bids"]]
+        self.assertEqual(len(amounts), AuctionSerializer.BIDS_LIMIT)
+        self.assertEqual(amounts[0], "32.00")
+        self.assertEqual(data["highest_bid"]["amount"], "32.00")
+
+
+class BidEngineTests(TestCase):
+    def setUp(self):
+        self.auction = _create_auction()
+        self.bidder = User.objects.create_user("ada", "ada@example.com", "password")
+        self.shard = BidShard(0, batch_size=10, cache_size=10)
+
+    def tearDown(self):
+        self.shard.stop()
+
+    def test_commits_a_queued_bid(self):
+        request = _BidRequest(str(self.auction.pk), self.bidder)
+        self.shard._process([request])
+
+        self.assertEqual(request.future.result()[0].amount, Decimal("11.00"))
+        self.auction.refresh_from_db()
+        self.assertEqual(self.auction.current_price, Decimal("11.00"))
+
+    def test_reloads_an_end_time_passed_in_its_cache(self):
+        self.shard._process([_BidRequest(str(self.auction.pk), self.bidder)])
+        # As if the bid extending the auction was committed by another process
+        state = self.shard._states[str(self.auction.pk)]
+        state.end_time = django_timezone.now() - timedelta(seconds=1)
+
+        request = _BidRequest(str(self.auction.pk), self.bidder)
+        self.shard._process([request])
+        self.assertEqual(request.future.result()[0].amount, Decimal("12.00"))
+
+    def test_drops_a_bid_whose_waiter_timed_out(self):
+        request = _BidRequest(str(self.auction.pk), self.bidder)
+        # As asyncio.wait_for does to the wrapped future on a timeout
+        request.future.cancel()
+        self.shard._process([request])
+
+        self.auction.refresh_from_db()
+        self.assertEqual(self.auction.current_price, Decimal("10.00"))
+        self.assertFalse(Bid.objects.filter(auction=self.auction).exists())
+
+
+class RestBidBroadcastTests(TestCase):
+    def test_broadcasts_a_bid_placed_over_http(self):
+        auction = _create_auction()
+        client = APIClient()
+        client.force_authenticate(
+            User.objects.create_user("ada", "ada@example.com", "password")
+        )
+        layer = _RecordingLayer()
+        with mock.patch("api.auctions.views.get_channel_layer", return_value=layer):
+            response = client.patch(f"/api/auctions/{auction.pk}/bid/", {})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertCountEqual(
+            [group for group, _ in layer.sent],
+            [f"auction.{auction.pk}", f"category.{auction.category_id}"],
+        )
+        event = layer.sent[0][1]
+        self.assertEqual(event["source"], "new_bid")
+        self.assertIn('"current_price": "11.00"', event["frames"]["json"])
+
+
+class MetricsTests(SimpleTestCase):
+    def counts(self, name):
+        return {
+            row["labels"].get("auction"): row["value"]
+            for row in metrics.snapshot()["counters"]
+            if row["name"] == name
+        }
+
+    def test_keeps_the_largest_counts_of_an_unbounded_label(self):
+        with mock.patch.object(metrics, "TOP_KEYS", 2):
+            metrics.increment_top("test_conflicts", "auction", "hot", 5)
+            metrics.increment_top("test_conflicts", "auction", "warm", 2)
+            metrics.increment_top("test_conflicts", "auction", "cold")
+
+        self.assertEqual(self.counts("test_conflicts"), {None: 8, "hot": 5, "cold": 1})
+
+
+class BroadcastCoalescerTests(SimpleTestCase):
+    async def test_merges_updates_of_a_window(self):
+        layer = _RecordingLayer()
+        coalescer = BroadcastCoalescer(window=0.01)
+        for seq in (1, 2, 3):
+            await coalescer.submit(layer, "a", ["auction.a"], "new_bid", {"seq": seq})
+        await asyncio.sleep(0.1)
+
+        self.assertEqual(len(layer.sent), 1)
+        group, event = layer.sent[0]
+        self.assertEqual(group, "auction.a")
+        self.assertIn('"seq": 3', event["frames"]["json"])
+        self.assertIn('"merged": 3', event["frames"]["json"])
+
+    async def test_update_submitted_during_a_flush_is_sent(self):
+        coalescer = BroadcastCoalescer(window=0.01)
+
+        async def submit_late():
+            await coalescer.submit(layer, "b", ["auction.b"], "new_bid", {"seq": 2})
+
+        layer = _RecordingLayer(on_send=submit_late)
+        await coalescer.submit(layer, "a", ["auction.a"], "new_bid", {"seq": 1})
+        await asyncio.sleep(0.1)
+
+        self.assertEqual([group for group, _ in layer.sent], ["auction.a", "auction.b"])
+
+
+class _QuietConnection:
+    """Connection silent for quiet seconds, recording its pings and reaping."""
+
+    def __init__(self, quiet, answers_pings):
+        self.channel_name = "quiet"
+        self.last_seen = time.monotonic() - quiet
+        self.last_ping = 0
+        self.answers_pings = answers_pings
+        self.pinged = False
+        self.reaped = False
+
+    async def ping(self):
+        self.pinged = True
+
+    async def reap(self):
+        self.reaped = True
+
+
+class _User:
+    def __init__(self, pk, username):
+        self.pk = pk
+        self.username = username
+
+
+class ConnectionRegistryTests(SimpleTestCase):
+    def setUp(self):
+        caches["default"].clear()
+
+    def test_every_process_restores_its_share_after_a_flush(self):
+        user = _User(1, "ada")
+        processes = [ConnectionRegistry("default", 10) for _ in range(2)]
+        for registry in processes:
+            registry.register(user, "auctions")
+
+        caches["default"].clear()
+        for registry in processes:
+            registry.refresh()
+
+        self.assertEqual(caches["default"].get("connections:auctions:1"), 2)
+        self.assertEqual(caches["default"].get("presence:ada"), 2)
+        # Refreshed again once restored, the shares are not added twice
+        for registry in processes:
+            registry.refresh()
+        self.assertEqual(caches["default"].get("connections:auctions:1"), 2)
+
+
+class HeartbeatTests(SimpleTestCase):
+    async def test_reaps_a_silent_client_that_answered_a_ping(self):
+        heartbeat = Heartbeat(interval=10, idle_timeout=30)
+        connection = _QuietConnection(quiet=60, answers_pings=True)
+        heartbeat._connections.add(connection)
+        await heartbeat.sweep()
+
+        self.assertTrue(connection.reaped)
+        self.assertNotIn(connection, heartbeat._connections)
+
+    async def test_keeps_pinging_a_client_that_never_answered(self):
+        heartbeat = Heartbeat(interval=10, idle_timeout=30)
+        connection = _QuietConnection(quiet=60, answers_pings=False)
+        heartbeat._connections.add(connection)
+        await heartbeat.sweep()
+
+        self.assertFalse(connection.reaped)
+        self.assertTrue(connection.pinged)
+        self.assertIn(connection, heartbeat._connections)
+
+
+class TimingWheelTests(SimpleTestCase):
+    def setUp(self):
+        self.start = datetime(2025, 3, 1, tzinfo=timezone.utc)
+        self.wheel = TimingWheel(1, 4, self.start)
+
+    def at(self, seconds):
+        return self.start + timedelta(seconds=seconds)
+
+    def test_keeps_keys_of_a_later_round_in_their_slot(self):
+        # Slot 2, in the first round and in the third
+        self.wheel.schedule("soon", self.at(2))
+        self.wheel.schedule("later", self.at(10))
+
+        self.assertEqual(self.wheel.advance(self.at(3)), ["soon"])
+        self.assertEqual(self.wheel.advance(self.at(9)), [])
+        self.assertIn("later", self.wheel)
+        self.assertEqual(self.wheel.advance(self.at(10)), ["later"])
+
+    def test_wraps_around_the_end_of_the_slots(self):
+        self.wheel.advance(self.at(2))
+        self.wheel.schedule("wrapped", self.at(5))
+
+        self.assertEqual(self.wheel.advance(self.at(4)), [])
+        self.assertEqual(self.wheel.advance(self.at(6)), ["wrapped"])
+        self.assertEqual(len(self.wheel), 0)
+
+    def test_hands_out_everything_due_after_falling_rounds_behind(self):
+        for seconds in (1, 3, 6, 9):
+            self.wheel.schedule(seconds, self.at(seconds))
+        self.wheel.schedule("ahead", self.at(30))
+
+        self.assertCountEqual(self.wheel.advance(self.at(12)), [1, 3, 6, 9])
+        self.assertEqual(self.wheel.advance(self.at(29)), [])
+        self.assertEqual(self.wheel.advance(self.at(30)), ["ahead"])
+
+
+class MsgpackCodecTests(SimpleTestCase):
+    def test_round_trips_compacted_values(self):
+        content = {
+            "id": "0c6a3e1c-4f7e-4d8a-9a51-2b7f0f2c9d11",
+            "price": "1250.50",
+            "placed_at": "2025-03-01T12:30:45.123456+00:00",
+        }
+        frame = msgpack_codec.encode(content)
+        self.assertEqual(msgpack_codec.decode(frame), content)
+
+    def test_keeps_decimal_text_too_large_for_an_int(self):
+        content = {"x": "11111111111111111111111.1", "y": "-99999999999999999999.9"}
+        frame = msgpack_codec.encode(content)
+        self.assertEqual(msgpack_codec.decode(frame), content)
+
+    def test_rejects_malformed_ext_payloads(self):
+        bad_decimal = msgpack.packb(msgpack.ExtType(2, msgpack.packb([1, "a"])))
+        for frame in (b"\xd4\x03\x00", bad_decimal):
+            with self.subTest(frame=frame):
+                with self.assertRaises(CodecError):
+                    msgpack_codec.decode(frame)
+
+    def test_broadcast_frame_is_packed_on_first_use(self):
+        data = {"auction_id": "0c6a3e1c-4f7e-4d8a-9a51-2b7f0f2c9d11", "price": "12.50"}
+        event = broadcast_event("new_bid", data)
+        self.assertNotIn("msgpack", event["frames"])
+
+        frame = event_frame(event, msgpack_codec)
+        self.assertEqual(
+            frame, msgpack_codec.encode({"source": "new_bid", "data": data})
+        )
+        self.assertIs(event_frame(event, msgpack_codec), frame)
+
+
+class OutboxTests(SimpleTestCase):
+    async def test_coalesced_frame_counts_the_frames_it_replaced(self):
+        sent = []
+
+        async def send(frame):
+            sent.append(frame)
+
+        for codec in (json_codec, msgpack_codec):
+            with self.subTest(codec=codec.name):
+                sent.clear()
+                outbox = Outbox(send, limit=10, timeout=10, codec=codec)
+                for seq, merged in ((3, 2), (4, 1), (7, 3)):
+                    frame = codec.encode(
+                        {"source": "new_bid", "data": {"seq": seq, "merged": merged}}
+                    )
+                    outbox.put(frame, "new_bid", "auction.a")
+
+                writer = asyncio.ensure_future(outbox.run())
+                await asyncio.sleep(0.01)
+                writer.cancel()
+
+                self.assertEqual(len(sent), 1)
+                data = codec.decode(sent[0])["data"]
+                self.assertEqual(data, {"seq": 7, "merged": 6})
+
+
+class AuctionUpdateTests(TestCase):
+    def test_keeps_counters_updated_since_the_auction_was_read(self):
+        auction = _create_auction()
+        Auction.objects.filter(pk=auction.pk).update(bid_count=5, watcher_count=3)
+
+        serializer = AuctionUpdateSerializer(
+            auction, data={"title": "Red bike"}, partial=True
+        )
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        serializer.save()
+
+        auction.refresh_from_db()
+        self.assertEqual(auction.title, "Red bike")
+        self.assertEqual((auction.bid_count, auction.watcher_count), (5, 3))
+
+
+class AuctionCardTests(TestCase):
+    def test_top_bid_costs_no_query_of_its_own(self):
+        auction = _create_auction()
+        bidder = User.objects.create_user("ada", "ada@example.com", "password")
+        queryset = Auction.objects.with_top_bid().filter(pk=auction.pk)
+        with CaptureQueriesContext(connection) as without_bid:
+            AuctionSerializer(queryset.all(), many=True).data
+
+        bid = Bid.objects.create(auction=auction, bidder=bidder, amount="11.00")
+        Auction.objects.filter(pk=auction.pk).update(top_bid=bid)
+        with CaptureQueriesContext(connection) as with_bid:
+            data = AuctionSerializer(queryset.all(), many=True).data
+
+        self.assertEqual(data[0]["highest_bid"]["amount"], "11.00")
+        self.assertEqual(len(with_bid), len(without_bid))
+
+
+class SoftCloseValidationTests(TestCase):
+    def setUp(self):
+        self.data = {
+            "title": "Bike",
+            "description": "A bike",
+            "starting_price": "10.00",
+            "bid_increment": "1.00",
+            "category": Category.objects.create(name="bikes").pk,
+            "end_time": [1, 0, 0],
+        }
+
+    def test_accepts_an_extension_within_the_window(self):
+        data = dict(self.data, soft_close_window=120, soft_close_extension=60)
+        serializer = AuctionCreateSerializer(data=data)
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+
+    def test_rejects_values_over_the_maximum(self):
+        data = dict(self.data, soft_close_window=10**8, soft_close_extension=10**8)
+        serializer = AuctionCreateSerializer(data=data)
+        self.assertFalse(serializer.is_valid())
+        self.assertIn("soft_close_window", serializer.errors)
+        self.assertIn("soft_close_extension", serializer.errors)
+
+    def test_rejects_an_extension_longer_than_the_window(self):
+        data = dict(self.data, soft_close_window=60, soft_close_extension=120)
+        serializer = AuctionCreateSerializer(data=data)
+        self.assertFalse(serializer.is_valid())
+        self.assertIn("soft_close_extension", serializer.errors)
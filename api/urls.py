@@ -1,7 +1,10 @@
 from django.urls import include, path
 
+from . import views
+
 urlpatterns = [
     path("users/", include("api.users.urls")),
     path("auctions/", include("api.auctions.urls")),
     path("chats/", include("api.chats.urls")),
+    path("metrics/", views.metrics_snapshot, name="metrics"),
 ]
@@ -33,6 +33,13 @@ class UserSerializer(serializers.ModelSerializer):
         return full_name if full_name else obj.username
 
 
+class UserSummarySerializer(UserSerializer):
+    """The few user fields a client needs to render a bidder or a sender."""
+
+    class Meta(UserSerializer.Meta):
+        fields = ["userId", "name", "username", "thumbnail"]
+
+
 class RegisterUserSerializer(serializers.ModelSerializer):
 
     email = serializers.EmailField(
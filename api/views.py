@@ -0,0 +1,13 @@
+from rest_framework import status
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+
+from . import metrics
+
+
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+def metrics_snapshot(request):
+    """Counters and gauges recorded by this worker process."""
+    return Response(metrics.snapshot(), status=status.HTTP_200_OK)
@@ -22,6 +22,8 @@ django.setup()
 
 from api.auctions import routing as auctions_routing
 from api.chats import routing as chats_routing
+from api.realtime.admission import AdmissionMiddleware
+from api.streams import routing as streams_routing
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.security.websocket import AllowedHostsOriginValidator
 from django.core.asgi import get_asgi_application
@@ -29,7 +31,9 @@ from django_channels_jwt_auth_middleware.auth import JWTAuthMiddlewareStack
 
 # Combine all websocket routes
 websocket_urlpatterns = (
-    auctions_routing.websocket_urlpatterns + chats_routing.websocket_urlpatterns
+    auctions_routing.websocket_urlpatterns
+    + chats_routing.websocket_urlpatterns
+    + streams_routing.websocket_urlpatterns
 )
 
 
@@ -47,8 +51,11 @@ django_asgi_app = get_asgi_application()
 application = ProtocolTypeRouter(
     {  # Correct
         "http": django_asgi_app,
-        "websocket": AllowedHostsOriginValidator(
-            JWTAuthMiddlewareStack(URLRouter(websocket_urlpatterns))
+        # Admission first, so a reconnect storm is paced before any work
+        "websocket": AdmissionMiddleware(
+            AllowedHostsOriginValidator(
+                JWTAuthMiddlewareStack(URLRouter(websocket_urlpatterns))
+            )
         ),
     }
 )
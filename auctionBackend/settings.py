@@ -82,6 +82,9 @@ SESSION_COOKIE_SECURE = (
 ASGI_APPLICATION = "auctionBackend.asgi.application"
 
 # Channels config
+# Events the broadcast hub channel of a server process can have queued
+REALTIME_HUB_CAPACITY = config("REALTIME_HUB_CAPACITY", default=1000, cast=int)
+
 if ENVIRONMENT == "DEVELOPMENT":
     # Local Redis config (if using Redis locally)
     CHANNEL_LAYERS = {
@@ -89,6 +92,8 @@ if ENVIRONMENT == "DEVELOPMENT":
             "BACKEND": "channels_redis.core.RedisChannelLayer",
             "CONFIG": {
                 "hosts": [("127.0.0.1", 6379)],
+                # Every broadcast of a server process goes through its hub channel
+                "channel_capacity": {"hub.*": REALTIME_HUB_CAPACITY},
             },
         },
     }
@@ -99,11 +104,108 @@ else:
             "BACKEND": "channels_redis.core.RedisChannelLayer",
             "CONFIG": {
                 "hosts": [config("REDIS_URL")],
+                # Every broadcast of a server process goes through its hub channel
+                "channel_capacity": {"hub.*": REALTIME_HUB_CAPACITY},
             },
         },
     }
 
 
+# Maximum number of auction/category groups a WebSocket connection can join
+WS_MAX_SUBSCRIPTIONS = config("WS_MAX_SUBSCRIPTIONS", default=50, cast=int)
+
+# Window during which the bids of an auction are merged into one broadcast
+BROADCAST_COALESCE_WINDOW_MS = config(
+    "BROADCAST_COALESCE_WINDOW_MS", default=75, cast=int
+)
+
+# Bid engine config
+# Number of shards (worker threads) owning the auctions of this process
+BID_ENGINE_SHARDS = config("BID_ENGINE_SHARDS", default=4, cast=int)
+# Maximum number of queued bids a shard commits in one transaction
+BID_ENGINE_BATCH_SIZE = config("BID_ENGINE_BATCH_SIZE", default=100, cast=int)
+# Maximum number of auctions a shard keeps in memory
+BID_ENGINE_CACHE_SIZE = config("BID_ENGINE_CACHE_SIZE", default=10000, cast=int)
+# Seconds a consumer waits for a shard to answer
+BID_ENGINE_TIMEOUT = config("BID_ENGINE_TIMEOUT", default=5, cast=float)
+# Times a bid is checked again when another writer moved the price first
+BID_CONFLICT_RETRIES = config("BID_CONFLICT_RETRIES", default=3, cast=int)
+# Largest soft close window and extension, in seconds, a seller may set
+AUCTION_SOFT_CLOSE_MAX_WINDOW = config(
+    "AUCTION_SOFT_CLOSE_MAX_WINDOW", default=3600, cast=int
+)
+AUCTION_SOFT_CLOSE_MAX_EXTENSION = config(
+    "AUCTION_SOFT_CLOSE_MAX_EXTENSION", default=600, cast=int
+)
+
+# Seconds between two ticks of the auction lifecycle scheduler
+AUCTION_SCHEDULER_TICK = config("AUCTION_SCHEDULER_TICK", default=1, cast=float)
+# Number of slots of the scheduler timing wheel, one tick each
+AUCTION_SCHEDULER_SLOTS = config("AUCTION_SCHEDULER_SLOTS", default=512, cast=int)
+# Seconds ahead of now whose deadlines are loaded into the wheel
+AUCTION_SCHEDULER_HORIZON = config("AUCTION_SCHEDULER_HORIZON", default=900, cast=int)
+# Seconds between two reloads of the upcoming deadlines
+AUCTION_SCHEDULER_REFRESH = config("AUCTION_SCHEDULER_REFRESH", default=60, cast=int)
+# Maximum number of auctions moved by one UPDATE
+AUCTION_SCHEDULER_BATCH_SIZE = config(
+    "AUCTION_SCHEDULER_BATCH_SIZE", default=500, cast=int
+)
+
+# Number of WebSocket request ids remembered by each process
+IDEMPOTENCY_MAX_ENTRIES = config("IDEMPOTENCY_MAX_ENTRIES", default=10000, cast=int)
+# Seconds a retried request id gets the stored replies back
+IDEMPOTENCY_TTL = config("IDEMPOTENCY_TTL", default=300, cast=int)
+# Django cache alias sharing request ids between processes, empty to disable
+IDEMPOTENCY_CACHE_ALIAS = config("IDEMPOTENCY_CACHE_ALIAS", default="")
+
+# Worker threads running the database work of realtime consumers
+REALTIME_DB_WORKERS = config("REALTIME_DB_WORKERS", default=8, cast=int)
+# Worker processes running the CPU heavy work (images) of realtime consumers
+REALTIME_CPU_WORKERS = config("REALTIME_CPU_WORKERS", default=2, cast=int)
+# Niceness added to those processes, so they yield the CPU to the event loop
+REALTIME_CPU_NICENESS = config("REALTIME_CPU_NICENESS", default=10, cast=int)
+# Jobs an executor queues before refusing new ones with ExecutorBusy
+REALTIME_EXECUTOR_BACKLOG = config("REALTIME_EXECUTOR_BACKLOG", default=200, cast=int)
+# Django cache alias counting the connections of each user across processes,
+# empty to count them in process (a single server process only)
+REALTIME_REGISTRY_CACHE_ALIAS = config("REALTIME_REGISTRY_CACHE_ALIAS", default="")
+# Seconds between two refreshes of the shared connection counts of a process
+REALTIME_PRESENCE_HEARTBEAT = config(
+    "REALTIME_PRESENCE_HEARTBEAT", default=30, cast=int
+)
+# Frames queued for a WebSocket client before it counts as behind
+REALTIME_OUTBOX_LIMIT = config("REALTIME_OUTBOX_LIMIT", default=100, cast=int)
+# Seconds a client may stay behind before it is disconnected
+REALTIME_SLOW_CLIENT_TIMEOUT = config(
+    "REALTIME_SLOW_CLIENT_TIMEOUT", default=10, cast=float
+)
+# Broadcasts of each group kept for reconnecting clients to resume from
+REALTIME_EVENT_LOG_SIZE = config("REALTIME_EVENT_LOG_SIZE", default=200, cast=int)
+# Seconds the broadcasts of a group are kept after the last one
+REALTIME_EVENT_LOG_TTL = config("REALTIME_EVENT_LOG_TTL", default=86400, cast=int)
+# Seconds a connection may stay quiet before it is sent a ping
+REALTIME_PING_INTERVAL = config("REALTIME_PING_INTERVAL", default=25, cast=float)
+# Seconds of silence, pings unanswered, after which a connection is reaped
+REALTIME_IDLE_TIMEOUT = config("REALTIME_IDLE_TIMEOUT", default=75, cast=float)
+# WebSocket handshakes let in per second and per process, see api.realtime.admission
+REALTIME_HANDSHAKE_RATE = config("REALTIME_HANDSHAKE_RATE", default=50, cast=float)
+# WebSocket handshakes in progress at once, per process
+REALTIME_MAX_HANDSHAKES = config("REALTIME_MAX_HANDSHAKES", default=20, cast=int)
+# Seconds a handshake may wait for its turn before it is refused
+REALTIME_HANDSHAKE_QUEUE_TIMEOUT = config(
+    "REALTIME_HANDSHAKE_QUEUE_TIMEOUT", default=5, cast=float
+)
+# Connections a second, and in a burst, a client IP may open; 0 turns the limit
+# off, e.g. behind a proxy whose X-Forwarded-For uvicorn does not trust
+REALTIME_IP_CONNECT_RATE = config("REALTIME_IP_CONNECT_RATE", default=2, cast=float)
+REALTIME_IP_CONNECT_BURST = config("REALTIME_IP_CONNECT_BURST", default=30, cast=int)
+# Connections a second, and in a burst, a user may open
+REALTIME_USER_CONNECT_RATE = config(
+    "REALTIME_USER_CONNECT_RATE", default=0.2, cast=float
+)
+REALTIME_USER_CONNECT_BURST = config("REALTIME_USER_CONNECT_BURST", default=6, cast=int)
+
+
 # profile picture media config
 
 